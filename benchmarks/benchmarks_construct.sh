@@ -29,3 +29,29 @@ for ((i=0; i<$NREPEATS; i++)); do
     fastsubtrees tree --force $TREE \
                       --ncbi $NTDUMPSDIR/nodes.dmp
 done
+
+# construction from compressed input files
+COMPRESSED_DIR=$(mktemp -d)
+for FORMAT in gz bz2 xz zst; do
+  case $FORMAT in
+    gz) COMPRESS="gzip -c" ;;
+    bz2) COMPRESS="bzip2 -c" ;;
+    xz) COMPRESS="xz -c" ;;
+    zst) COMPRESS="zstd -q -c" ;;
+  esac
+  if ! command -v ${COMPRESS%% *} &> /dev/null; then
+    echo "Skipping $FORMAT input (${COMPRESS%% *} not found)"
+    continue
+  fi
+  NODES=$COMPRESSED_DIR/nodes.dmp.$FORMAT
+  $COMPRESS $NTDUMPSDIR/nodes.dmp > $NODES
+  for ((i=0; i<$NREPEATS; i++)); do
+    STEP="construct-$FORMAT"
+    ROOT=""
+    echo "Step $STEP, iteration $i..."
+    rm -f nt.tree
+    /usr/bin/time -f "$STEP\t$ROOT\t$i\t%U\t%S\t%e\t%M" -o $OUTFILE -a \
+      fastsubtrees tree --force $TREE --ncbi $NODES
+  done
+done
+rm -rf $COMPRESSED_DIR
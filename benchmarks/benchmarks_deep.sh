@@ -0,0 +1,47 @@
+#!/bin/bash
+#
+# Benchmarks the construction of deep (chain-shaped) trees, for which
+# the running time of the subtree sizes computation depends on the depth
+# of the tree, unless it is linear in the number of nodes
+#
+
+if [ $# -ne 1 ]; then
+    echo "Usage: $0 <workdir>"
+    echo "where <workdir> is the directory where the generated trees are"
+    echo "written"
+    exit 1
+fi
+WORKDIR=$1
+
+SCRIPT_DIR=$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )
+FST_DIR=$SCRIPT_DIR/..
+GENERATOR=$FST_DIR/tests/generate_random_tree.py
+
+source $SCRIPT_DIR/benchmarks_params.sh
+OUTFILE=${OUTFILE_PFX}_deep.tsv
+rm -f $OUTFILE
+mkdir -p $WORKDIR
+
+DEEP_TREE_SIZES="10000 100000 1000000"
+DEEP_TREE_ENGINES="python numpy auto"
+DEEP_TREE_PROCESSES="1 4"
+
+for N in $DEEP_TREE_SIZES; do
+  $GENERATOR --chain $N > $WORKDIR/chain.$N.tsv
+  $GENERATOR --chain --reverse $N > $WORKDIR/rchain.$N.tsv
+  $GENERATOR --window 10 $N > $WORKDIR/deep.$N.tsv
+  for SHAPE in chain rchain deep; do
+    for ENGINE in $DEEP_TREE_ENGINES; do
+      for P in $DEEP_TREE_PROCESSES; do
+        for ((i=0; i<$NREPEATS; i++)); do
+          STEP="$SHAPE.$ENGINE.$P"
+          echo "Step $STEP, size $N, iteration $i..."
+          /usr/bin/time -f "$STEP\t$N\t$i\t%U\t%S\t%e\t%M" -o $OUTFILE -a \
+            fastsubtrees tree --force --quiet $WORKDIR/$SHAPE.$N.tree \
+                              $WORKDIR/$SHAPE.$N.tsv \
+                              --engine $ENGINE --processes $P
+        done
+      done
+    done
+  done
+done
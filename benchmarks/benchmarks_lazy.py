@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Compare the startup time and number of bytes read from the tree file
+for a query-only workload, loading the tree completely or lazily.
+
+For each mode, the tree is loaded and the IDs of the subtrees of the given
+nodes are extracted; the bytes read are counted using /proc/self/io (Linux).
+
+Usage:
+  ./benchmarks_lazy.py <tree> <node>...
+
+Output:
+  tab-separated: mode, startup time (s), query time (s), bytes read
+"""
+
+import time
+from docopt import docopt
+from fastsubtrees import Tree, logger
+
+def bytes_read():
+  with open("/proc/self/io") as f:
+    for line in f:
+      if line.startswith("rchar:"):
+        return int(line.split()[1])
+
+def benchmark(treefile, nodes, lazy):
+  rchar = bytes_read()
+  start = time.perf_counter()
+  tree = Tree.from_file(treefile, lazy=lazy)
+  loaded = time.perf_counter()
+  for node in nodes:
+    tree.subtree_ids(node)
+  queried = time.perf_counter()
+  return loaded - start, queried - loaded, bytes_read() - rchar
+
+def main(args):
+  logger.remove()
+  nodes = [int(node) for node in args["<node>"]]
+  print("# mode\tstartup_time\tquery_time\tbytes_read")
+  for mode, lazy in [("full", False), ("lazy", True)]:
+    startup, query, nbytes = benchmark(args["<tree>"], nodes, lazy)
+    print(f"{mode}\t{startup:.4f}\t{query:.4f}\t{nbytes}")
+
+if __name__ == "__main__":
+  main(docopt(__doc__))
@@ -0,0 +1,33 @@
+#!/bin/bash
+#
+# Benchmarks the parallel construction of the tree data files for fastsubtrees,
+# using an increasing number of processes
+#
+
+if [ $# -ne 2 ]; then
+    echo "Usage: $0 <tree> <ntdumpsdir>"
+    echo "where <ntdumpsdir> is the directory containing the NCBI taxonomy"
+    echo "dump files to be used for the tree construction"
+    exit 1
+fi
+TREE=$1
+NTDUMPSDIR=$2
+
+SCRIPT_DIR=$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )
+
+source $SCRIPT_DIR/benchmarks_params.sh
+OUTFILE=${OUTFILE_PFX}_parallel.tsv
+rm -f $OUTFILE
+
+PROCESSES="1 2 4 8 16"
+
+for P in $PROCESSES; do
+  for ((i=0; i<$NREPEATS; i++)); do
+    STEP="construct"
+    echo "Step $STEP, $P processes, iteration $i..."
+    rm -f $TREE
+    /usr/bin/time -f "$STEP\t$P\t$i\t%U\t%S\t%e\t%M" -o $OUTFILE -a \
+      fastsubtrees tree --force $TREE --engine python --processes $P \
+                        --ncbi $NTDUMPSDIR/nodes.dmp
+  done
+done
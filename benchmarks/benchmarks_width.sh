@@ -0,0 +1,43 @@
+#!/bin/bash
+#
+# Benchmarks the memory usage and file size of trees using 32-bit and 64-bit
+# arrays, for the construction from NCBI taxonomy and the subtree queries
+#
+
+if [ $# -ne 2 ]; then
+    echo "Usage: $0 <tree> <ntdumpsdir>"
+    echo "where <ntdumpsdir> is the directory containing the NCBI taxonomy"
+    echo "dump files to be used for the tree construction"
+    exit 1
+fi
+TREE=$1
+NTDUMPSDIR=$2
+
+SCRIPT_DIR=$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )
+
+source $SCRIPT_DIR/benchmarks_params.sh
+OUTFILE=${OUTFILE_PFX}_width.tsv
+SIZESFILE=${OUTFILE_PFX}_width_filesizes.tsv
+rm -f $OUTFILE $SIZESFILE
+mkdir -p $OUTDIR
+
+for WIDTH in 64 32; do
+  WTREE=$TREE.$WIDTH
+  for ((i=0; i<$NREPEATS; i++)); do
+    STEP="construct-$WIDTH"
+    ROOT=""
+    echo "Step $STEP, iteration $i..."
+    rm -f $WTREE
+    /usr/bin/time -f "$STEP\t$ROOT\t$i\t%U\t%S\t%e\t%M" -o $OUTFILE -a \
+      fastsubtrees tree --force $WTREE --width $WIDTH \
+                        --ncbi $NTDUMPSDIR/nodes.dmp
+    STEP="extract-$WIDTH"
+    for ROOT in $NODES; do
+      echo "Step $STEP from node $ROOT, iteration $i..."
+      /usr/bin/time -f "$STEP\t$ROOT\t$i\t%U\t%S\t%e\t%M" -o $OUTFILE -a \
+        fastsubtrees query $WTREE $ROOT > \
+          $OUTDIR/fastsubtrees.subtree.$WIDTH.$ROOT
+    done
+  done
+  echo -e "$WIDTH\t$(stat -c %s $WTREE)" >> $SIZESFILE
+done
@@ -0,0 +1,333 @@
+"""
+Precomputed aggregates of the values of numeric attributes in subtrees
+(requires NumPy).
+
+Since each subtree is a contiguous range of positions of treedata,
+aggregates of the values of an attribute in a subtree can be computed
+in constant time from an index over the attribute column (see the columns
+module):
+
+- prefix sums over the positions of treedata of the number of values,
+  of their sum and of the sum of the squares of their differences from
+  the mean of all values (shift), from which the count, sum, mean,
+  variance and standard deviation of the values of a range of positions
+  are computed; the values are shifted, since for large values (e.g.
+  genome sizes) the variance would otherwise be the difference of two
+  huge, nearly equal numbers; for integer values, the prefix sums of the
+  squares are also stored modulo 2^64, so that the sums of the squares
+  of ranges (and thus the variance) are computed exactly (for floating
+  point values, precision is still lost for ranges whose mean is far
+  from the shift, compared to their standard deviation);
+- minimum and maximum value of each position and a sparse table of the
+  minima and maxima of blocks of BLOCKSIZE positions (as in the LCA index,
+  see the lca module): the minimum of a range is the minimum of two entries
+  of the sparse table, for the blocks inside the range, and of the
+  values at the at most 2 * BLOCKSIZE positions at its ends.
+
+The index is stored in a file (<attribute file>.agg), which uses the
+container format of the tree files (see the treefile module) and is
+memory mapped, so that a query reads only few values. It is written
+together with the attribute column, i.e. it is updated when the attribute
+values or the tree are modified.
+"""
+
+import array
+import math
+from pathlib import Path
+from fastsubtrees import vectorized, treefile, error, logger
+from fastsubtrees.lca import BLOCKSIZE
+
+EXT = "agg"
+
+OPS = ["count", "sum", "min", "max", "mean", "var", "std"]
+
+# kinds of attribute columns, for which the index can be computed
+KINDS = ["int", "float"]
+
+SECTIONS = ["count", "sum", "sumsq", "sumsq_low", "shift", "min", "max",
+            "min_blocks", "max_blocks"]
+
+def index_filename(attrfilename) -> Path:
+  return Path(f"{attrfilename}.{EXT}")
+
+def _sparse_table(values, reduce_fn, fill):
+  """
+  Sparse table of a reduction function over blocks of BLOCKSIZE values:
+  entry [k, b] is the reduction of the blocks b..b+2^k-1.
+  """
+  np = vectorized.np
+  n_blocks = -(-len(values) // BLOCKSIZE)
+  blocks = np.full(n_blocks * BLOCKSIZE, fill, dtype=values.dtype)
+  blocks[:len(values)] = values
+  n_levels = max(n_blocks.bit_length(), 1)
+  sparse = np.full((n_levels, n_blocks), fill, dtype=values.dtype)
+  sparse[0] = reduce_fn.reduce(blocks.reshape(n_blocks, BLOCKSIZE), axis=1)
+  for k in range(1, n_levels):
+    half = 1 << (k - 1)
+    sparse[k, :n_blocks - half] = \
+        reduce_fn(sparse[k - 1, :n_blocks - half], sparse[k - 1, half:])
+  return sparse
+
+class AggregateIndex:
+  """
+  Index for computing aggregates of the values of a numeric attribute
+  in subtrees (see the module documentation).
+  """
+
+  def __init__(self, sections):
+    # dict section name: NumPy array (the block tables have
+    # one row for each level of the sparse table)
+    self.sections = sections
+
+  @staticmethod
+  def _limits(dtype):
+    np = vectorized.np
+    if dtype.kind == "f":
+      return np.inf, -np.inf
+    return np.iinfo(dtype).max, np.iinfo(dtype).min
+
+  @staticmethod
+  def _shift(values):
+    """
+    Mean of the values, rounded for integer values (so that the sums of
+    the squares of the shifted values are exact, as long as they are less
+    than 2^53).
+    """
+    if len(values) == 0:
+      return 0.0
+    mean = float(values.mean())
+    return mean if values.dtype.kind == "f" else float(round(mean))
+
+  @staticmethod
+  def _sumsq_low(values, shift, valid=None):
+    """
+    For integer values, prefix sums of the squares of the shifted values
+    modulo 2^64 (exact, since the unsigned integer arithmetic wraps around);
+    empty for floating point values.
+    """
+    np = vectorized.np
+    if values.dtype.kind == "f":
+      return np.array([], dtype=np.uint64)
+    shifted = (values.astype(np.int64) - int(shift)).astype(np.uint64)
+    if valid is not None:
+      shifted[~valid] = 0
+    return np.concatenate((np.zeros(1, dtype=np.uint64),
+                           np.cumsum(shifted * shifted, dtype=np.uint64)))
+
+  @classmethod
+  def build(cls, column):
+    """
+    Compute the index for an attribute column (in linear time).
+    """
+    np = vectorized.np
+    values = column.values
+    dtype = values.dtype
+    high, low = cls._limits(dtype)
+    n = len(column)
+    if column.multivalued:
+      offsets = np.asarray(column.offsets, dtype=np.int64)
+      shift = cls._shift(values)
+      count = offsets
+      total = np.concatenate(([0], np.cumsum(values, dtype=dtype)))[offsets]
+      shifted = values - shift
+      sumsq = np.concatenate(([0.0], np.cumsum(shifted**2)))[offsets]
+      sumsq_low = cls._sumsq_low(values, shift)
+      if len(sumsq_low):
+        sumsq_low = sumsq_low[offsets]
+      minima = np.full(n, high, dtype=dtype)
+      maxima = np.full(n, low, dtype=dtype)
+      nonempty = offsets[1:] > offsets[:-1]
+      if nonempty.any():
+        starts = offsets[:-1][nonempty]
+        minima[nonempty] = np.minimum.reduceat(values, starts)
+        maxima[nonempty] = np.maximum.reduceat(values, starts)
+    else:
+      valid = column.valid()
+      present = np.where(valid, values, 0).astype(dtype)
+      shift = cls._shift(values[valid])
+      count = np.concatenate(([0], np.cumsum(valid, dtype=np.int64)))
+      total = np.concatenate(([0], np.cumsum(present, dtype=dtype)))
+      shifted = np.where(valid, values - shift, 0)
+      sumsq = np.concatenate(([0.0], np.cumsum(shifted**2)))
+      sumsq_low = cls._sumsq_low(values, shift, valid)
+      minima = np.where(valid, values, high).astype(dtype)
+      maxima = np.where(valid, values, low).astype(dtype)
+    return cls({"count": count, "sum": total.astype(dtype), "sumsq": sumsq,
+                "sumsq_low": sumsq_low,
+                "shift": np.array([shift], dtype=np.float64),
+                "min": minima, "max": maxima,
+                "min_blocks": _sparse_table(minima, np.minimum, high),
+                "max_blocks": _sparse_table(maxima, np.maximum, low)})
+
+  def to_file(self, filename, tree):
+    """
+    Save the index for an attribute of the given tree to file.
+    """
+    arrays = []
+    for name in SECTIONS:
+      values = self.sections[name]
+      typecode = "Q" if name in ["count", "sumsq_low"] else \
+          ("d" if values.dtype.kind == "f" else "q")
+      section = array.array(typecode)
+      section.frombytes(vectorized.np.ascontiguousarray(values).tobytes())
+      arrays.append((name, section))
+    treefile.write(filename, 64, 0, tree.root_id, tree.get_treesize(),
+                   tree.generation, arrays)
+    logger.debug(f"Aggregate index written to file \"{filename}\"")
+
+  @classmethod
+  def from_file(cls, filename):
+    """
+    Load an index from file (memory mapped, if possible).
+    """
+    vectorized.require_numpy("the aggregate index")
+    np = vectorized.np
+    with open(filename, "rb") as f:
+      header = treefile.read_header(f, filename)
+      if treefile.can_map(header):
+        mapped = treefile.map_file(filename)
+        sections = [treefile.map_section(mapped, filename, header, name)
+                    for name in SECTIONS]
+      else:  # pragma: no cover
+        sections = [treefile.read_section(f, filename, header, name)
+                    for name in SECTIONS]
+    sections = {name: np.frombuffer(section,
+                                    dtype=memoryview(section).format)
+                for name, section in zip(SECTIONS, sections)}
+    n = len(sections["min"])
+    n_blocks = -(-n // BLOCKSIZE)
+    if len(sections["count"]) != n + 1 or n_blocks == 0 or \
+        len(sections["shift"]) != 1 or \
+        len(sections["sumsq_low"]) not in [0, n + 1] or \
+        len(sections["min_blocks"]) % n_blocks or \
+        len(sections["max_blocks"]) != len(sections["min_blocks"]):
+      raise error.FastsubtreesError(\
+          f"Invalid aggregate index file \"{filename}\": "+\
+          "inconsistent sections")
+    for name in ["min_blocks", "max_blocks"]:
+      sections[name] = sections[name].reshape(-1, n_blocks)
+    return cls(sections)
+
+  def __len__(self):
+    return len(self.sections["min"])
+
+  def _range_reduce(self, name, reduce_fn, start, end):
+    """
+    Reduction of the values of the section name (min or max) in the
+    positions start..end-1, where start < end.
+    """
+    values = self.sections[name]
+    start_block = start // BLOCKSIZE
+    end_block = (end - 1) // BLOCKSIZE
+    if start_block == end_block:
+      return reduce_fn.reduce(values[start:end])
+    result = reduce_fn(\
+        reduce_fn.reduce(values[start:(start_block + 1) * BLOCKSIZE]),
+        reduce_fn.reduce(values[end_block * BLOCKSIZE:end]))
+    n_inner = end_block - start_block - 1
+    if n_inner > 0:
+      k = n_inner.bit_length() - 1
+      table = self.sections[f"{name}_blocks"]
+      result = reduce_fn(result, reduce_fn(table[k, start_block + 1],
+                         table[k, end_block - (1 << k)]))
+    return result
+
+  def _exact_sumsq(self, start, end):
+    """
+    Sum of the squares of the shifted integer values in the positions
+    start..end-1, as Python integer: the floating point prefix sums
+    determine the multiple of 2^64 to add to the sum modulo 2^64; None
+    if their rounding error can be too large for this, or if the values
+    are floating point.
+    """
+    sections = self.sections
+    if len(sections["sumsq_low"]) == 0:
+      return None
+    high = sections["sumsq"]
+    # bound of the rounding error of the sequential prefix sums
+    if float(high[end]) * len(high) * 2.0 ** -52 >= 2.0 ** 62:
+      return None
+    low_sums = sections["sumsq_low"]
+    low = (int(low_sums[end]) - int(low_sums[start])) % 2 ** 64
+    approx = float(high[end] - high[start])
+    return low + round((approx - low) / 2 ** 64) * 2 ** 64
+
+  def _variance(self, start, end, count, total):
+    shift = float(self.sections["shift"][0])
+    sumsq = self._exact_sumsq(start, end)
+    if sumsq is not None:
+      shifted_total = total - count * int(shift)
+      return (count * sumsq - shifted_total ** 2) / count ** 2
+    if count == 1:
+      return 0.0
+    sumsq = self.sections["sumsq"]
+    sumsq = float(sumsq[end] - sumsq[start])
+    # the clamping only removes rounding errors (see the module documentation)
+    shifted_mean = total / count - shift
+    return max(sumsq / count - shifted_mean ** 2, 0.0)
+
+  def aggregate(self, start, end, ops):
+    """
+    Aggregates of the values in the positions start..end-1;
+    ops is a list of elements of OPS. Except for count and sum,
+    the aggregates are None, if there are no values.
+    """
+    np = vectorized.np
+    result = {}
+    sections = self.sections
+    count = int(sections["count"][end] - sections["count"][start])
+    total = (sections["sum"][end] - sections["sum"][start]).item()
+    for op in ops:
+      if op == "count":
+        result[op] = count
+      elif op == "sum":
+        result[op] = total
+      elif count == 0:
+        result[op] = None
+      elif op in ["min", "max"]:
+        result[op] = self._range_reduce(op,
+            np.minimum if op == "min" else np.maximum, start, end).item()
+      elif op == "mean":
+        result[op] = total / count
+      else:
+        var = self._variance(start, end, count, total)
+        result[op] = var if op == "var" else math.sqrt(var)
+    return result
+
+def aggregate_values(values, ops):
+  """
+  Aggregates (see AggregateIndex.aggregate) of a list of values,
+  computed without an index.
+  """
+  result = {}
+  count = len(values)
+  total = sum(values)
+  for op in ops:
+    if op == "count":
+      result[op] = count
+    elif op == "sum":
+      result[op] = total
+    elif count == 0:
+      result[op] = None
+    elif op == "min":
+      result[op] = min(values)
+    elif op == "max":
+      result[op] = max(values)
+    elif op == "mean":
+      result[op] = total / count
+    else:
+      mean = total / count
+      var = sum((v - mean) ** 2 for v in values) / count
+      result[op] = var if op == "var" else math.sqrt(var)
+  return result
+
+def write_index(attrfilename, column, tree):
+  """
+  Write the index for the column of an attribute, if it is numeric
+  (otherwise, remove the index file, if any).
+  """
+  filename = index_filename(attrfilename)
+  if column.kind in KINDS:
+    AggregateIndex.build(column).to_file(filename, tree)
+  elif filename.exists():
+    filename.unlink()
@@ -4,10 +4,14 @@ Attribute operations for fastsubtrees.Tree objects.
 
 from collections import defaultdict
 from typing import List, Union, Dict, Any
+import array
 import json
 import glob
+import os
+import struct
+import sys
 from pathlib import Path
-from fastsubtrees import logger, error
+from fastsubtrees import logger, error, columns, vectorized, aggregates
 from fastsubtrees.ids_modules import attr_from_tabular_file
 
 class TreeAttributes():
@@ -16,19 +20,145 @@ class TreeAttributes():
 
   NONELINE = 'null\n'
 
+  # line index of an attribute file (<attribute file>.idx): byte offset
+  # of each line and size of the file, as little endian uint64
+  IDX_EXT = "idx"
+  IDX_ENTRY = struct.Struct("<Q")
+
+  @staticmethod
+  def compute_line_index_filename(attrfilename):
+    return Path(f"{attrfilename}.{TreeAttributes.IDX_EXT}")
+
+  @staticmethod
+  def _write_line_index(attrfilename):
+    """
+    Compute the line index of an attribute file.
+    """
+    with open(attrfilename, 'rb') as f:
+      if vectorized.numpy_available():
+        np = vectorized.np
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+        offsets = np.concatenate(([0], np.flatnonzero(data == 10) + 1))
+        if offsets[-1] != len(data):
+          offsets = np.append(offsets, len(data))
+        offsets = vectorized.to_array(offsets)
+      else:
+        offsets = array.array("Q", [0])
+        for line in f:
+          offsets.append(offsets[-1] + len(line))
+    if sys.byteorder != "little":  # pragma: no cover
+      offsets.byteswap()
+    idxfilename = TreeAttributes.compute_line_index_filename(attrfilename)
+    with open(idxfilename, 'wb') as f:
+      offsets.tofile(f)
+
+  @staticmethod
+  def _read_lines(attrfilename, first, count):
+    """
+    Read the lines first..first+count-1 of an attribute file using its
+    line index. Returns None if the line index does not exist or does
+    not match the attribute file. Returns an empty list if first is
+    negative (i.e. for nodes which are not in the tree) or count is 0.
+    """
+    if first < 0 or count == 0:
+      return []
+    idxfilename = TreeAttributes.compute_line_index_filename(attrfilename)
+    entry = TreeAttributes.IDX_ENTRY
+    try:
+      with open(idxfilename, 'rb') as f:
+        n_lines = os.fstat(f.fileno()).st_size // entry.size - 1
+        if first + count > n_lines:
+          return None
+        f.seek(-entry.size, os.SEEK_END)
+        filesize = entry.unpack(f.read(entry.size))[0]
+        f.seek(first * entry.size)
+        start = entry.unpack(f.read(entry.size))[0]
+        f.seek((first + count) * entry.size)
+        end = entry.unpack(f.read(entry.size))[0]
+    except FileNotFoundError:
+      return None
+    if filesize != Path(attrfilename).stat().st_size:
+      logger.debug(f"Line index of '{attrfilename}' is outdated")
+      return None
+    with open(attrfilename, 'rb') as f:
+      f.seek(start)
+      return f.read(end - start).splitlines()
+
+  @staticmethod
+  def _read_lines_at(attrfilename, line_nos):
+    """
+    Read the given lines of an attribute file using its line index.
+    Returns a dict from line number to line, without the negative line
+    numbers and those after the end of the file, or None if the line
+    index does not exist or does not match the attribute file.
+    """
+    idxfilename = TreeAttributes.compute_line_index_filename(attrfilename)
+    entry = TreeAttributes.IDX_ENTRY
+    bounds = {}
+    try:
+      with open(idxfilename, 'rb') as f:
+        n_lines = os.fstat(f.fileno()).st_size // entry.size - 1
+        if n_lines < 0:
+          return None
+        f.seek(-entry.size, os.SEEK_END)
+        filesize = entry.unpack(f.read(entry.size))[0]
+        for line_no in sorted(set(line_nos)):
+          if line_no < 0:
+            continue
+          if line_no >= n_lines:
+            break
+          f.seek(line_no * entry.size)
+          bounds[line_no] = [e[0] for e in \
+              entry.iter_unpack(f.read(2 * entry.size))]
+    except FileNotFoundError:
+      return None
+    if filesize != Path(attrfilename).stat().st_size:
+      logger.debug(f"Line index of '{attrfilename}' is outdated")
+      return None
+    result = {}
+    with open(attrfilename, 'rb') as f:
+      for line_no, (start, end) in bounds.items():
+        f.seek(start)
+        result[line_no] = f.read(end - start)
+    return result
+
   def _edit_attribute_values(self, edit_script, attrfilenames):
     for attrfilename in attrfilenames:
       with open(attrfilename, 'r') as f:
         lines = f.readlines()
+      # previous line number of each line (-1 for empty lines)
+      sources = list(range(len(lines)))
       for op in edit_script:
         if op[0] == "insert":
           lines.insert(op[1]-1, self.NONELINE)
+          sources.insert(op[1]-1, -1)
         elif op[0] == "copy":
           lines[op[2]-1] = lines[op[1]-1]
+          sources[op[2]-1] = sources[op[1]-1]
         elif op[0] == "delete":
           lines[op[1]-1] = self.NONELINE
+          sources[op[1]-1] = -1
       with open(attrfilename, 'w') as f:
         f.writelines(lines)
+      self._write_line_index(attrfilename)
+      columns.update_column(attrfilename, sources, self)
+
+  def _compact_attribute_values(self, keep, attrfilenames):
+    """
+    Remove the lines of the attribute files for which keep is False,
+    reading and writing each file in a single streaming pass.
+    """
+    for attrfilename in attrfilenames:
+      tmpfilename = f"{attrfilename}.tmp"
+      sources = []
+      with open(attrfilename, 'r') as f, open(tmpfilename, 'w') as out:
+        for line_no, (line, kept) in enumerate(zip(f, keep)):
+          if kept:
+            out.write(line)
+            sources.append(line_no)
+      os.replace(tmpfilename, attrfilename)
+      self._write_line_index(attrfilename)
+      columns.update_column(attrfilename, sources, self)
 
   @staticmethod
   def compute_attribute_filename(treefilename, attribute):
@@ -53,6 +183,23 @@ class TreeAttributes():
     for filename in self.existing_attribute_filenames(self.filename).values():
       logger.info("Removing obsolete attribute file {}".format(filename))
       filename.unlink()
+      self.__remove_sidecar_files(filename)
+
+  @staticmethod
+  def sidecar_filenames(attrfilename) -> List[Path]:
+    """
+    Returns the filenames of the files derived from an attribute file
+    (line index, column and aggregate index), which may exist or not.
+    """
+    return [TreeAttributes.compute_line_index_filename(attrfilename),
+            columns.column_filename(attrfilename),
+            aggregates.index_filename(attrfilename)]
+
+  @staticmethod
+  def __remove_sidecar_files(attrfilename):
+    for filename in TreeAttributes.sidecar_filenames(attrfilename):
+      if filename.exists():
+        filename.unlink()
 
   def attribute_filename(self, attribute) -> Path:
     """
@@ -88,6 +235,7 @@ class TreeAttributes():
     filename = self.attribute_filename(attribute)
     logger.info("Removing obsolete attribute file {}".format(filename))
     filename.unlink()
+    self.__remove_sidecar_files(filename)
 
   def subtree_attribute_data(self, subtree_root, attribute):
     self._check_filename_set()
@@ -95,6 +243,9 @@ class TreeAttributes():
     subtree_size = self.get_subtree_size(subtree_root)
     coord = self.get_treedata_coord(subtree_root) - 1
     attrfilename = self.attribute_filename(attribute)
+    lines = self._read_lines(attrfilename, coord, subtree_size)
+    if lines is not None:
+      return [json.loads(line) for line in lines]
     line_no = 0
     result = []
     with open(attrfilename, 'r') as f:
@@ -104,6 +255,162 @@ class TreeAttributes():
         line_no += 1
     return result
 
+  def attribute_column_filename(self, attribute) -> Path:
+    """
+    Returns the filename where the attribute column is stored
+    (see create_attribute_column).
+    """
+    return columns.column_filename(self.attribute_filename(attribute))
+
+  def has_attribute_column(self, attribute):
+    return self.attribute_column_filename(attribute).exists()
+
+  def create_attribute_column(self, attribute, kind, multivalued=False):
+    """
+    Stores the values of an existing attribute also in a binary column
+    (see the columns module), where kind is "int", "float" or "bool".
+    If multivalued is False, each node must have at most one value;
+    otherwise the values are stored in CSR form. The column is kept
+    in sync with the attribute file, until the attribute is destroyed.
+    """
+    self._check_filename_set()
+    self.__check_has_attribute(attribute)
+    attrfilename = self.attribute_filename(attribute)
+    columns.write(attrfilename, columns.Column.from_attribute_file(\
+        attrfilename, kind, multivalued), self)
+
+  def __load_column(self, attribute):
+    self._check_filename_set()
+    self.__check_has_attribute(attribute)
+    filename = self.attribute_column_filename(attribute)
+    if not filename.exists():
+      raise error.AttributeNotFoundError(\
+          f"Attribute '{attribute}' has no column "+\
+          f"(file '{filename}' does not exist)")
+    column = columns.Column.from_file(filename)
+    if len(column) != len(self.treedata):
+      raise error.FastsubtreesError(\
+          f"Attribute column file '{filename}' does not match the tree")
+    return column
+
+  def __subtree_range(self, subtree_root):
+    coord = self.get_treedata_coord(subtree_root)
+    return coord, coord + self.get_subtree_size(subtree_root)
+
+  def subtree_attribute_column(self, subtree_root, attribute):
+    """
+    Returns the values of an attribute for the given subtree, in the order
+    of subtree_ids, as NumPy masked array (nodes without a value, as well
+    as deleted nodes, are masked), using the attribute column
+    (see create_attribute_column), which is memory mapped.
+    """
+    column = self.__load_column(attribute)
+    return column.slice(*self.__subtree_range(subtree_root))
+
+  def subtree_attribute_csr(self, subtree_root, attribute):
+    """
+    Returns the values of an attribute for the given subtree, in the order
+    of subtree_ids, in compressed sparse row form, using the attribute
+    column (see create_attribute_column): a pair of NumPy arrays (values,
+    offsets), where the values of the i-th node are
+    values[offsets[i]:offsets[i+1]].
+    """
+    column = self.__load_column(attribute)
+    return column.csr(*self.__subtree_range(subtree_root))
+
+  def attribute_categories(self, attribute) -> List[Any]:
+    """
+    Returns the distinct values of a categorical attribute, i.e. one
+    with a column of kind "category" (see create_attribute_column).
+    """
+    column = self.__load_column(attribute)
+    if column.kind != "category":
+      raise error.FastsubtreesError(\
+          f"Attribute '{attribute}' is not categorical")
+    return column.categories
+
+  def subtree_nodes_with_attribute_value(self, subtree_root, attribute,
+                                         value):
+    """
+    Returns the IDs of the nodes of the given subtree, for which the value
+    of the attribute is value (or one of the values is value), as NumPy
+    array, using the attribute column (see create_attribute_column).
+    For categorical attributes, the values are not decoded.
+    """
+    column = self.__load_column(attribute)
+    positions = column.positions_with_value(\
+        *self.__subtree_range(subtree_root), value)
+    return vectorized.gather(self.treedata, positions)
+
+  def subtree_aggregate(self, subtree_root, attribute, ops=None) \
+      -> Dict[str, Any]:
+    """
+    Returns aggregates of the values of a numeric attribute in the given
+    subtree, as dictionary {op: value}, where ops is a list of operations
+    (default: all): count (number of values), sum, min, max, mean,
+    var (population variance) and std (standard deviation).
+    Except for count and sum, the values are None, if the subtree has
+    no values.
+
+    If the attribute has a column of kind int or float (see
+    create_attribute_column), the aggregates are computed in constant time
+    using the aggregate index; otherwise from the values in the attribute
+    file.
+    """
+    if ops is None:
+      ops = aggregates.OPS
+    unknown = [op for op in ops if op not in aggregates.OPS]
+    if unknown:
+      raise error.FastsubtreesError(\
+          f"Unknown aggregate operation '{unknown[0]}', "+\
+          f"available operations: {', '.join(aggregates.OPS)}")
+    self._check_filename_set()
+    self.__check_has_attribute(attribute)
+    attrfilename = self.attribute_filename(attribute)
+    idxfilename = aggregates.index_filename(attrfilename)
+    if idxfilename.exists() and self.has_attribute_column(attribute):
+      index = aggregates.AggregateIndex.from_file(idxfilename)
+      if len(index) != len(self.treedata):
+        raise error.FastsubtreesError(\
+            f"Aggregate index file '{idxfilename}' does not match the tree")
+      return index.aggregate(*self.__subtree_range(subtree_root), ops)
+    values = []
+    for value in self.subtree_attribute_data(subtree_root, attribute):
+      if isinstance(value, list):
+        values.extend(value)
+      elif value is not None:
+        values.append(value)
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+               for v in values):
+      raise error.FastsubtreesError(\
+          f"Attribute '{attribute}' has non-numeric values")
+    return aggregates.aggregate_values(values, ops)
+
+  def attribute_values_at_lines(self, attribute, lines):
+    """
+    Returns the values of an attribute at the given lines of the attribute
+    file (i.e. positions in treedata, minus 1), using the line index if
+    it is up to date, otherwise reading the file once.
+    """
+    self._check_filename_set()
+    self.__check_has_attribute(attribute)
+    needed = defaultdict(list)
+    for i, line_no in enumerate(lines):
+      needed[int(line_no)].append(i)
+    result = [None] * len(lines)
+    attrfilename = self.attribute_filename(attribute)
+    found = self._read_lines_at(attrfilename, needed.keys())
+    if found is not None:
+      for line_no, line in found.items():
+        for i in needed[line_no]:
+          result[i] = json.loads(line.rstrip())
+      return result
+    with open(attrfilename, 'r') as f:
+      for line_no, line in enumerate(f):
+        for i in needed.get(line_no, ()):
+          result[i] = json.loads(line.rstrip())
+    return result
+
   @staticmethod
   def prepare_attribute_values(generator, casting_fn=lambda x: x):
     result = defaultdict(list)
@@ -120,12 +427,16 @@ class TreeAttributes():
     return TreeAttributes.prepare_attribute_values(generator, casting_fn)
 
   def create_attribute(self, attribute, generator, casting_fn=lambda x: x,
-                       force=False):
+                       force=False, column_kind=None,
+                       multivalued_column=False):
     """
     Creates a new attribute.
 
     The attribute values are given by the generator. The generator
     should yield pairs of the form (element_id, attribute_value).
+    If column_kind is set, the values are also stored in a binary
+    column of the given kind, which is multi-valued if multivalued_column
+    is True (see create_attribute_column).
     """
     self._check_filename_set()
     if self.has_attribute(attribute) and not force:
@@ -134,6 +445,9 @@ class TreeAttributes():
     attribute_values = \
         TreeAttributes.prepare_attribute_values(generator, casting_fn)
     self.save_attribute_values(attribute, attribute_values)
+    if column_kind is not None:
+      self.create_attribute_column(attribute, column_kind,
+                                   multivalued_column)
 
   def create_attribute_from_tabular(self, attribute, filename,
       separator="\t", elem_field_num=0, attr_field_num=1, comment_char="#",
@@ -163,6 +477,12 @@ class TreeAttributes():
         else:
           attribute = attrvalues.get(element_id, None)
         outfile.write(json.dumps(attribute) + "\n")
+    self._write_line_index(attrfilename)
+    colfilename = columns.column_filename(attrfilename)
+    if colfilename.exists():
+      column = columns.Column.from_file(colfilename)
+      columns.write(attrfilename, columns.Column.from_attribute_file(\
+          attrfilename, column.kind, column.multivalued), self)
 
   def check_has_attributes(self, attributes):
     self._check_filename_set()
@@ -184,12 +504,18 @@ class TreeAttributes():
       logger.debug("Loading attribute '{}' values".format(attrname))
       result[attrname] = self.subtree_attribute_data(subtree_root, attrname)
       if show_stats:
-        filtered = [a for a in result[attrname] if a is not None]
-        flattened = [e for sl in filtered for e in sl]
+        if self.has_attribute_column(attrname):
+          n_nodes, n_values = self.__load_column(attrname).count(\
+              *self.__subtree_range(subtree_root))
+        else:
+          filtered = [a for a in result[attrname] if a is not None]
+          n_nodes = len(filtered)
+          n_values = sum(len(a) if isinstance(a, list) else 1
+                         for a in filtered)
         logger.info("Number of nodes with attribute '{}': {}".\
-            format(attrname, len(filtered)))
+            format(attrname, n_nodes))
         logger.info("Number of values of attribute '{}': {}".\
-            format(attrname, len(flattened)))
+            format(attrname, n_values))
     return result
 
   def clear_attributes_cache(self):
@@ -209,6 +535,9 @@ class TreeAttributes():
       return self.attribute_cache[attribute][coord]
     else:
       attrfilename = self.attribute_filename(attribute)
+      lines = self._read_lines(attrfilename, coord, 1)
+      if lines is not None:
+        return json.loads(lines[0]) if lines else None
       with open(attrfilename, 'r') as f:
         line_no = 0
         for line in f:
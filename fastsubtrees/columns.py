@@ -0,0 +1,356 @@
+"""
+Binary columnar storage of attribute values (requires NumPy).
+
+The values of a numeric or boolean attribute can be stored, in addition
+to the attribute file (JSON lines, see TreeAttributes), in a column file
+(<attribute file>.col), which contains a fixed-width array aligned with
+treedata (the value for the node at position i of treedata is at index i)
+and a bitmap of the positions which have a value (bit i is the bit
+i % 8 of byte i // 8). Thus the values of a subtree are a slice of the
+array, which is returned as NumPy masked array (the positions without
+a value are masked).
+
+Multi-valued attributes are stored in compressed sparse row (CSR) form:
+the values of all positions are concatenated in the values array, and the
+offsets array contains for each position i the index of its first value
+(the values of position i are values[offsets[i]:offsets[i+1]]); the bitmap
+distinguishes positions without a value (null) from empty lists. Thus the
+values of a subtree are also a slice of the values array.
+
+Categorical attributes (e.g. strings with few distinct values) are
+dictionary encoded: the values array contains, for each value, a code,
+i.e. the index of the value in the list of distinct values (categories),
+which is stored in JSON format. The values are decoded only on output
+and searching a value only requires to compare the codes.
+
+The column file uses the container format of the tree files (see the
+treefile module), with the sections "values", "valid", "offsets" (only for
+multi-valued attributes) and "categories" (only for categorical attributes;
+the JSON encoded categories, as bytes), so that it can be memory mapped.
+It is created from the attribute file and it is updated by the methods
+which modify the attribute file.
+"""
+
+import array
+import json
+from pathlib import Path
+from fastsubtrees import vectorized, treefile, error, logger, aggregates
+
+EXT = "col"
+
+# kind of attribute values: typecode of the values array
+# (for categorical attributes, of the codes)
+KINDS = {"int": "q", "float": "d", "bool": "B", "category": "I"}
+
+def column_filename(attrfilename) -> Path:
+  return Path(f"{attrfilename}.{EXT}")
+
+def _scalar(value, attrfilename, line_no):
+  if isinstance(value, list):
+    if len(value) > 1:
+      raise error.AttributeCreationError(\
+          f"Attribute file '{attrfilename}' has multiple values "+\
+          f"at line {line_no + 1}, which cannot be stored in a column")
+    value = value[0] if value else None
+  return value
+
+def _kind(dtype):
+  for kind, typecode in KINDS.items():
+    if vectorized.np.dtype(typecode) == dtype:
+      return kind
+  return None
+
+class Column:
+  """
+  Values of an attribute, aligned with treedata
+  (see the module documentation).
+  """
+
+  def __init__(self, values, valid_bits, offsets=None, categories=None):
+    self.values = values
+    self.valid_bits = valid_bits
+    # None, unless the attribute is multi-valued
+    self.offsets = offsets
+    # None, unless the attribute is categorical; list of the categories
+    # or (before they are decoded) their JSON encoding, as bytes buffer
+    self._categories = categories
+
+  def __len__(self):
+    if self.offsets is not None:
+      return len(self.offsets) - 1
+    return len(self.values)
+
+  @property
+  def multivalued(self) -> bool:
+    return self.offsets is not None
+
+  @property
+  def kind(self) -> str:
+    return _kind(self.values.dtype)
+
+  @property
+  def categories(self) -> list:
+    """
+    Distinct values of a categorical attribute (the code of a value is
+    its index in the list).
+    """
+    if self._categories is not None and \
+        not isinstance(self._categories, list):
+      self._categories = json.loads(bytes(self._categories))
+    return self._categories
+
+  def code(self, value):
+    """
+    Code of a value of a categorical attribute, None if the value
+    does not occur.
+    """
+    if not hasattr(self, "_codes"):
+      self._codes = {v: i for i, v in enumerate(self.categories)}
+    return self._codes.get(value)
+
+  def decode(self, codes):
+    """
+    Values of a categorical attribute for the given codes,
+    as NumPy array of objects.
+    """
+    np = vectorized.np
+    # one more entry, for the codes of the positions without a value,
+    # if there are no categories
+    categories = np.empty(len(self.categories) + 1, dtype=object)
+    categories[:-1] = self.categories
+    return categories[codes]
+
+  @classmethod
+  def from_attribute_file(cls, attrfilename, kind, multivalued=False):
+    """
+    Compute the column from the values in an attribute file;
+    kind is one of the keys of KINDS. If multivalued is False,
+    each node must have at most one value.
+    """
+    vectorized.require_numpy("attribute columns")
+    np = vectorized.np
+    if kind not in KINDS:
+      raise error.AttributeCreationError(\
+          f"Unknown kind of attribute column '{kind}', "+\
+          f"available kinds: {', '.join(KINDS)}")
+    # position 0 of treedata has no value
+    parsed = [None]
+    with open(attrfilename, "r") as f:
+      for line_no, line in enumerate(f):
+        value = json.loads(line.rstrip())
+        if not multivalued:
+          value = _scalar(value, attrfilename, line_no)
+        elif value is not None and not isinstance(value, list):
+          value = [value]
+        parsed.append(value)
+    valid = np.array([v is not None for v in parsed], dtype=bool)
+    offsets = None
+    if multivalued:
+      sizes = np.array([len(v) if v is not None else 0 for v in parsed],
+                       dtype=np.int64)
+      offsets = np.concatenate(([0], np.cumsum(sizes)))
+      flat = [e for v in parsed if v is not None for e in v]
+      values = np.zeros(len(flat), dtype=KINDS[kind])
+      selected = slice(None)
+    else:
+      flat = [v for v in parsed if v is not None]
+      values = np.zeros(len(parsed), dtype=KINDS[kind])
+      selected = valid
+    categories = None
+    try:
+      if kind == "category":
+        codes = {}
+        flat = [codes.setdefault(v, len(codes)) for v in flat]
+        categories = list(codes)
+      values[selected] = flat
+    except (TypeError, ValueError) as exc:
+      raise error.AttributeCreationError(\
+          f"Values of attribute file '{attrfilename}' cannot be stored "+\
+          f"in a column of kind '{kind}': {exc}")
+    return cls(values, np.packbits(valid, bitorder="little"), offsets,
+               categories)
+
+  def to_file(self, filename, tree):
+    """
+    Save the column of an attribute of the given tree to file.
+    """
+    sections = []
+    arrays = [("values", self.values, KINDS[self.kind]),
+              ("valid", self.valid_bits, "B")]
+    if self.multivalued:
+      arrays.append(("offsets", self.offsets, "Q"))
+    for name, values, typecode in arrays:
+      section = array.array(typecode)
+      section.frombytes(values.tobytes())
+      sections.append((name, section))
+    if self.kind == "category":
+      sections.append(("categories",
+          array.array("B", json.dumps(self.categories).encode())))
+    treefile.write(filename, 64, 0, tree.root_id, tree.get_treesize(),
+                   tree.generation, sections)
+    logger.debug(f"Attribute column written to file \"{filename}\"")
+
+  @classmethod
+  def from_file(cls, filename):
+    """
+    Load a column from file (memory mapped, if possible).
+    """
+    vectorized.require_numpy("attribute columns")
+    np = vectorized.np
+    with open(filename, "rb") as f:
+      header = treefile.read_header(f, filename)
+      names = [name for name in ["values", "valid", "offsets",
+                                 "categories"] if name in header.sections]
+      if treefile.can_map(header):
+        mapped = treefile.map_file(filename)
+        sections = [treefile.map_section(mapped, filename, header, name)
+                    for name in names]
+      else:  # pragma: no cover
+        sections = [treefile.read_section(f, filename, header, name)
+                    for name in names]
+    sections = dict(zip(names, sections))
+    values, valid_bits = \
+        [np.frombuffer(sections[name], dtype=memoryview(sections[name]).format)
+         for name in ["values", "valid"]]
+    offsets = None
+    n_positions = len(values)
+    if "offsets" in sections:
+      offsets = \
+          np.frombuffer(sections["offsets"], dtype=np.uint64).view(np.int64)
+      n_positions = len(offsets) - 1
+      if n_positions < 0 or offsets[-1] != len(values):
+        raise error.FastsubtreesError(\
+            f"Invalid attribute column file \"{filename}\"")
+    if _kind(values.dtype) is None or \
+        len(valid_bits) != -(-n_positions // 8) or \
+        (_kind(values.dtype) == "category") != ("categories" in sections):
+      raise error.FastsubtreesError(\
+          f"Invalid attribute column file \"{filename}\"")
+    return cls(values, valid_bits, offsets, sections.get("categories"))
+
+  def valid(self, start=0, end=None):
+    """
+    For each position start..end-1, whether it has a value.
+    """
+    np = vectorized.np
+    if end is None:
+      end = len(self)
+    first = start // 8
+    bits = np.unpackbits(self.valid_bits[first:-(-end // 8)],
+                         bitorder="little")
+    return bits[start - 8 * first:end - 8 * first].astype(bool)
+
+  def slice(self, start, end):
+    """
+    Values at the positions start..end-1 as masked array (the values
+    are not copied, i.e. they are memory mapped, if the column was loaded
+    from file).
+    """
+    if self.multivalued:
+      raise error.FastsubtreesError(\
+          "The values of a multi-valued attribute column cannot be "+\
+          "returned as masked array, use the CSR form instead")
+    return vectorized.np.ma.MaskedArray(self._typed(self.values[start:end]),
+                                        mask=~self.valid(start, end))
+
+  def _typed(self, values):
+    if self.kind == "bool":
+      return values.view(bool)
+    if self.kind == "category":
+      return self.decode(values)
+    return values
+
+  def csr(self, start, end):
+    """
+    Values at the positions start..end-1 in CSR form, i.e. as pair
+    (values, offsets), where the values of the i-th position are
+    values[offsets[i]:offsets[i+1]]. For multi-valued attributes, the values
+    are not copied (see slice).
+    """
+    np = vectorized.np
+    if self.multivalued:
+      offsets = self.offsets[start:end + 1]
+      return self._typed(self.values[offsets[0]:offsets[-1]]), \
+          offsets - offsets[0]
+    valid = self.valid(start, end)
+    return self._typed(self.values[start:end][valid]), \
+        np.concatenate(([0], np.cumsum(valid)))
+
+  def positions_with_value(self, start, end, value):
+    """
+    Positions in start..end-1 where the attribute has the given value
+    (or, for multi-valued attributes, where it is one of the values).
+    For categorical attributes, only the codes are compared.
+    """
+    np = vectorized.np
+    if self.kind == "category":
+      value = self.code(value)
+      if value is None:
+        return np.array([], dtype=np.int64)
+    if self.multivalued:
+      first, last = self.offsets[start], self.offsets[end]
+      found = np.flatnonzero(self.values[first:last] == value) + first
+      return np.unique(np.searchsorted(self.offsets, found, side="right") - 1)
+    found = np.flatnonzero(self.values[start:end] == value)
+    return found[self.valid(start, end)[found]] + start
+
+  def count(self, start, end):
+    """
+    Number of positions with a value and total number of values,
+    in the positions start..end-1.
+    """
+    n_valid = int(self.valid(start, end).sum())
+    if self.multivalued:
+      return n_valid, int(self.offsets[end] - self.offsets[start])
+    return n_valid, n_valid
+
+  def remap(self, sources):
+    """
+    Column whose value at position i is the value at position sources[i],
+    or no value, if sources[i] is negative.
+    """
+    np = vectorized.np
+    sources = np.asarray(sources, dtype=np.int64)
+    found = sources >= 0
+    valid = np.zeros(len(sources), dtype=bool)
+    valid[found] = self.valid()[sources[found]]
+    valid_bits = np.packbits(valid, bitorder="little")
+    if self.multivalued:
+      starts = self.offsets[sources[found]]
+      sizes = np.zeros(len(sources), dtype=np.int64)
+      sizes[found] = self.offsets[sources[found] + 1] - starts
+      return Column(vectorized.gather_ranges(self.values, starts,
+                                             sizes[found]),
+                    valid_bits, np.concatenate(([0], np.cumsum(sizes))),
+                    self._categories)
+    values = np.zeros(len(sources), dtype=self.values.dtype)
+    values[found] = self.values[sources[found]]
+    return Column(values, valid_bits, categories=self._categories)
+
+def update_column(attrfilename, line_sources, tree):
+  """
+  Update the column of an attribute file, if it exists, after the lines
+  of the attribute file were rearranged: line_sources contains for each
+  line the previous line number, or a negative number for new empty lines.
+  """
+  filename = column_filename(attrfilename)
+  if not filename.exists():
+    return
+  if not vectorized.numpy_available():  # pragma: no cover
+    logger.warning(f"Removing attribute column file \"{filename}\", "+\
+        "which cannot be updated since NumPy is not installed")
+    filename.unlink()
+    return
+  np = vectorized.np
+  line_sources = np.asarray(line_sources, dtype=np.int64)
+  sources = np.concatenate(([0], np.where(line_sources >= 0,
+                                          line_sources + 1, -1)))
+  write(attrfilename, Column.from_file(filename).remap(sources), tree)
+
+def write(attrfilename, column, tree):
+  """
+  Save the column of an attribute file of the given tree, together
+  with its aggregate index (see the aggregates module).
+  """
+  column.to_file(column_filename(attrfilename), tree)
+  aggregates.write_index(attrfilename, column, tree)
@@ -34,6 +34,12 @@ Conversion of attribute values:
   -t, --type T   function to apply to the attribute values; either from the
                  standard library or defined in the specified --module M
 
+Binary attribute columns:
+  -k, --column K       also store the values in a binary column of kind K
+                       (int, float, bool or category); for int and float,
+                       the aggregate index is computed
+  -M, --multivalued    the column contains multiple values for each node
+
 Further options:
   -S, --strict   exit with an error if a node ID is not found in the tree
                  (default: ignore lines with non-existing node IDs)
@@ -43,7 +49,7 @@ Further options:
   -V, --version  show program's version number and exit
 """ # noqa
 
-from fastsubtrees import logger, Tree
+from fastsubtrees import logger, Tree, columns
 from fastsubtrees.commands import _support
 
 def get_generator_and_casting_fn(args):
@@ -115,6 +121,19 @@ def manage_attribute(args, tree):
   elif action == "list":
     for attr in tree.list_attributes():
       print(attr)
+  if action in ["new", "add", "replace"] and args.get("--column"):
+    kind = args["--column"]
+    multivalued = args.get("--multivalued", False)
+    # an existing column is already updated by the actions above
+    if not has_column(tree, args["<attribute>"], kind, multivalued):
+      tree.create_attribute_column(args["<attribute>"], kind, multivalued)
+
+def has_column(tree, attribute, kind, multivalued):
+  filename = tree.attribute_column_filename(attribute)
+  if not filename.exists():
+    return False
+  column = columns.Column.from_file(filename)
+  return column.kind == kind and column.multivalued == multivalued
 
 def main(args):
   logger.debug("Loading tree from file '{}'".format(args['<treefile>']))
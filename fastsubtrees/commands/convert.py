@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Convert a tree file to the current file format version.
+
+Usage:
+  fastsubtrees convert <treefile> [<outfile>] [options]
+
+Arguments:
+  <treefile>     tree file (output of fastsubtrees tree), in any
+                 supported file format version
+  <outfile>      output file (default: overwrite <treefile>);
+                 the attribute files of the tree (and their line
+                 indices, columns and aggregate indices) are copied as well
+
+Options:
+  -q, --quiet    disable log messages
+  -d, --debug    print debug information
+  -h, --help     show this help message and exit
+  -V, --version  show program's version number and exit
+"""
+
+import shutil
+from fastsubtrees import logger, Tree, treefile
+
+def main(args):
+  infname = args["<treefile>"]
+  outfname = args["<outfile>"] or infname
+  logger.debug("Loading tree from file '{}'".format(infname))
+  tree = Tree.from_file(infname)
+  attrfilenames = Tree.existing_attribute_filenames(infname)
+  tree.to_file(outfname)
+  if outfname != infname:
+    for attribute, attrfilename in attrfilenames.items():
+      outattrfilename = Tree.compute_attribute_filename(outfname, attribute)
+      shutil.copyfile(attrfilename, outattrfilename)
+      for filename, outfilename in \
+          zip(Tree.sidecar_filenames(attrfilename),
+              Tree.sidecar_filenames(outattrfilename)):
+        if filename.exists():
+          shutil.copyfile(filename, outfilename)
+  logger.success("Tree file '{}' written in format version {}".\
+      format(outfname, treefile.VERSION))
@@ -22,13 +22,17 @@ Options:
   -z, --subtree-sizes    show size of subtree under each nodes
                          (including nodes marked as deleted!)
   -o, --only             show only selected node, not the subtree
+  -g, --aggregate OPS    instead of the values of the attributes, show
+                         aggregates of the numeric values in the subtree;
+                         comma-separated list of: count, sum, min, max,
+                         mean, var, std (or: all)
   -q, --quiet            disable log messages
   -d, --debug            print debug information
   -h, --help             show this help message and exit
   -V, --version          show program's version number and exit
 """
 
-from fastsubtrees import Tree, logger
+from fastsubtrees import Tree, logger, aggregates
 
 def check_attribute_args(args):
   attrnames = args["<attribute>"]
@@ -61,14 +65,12 @@ def show_header(args, attrnames):
     header_data.extend(attrnames)
     print("# "+args["--separator"].join(header_data))
 
-def show_data(args, subtree_info, attrnames):
-  n_nodes = 0
+def show_data(args, subtree_info, attrnames, undef):
   for i, node_id in enumerate(subtree_info["node_id"]):
     if args["--only"] and node_id != int(args["<subtreeroot>"]):
       continue
-    if node_id == Tree.UNDEF:
+    if node_id == undef:
       continue
-    n_nodes += 1
     if not args["--missing"] and \
         all([subtree_info[attrname][i] is None for attrname in attrnames]):
       continue
@@ -86,8 +88,29 @@ def show_data(args, subtree_info, attrnames):
       else:
         line_data.append(str(value))
     print(args["--separator"].join(line_data))
-  if args["--stats"]:
-    logger.info("Number of nodes in subtree: {}".format(n_nodes))
+
+def get_aggregate_ops(args):
+  ops = args["--aggregate"].split(",")
+  if ops == ["all"]:
+    return aggregates.OPS
+  for op in ops:
+    if op not in aggregates.OPS:
+      logger.error("Unknown aggregate operation '{}', ".format(op)+\
+          "available operations: {}".format(", ".join(aggregates.OPS)))
+      exit(1)
+  return ops
+
+def show_aggregates(args, tree, subtree_root, attrnames):
+  if not attrnames:
+    logger.error("Cannot use --aggregate without attributes")
+    exit(1)
+  ops = get_aggregate_ops(args)
+  if not args["--no-header"]:
+    print("# "+args["--separator"].join(["attribute"] + ops))
+  for attrname in attrnames:
+    result = tree.subtree_aggregate(subtree_root, attrname, ops)
+    print(args["--separator"].join(\
+        [attrname] + [str(result[op]) for op in ops]))
 
 def run_query(args, tree):
   if args["<subtreeroot>"] == "root":
@@ -98,12 +121,20 @@ def run_query(args, tree):
   attrnames = check_attribute_args(args)
   if not tree.check_has_attributes(attrnames):
     exit(1)
+  if args.get("--aggregate"):
+    show_aggregates(args, tree, subtree_root, attrnames)
+    return
   subtree_info = tree.subtree_info(subtree_root, attrnames,
       args["--subtree-sizes"], args["--parents"], args["--stats"])
   show_header(args, attrnames)
-  show_data(args, subtree_info, attrnames)
+  show_data(args, subtree_info, attrnames, tree.UNDEF)
+  if args["--stats"]:
+    n_nodes = tree.get_live_subtree_size(subtree_root)
+    if args["--only"]:
+      n_nodes = min(n_nodes, 1)
+    logger.info("Number of nodes in subtree: {}".format(n_nodes))
 
 def main(args):
   logger.debug("Loading tree from file '{}'".format(args['<tree>']))
-  tree = Tree.from_file(args["<tree>"])
+  tree = Tree.from_file(args["<tree>"], mmap=True)
   run_query(args, tree)
@@ -6,6 +6,7 @@ Usage:
   fastsubtrees tree <treefile> [--new|--update|--reset|--add] <tabfile> [options]
   fastsubtrees tree <treefile> [--new|--update|--reset|--add] --module M [<args>...] [options]
   fastsubtrees tree <treefile> --delete <subtree_root>... [options]
+  fastsubtrees tree <treefile> --compact [options]
 
 Actions:
   -N, --new      (default) create a new tree from the given IDs source
@@ -15,6 +16,8 @@ Actions:
                  the tree is created from scratch; attributes are dumped and reloaded
   -A, --add      add new nodes to an existing tree
   -D, --delete   remove leaves or subtrees from an existing tree
+  -X, --compact  remove the positions left empty by deleted and moved nodes
+                 from an existing tree and its attribute files
 
 Tabular file input:
   <tabfile>            tabular file containing IDs of the nodes and their parents
@@ -40,13 +43,45 @@ Further options:
   -h, --help         show this help message and exit
   -V, --version      show program's version number and exit
   -t, --processes N  number of processes to use (default: 1)
+  -E, --engine E     construction engine (action --new): python, numpy or auto
+                     (default: auto, i.e. numpy if installed, otherwise python)
+  -W, --width W      width in bits of the tree arrays (action --new): 32, 64
+                     or auto (default: auto, i.e. the narrowest possible)
+  -M, --remap        index the tree arrays by the rank of the node IDs,
+                     instead of the node IDs (action --new), i.e. use memory
+                     proportional to the number of nodes, not to the max ID
 """ # noqa
 
 from pathlib import Path
 from fastsubtrees import Tree, logger
 from fastsubtrees.commands import _support
 
-def get_generator(args):
+def get_tabular_keyargs(args):
+  if args["--ncbi"]:
+    if args["--separator"] or args["--elementscol"] \
+        or args["--parentscol"] or args["--commentchar"]:
+      logger.warning("The --ncbi option overrides the following options: " +\
+          "--separator, --elementscol, --parentscol, --commentchar")
+    keyargs = {"ncbi_preset": True, "comment_pfx": "#"}
+  else:
+    keyargs = {"separator": "\t", "element_id_column": 0,
+               "parent_id_column": 1, "comment_pfx": "#"}
+    if args["--separator"]:
+      keyargs["separator"] = args["--separator"]
+    if args["--elementscol"]:
+      keyargs["element_id_column"] = int(args["--elementscol"]) - 1
+    if args["--parentscol"]:
+      keyargs["parent_id_column"] = int(args["--parentscol"]) - 1
+    if args["--commentchar"]:
+      keyargs["comment_pfx"] = args["--commentchar"]
+  return keyargs
+
+def get_generator(args, chunks=False):
+  """
+  Returns a generator of (element, parent) pairs; if chunks is set and the
+  IDs are read from a tabular file, returns instead a generator of chunks
+  of (elements, parents) arrays.
+  """
   fn = "element_parent_ids"
   if args["--module"]:
     if args["--ncbi"]:
@@ -65,30 +100,18 @@ def get_generator(args):
     logger.debug("Using tabular file {} as a source of IDs".\
         format(args["<tabfile>"]))
     posargs = [args["<tabfile>"]]
-    if args["--ncbi"]:
-      if args["--separator"] or args["--elementscol"] \
-          or args["--parentscol"] or args["--commentchar"]:
-        logger.warning("The --ncbi option overrides the following options: " +\
-            "--separator, --elementscol, --parentscol, --commentchar")
-      keyargs = {"ncbi_preset": True, "comment_pfx": "#"}
-    else:
-      keyargs = {"separator": "\t", "element_id_column": 0,
-                 "parent_id_column": 1, "comment_pfx": "#"}
-      if args["--separator"]:
-        keyargs["separator"] = args["--separator"]
-      if args["--elementscol"]:
-        keyargs["element_id_column"] = int(args["--elementscol"]) - 1
-      if args["--parentscol"]:
-        keyargs["parent_id_column"] = int(args["--parentscol"]) - 1
-      if args["--commentchar"]:
-        keyargs["comment_pfx"] = args["--commentchar"]
+    keyargs = get_tabular_keyargs(args)
+    if chunks:
+      fn = "element_parent_id_chunks"
+      keyargs["n_processes"] = args["--processes"]
   return getattr(m, fn)(*posargs, **keyargs)
 
 DEFAULT_ACTION = "new"
 
 def get_action(args):
   actions = \
-      [a for a in ["new", "update", "reset", "add", "delete"] if args["--" + a]]
+      [a for a in ["new", "update", "reset", "add", "delete", "compact"]
+       if args["--" + a]]
   assert len(actions) <= 1
   if len(actions) == 0:
     return DEFAULT_ACTION
@@ -104,18 +127,29 @@ def report_changes(n_changes, changes, report=[]):
 
 def main(args):
   action = get_action(args)
-  if action != "delete":
-    generator = get_generator(args)
+  if not args["--processes"]:
+    args["--processes"] = 1
+  else:
+    args["--processes"] = int(args["--processes"])
+  if action not in ["delete", "compact"]:
+    generator = get_generator(args, chunks=(action in ["new", "reset"]))
   if action == "new":
     logger.debug("Creating new tree")
     if Path(args["<treefile>"]).exists() and not args["--force"]:
       logger.error("File {} already exists".format(args["<treefile>"]))
       exit(1)
-    if not args["--processes"]:
-      args["--processes"] = 1
+    if not args["--engine"]:
+      args["--engine"] = "auto"
+    if not args["--width"] or args["--width"] == "auto":
+      args["--width"] = "auto"
+    else:
+      args["--width"] = int(args["--width"])
+    if args["--module"]:
+      tree = Tree.construct(generator, args["--processes"], args["--engine"],
+                            args["--width"], args["--remap"])
     else:
-      args["--processes"] = int(args["--processes"])
-    tree = Tree.construct(generator, args["--processes"])
+      tree = Tree.construct_from_chunks(generator, args["--processes"],
+          args["--engine"], args["--width"], args["--remap"])
     tree.set_filename(args["<treefile>"])
     tree.destroy_all_attributes()
   else:
@@ -135,6 +169,9 @@ def main(args):
         n_changes["deleted"] += tree.delete_subtree(int(n),
             list_deleted=changes["deleted"])
       report_changes(n_changes, changes, ["deleted"])
+    elif action == "compact":
+      reclaimed = tree.compact()
+      logger.info("Number of bytes reclaimed: {}".format(reclaimed))
     elif action == "add":
       n_changes["added"] = tree.add_nodes(generator,
           list_added=changes["added"])
@@ -146,5 +183,8 @@ def main(args):
               list_moved=changes["moved"])
       report_changes(n_changes, changes, ["added", "deleted", "moved"])
     elif action == "reset":
-      tree.reset(generator)
+      if args["--module"]:
+        tree.reset(generator)
+      else:
+        tree.reset_from_chunks(generator)
   tree.to_file(args["<treefile>"])
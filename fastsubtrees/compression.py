@@ -0,0 +1,128 @@
+"""
+Transparent reading of compressed input files.
+
+The compression format (gzip, bz2, xz or zstd) is recognized from the
+magic number at the beginning of the file. Decompression is streamed,
+i.e. the file is not decompressed to disk.
+
+The zstd format requires the zstandard package (optional dependency).
+"""
+
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+from fastsubtrees import error
+
+try:
+  import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+  zstandard = None
+
+MAGIC = {"gzip": b"\x1f\x8b",
+         "bz2": b"BZh",
+         "xz": b"\xfd7zXZ\x00",
+         "zstd": b"\x28\xb5\x2f\xfd"}
+
+def detect_compression(filename):
+  """
+  Returns the compression format of a file (gzip, bz2, xz or zstd)
+  or None if the file is not compressed.
+  """
+  with open(filename, "rb") as f:
+    head = f.read(max(len(magic) for magic in MAGIC.values()))
+  for fmt, magic in MAGIC.items():
+    if head.startswith(magic):
+      return fmt
+  return None
+
+def _open_decompressed(filename, fmt):
+  if fmt == "gzip":
+    return gzip.open(filename, "rb")
+  elif fmt == "bz2":
+    return bz2.open(filename, "rb")
+  elif fmt == "xz":
+    return lzma.open(filename, "rb")
+  if zstandard is None:
+    raise error.FastsubtreesError(\
+        f"The file '{filename}' is zstd-compressed, which requires "+\
+        "the zstandard package, but it is not installed")
+  return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"),
+                                                    closefd=True)
+
+class BackgroundReader:
+  """
+  Binary file-like object, which reads blocks of data from another
+  file object in a background thread, so that e.g. decompression
+  overlaps with the processing of the data by the caller.
+
+  The decompression functions of zlib, bz2 and lzma release the GIL,
+  thus they run concurrently with the main thread.
+  """
+
+  def __init__(self, file, blocksize = 1 << 22, n_buffered = 4):
+    self._file = file
+    self._queue = queue.Queue(n_buffered)
+    self._stopped = threading.Event()
+    self._buffer = b""
+    self._eof = False
+    self._thread = threading.Thread(target=self._run, args=(blocksize,),
+                                    daemon=True)
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stopped.is_set():
+      try:
+        self._queue.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        continue
+
+  def _run(self, blocksize):
+    try:
+      while not self._stopped.is_set():
+        data = self._file.read(blocksize)
+        self._put(data)
+        if not data:
+          break
+    except Exception as exc:
+      self._put(exc)
+
+  def read(self, size = -1):
+    """
+    Read up to size bytes (all remaining bytes, if size is negative);
+    returns an empty bytes object only at the end of the file.
+    """
+    while not self._eof and (size < 0 or not self._buffer):
+      item = self._queue.get()
+      if isinstance(item, Exception):
+        raise item
+      if not item:
+        self._eof = True
+      self._buffer += item
+    if size < 0:
+      size = len(self._buffer)
+    data, self._buffer = self._buffer[:size], self._buffer[size:]
+    return data
+
+  def close(self):
+    self._stopped.set()
+    self._thread.join()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def open_binary(filename):
+  """
+  Open a file for reading in binary mode, decompressing it on the fly
+  if it is compressed (in a background thread).
+  """
+  fmt = detect_compression(filename)
+  if fmt is None:
+    return open(filename, "rb")
+  return BackgroundReader(_open_decompressed(filename, fmt))
@@ -10,12 +10,23 @@ from fastsubtrees.ids_modules import ids_from_tabular_file
 
 class TreeEditor():
 
+  # action of update and to_file, if the fraction of empty positions in the
+  # tree data (see get_fragmentation) exceeds compaction_threshold:
+  # 'warn' (log a warning), 'auto' (compact the tree) or 'off' (nothing);
+  # the attributes can be changed for each tree
+  COMPACTION_POLICIES = ["off", "warn", "auto"]
+  compaction_policy = "warn"
+  compaction_threshold = 0.5
+
   def __add_or_move_nodes(self, generator, attrfilenames=[],
       skip_existing=False, rm_existing_set=None, list_added=None,
       list_moved=None, total=None, edit_script=None):
     n_added = 0
     n_moved = 0
     pending = defaultdict(list)
+    # moves of nodes under their current descendants, which are only
+    # possible after the descendants have been moved elsewhere
+    deferred = []
     logger.info("Tree root: " + str(self.root_id))
     if edit_script is None:
       edit_script = []
@@ -28,7 +39,8 @@ class TreeEditor():
       elif parent < 0:
         raise error.ConstructionError(\
             f"The node parent IDs must be >= 0, found: {parent}")
-      if node_number < len(self.parents):
+      node_index = self._index(node_number)
+      if node_index is not None:
         if node_number == self.root_id:
           if skip_existing:
             if node_number == parent:
@@ -40,12 +52,14 @@ class TreeEditor():
           else:
             raise error.ConstructionError(\
                 f"The root node {node_number} already exists")
-        if self.parents[node_number] != self.UNDEF and \
-              self.treedata[self.coords[node_number]] != self.UNDEF:
+        if self.parents[node_index] != self.UNDEF and \
+              self.treedata[self.coords[node_index]] != self.UNDEF:
           if skip_existing:
-            if self.parents[node_number] != parent:
-              if parent >= len(self.parents) or self.coords[parent] == 0:
+            if self.parents[node_index] != parent:
+              if not self.__is_inserted(parent):
                 pending[parent].append(('move', node_number))
+              elif self.is_ancestor(node_number, parent):
+                deferred.append((node_number, parent))
               else:
                 self.__move_subtree(node_number, parent, edit_script)
                 n_moved += 1
@@ -53,14 +67,14 @@ class TreeEditor():
                   list_moved.append(node_number)
             continue
           else:
-            if self.parents[node_number] != parent:
+            if self.parents[node_index] != parent:
               raise error.ConstructionError(\
                 f"Node {node_number} / parent {parent} already exists "+\
-                f"with a different parent ({self.parents[node_number]})")
+                f"with a different parent ({self.parents[node_index]})")
             else:
               raise error.ConstructionError(\
                 f"Node {node_number} / parent {parent} already exists")
-      if parent >= len(self.parents) or self.coords[parent] == 0:
+      if not self.__is_inserted(parent):
         pending[parent].append(("insert", node_number))
       else:
         self.__insert_node(node_number, parent, edit_script, list_added)
@@ -75,11 +89,28 @@ class TreeEditor():
                 n_added += 1
                 stack.append(child[1])
               elif child[0] == "move":
+                if self.is_ancestor(child[1], node):
+                  deferred.append((child[1], node))
+                  continue
                 self.__move_subtree(child[1], node, edit_script)
                 n_moved += 1
                 if list_moved is not None:
                   list_moved.append(child[1])
             del pending[node]
+    while deferred:
+      for move in deferred:
+        if not self.is_ancestor(*move):
+          break
+      else:
+        node_number, parent = deferred[0]
+        raise error.ConstructionError(\
+            f"Node {node_number} cannot be moved under its descendant "+\
+            f"{parent} (the parent relationships contain a cycle)")
+      deferred.remove(move)
+      self.__move_subtree(move[0], move[1], edit_script)
+      n_moved += 1
+      if list_moved is not None:
+        list_moved.append(move[0])
     if len(pending) > 0:
       raise error.ConstructionError(\
           "Impossible operations because the node parents " + \
@@ -87,44 +118,59 @@ class TreeEditor():
     self._edit_attribute_values(edit_script, attrfilenames)
     return n_added, n_moved
 
+  def __is_inserted(self, node_number):
+    node_index = self._index(node_number)
+    return node_index is not None and self.coords[node_index] != 0
+
   def __insert_node(self, node_number, parent, edit_script, list_added):
     # the idea for the insertion is the following
     # - in treedata, the insertion position is after the parent
     # - thus coords must be updated, adding 1 to all the coords >= inspos
-    # - if the node_number is larger than the current max_node_number then
-    #   parents/coords and subtree_sizes must be extended
+    # - if the node_number is not yet contained in the arrays, then
+    #   parents/coords and subtree_sizes must be extended (see _insert_index)
     # - the parents/coords/subtree_sizes values for the node must be set
     #   (to parent/inspos/0)
     # - subtree_sizes must be updated, adding 1 to all ancestors of node_number
-    assert self.coords[parent] > 0
-    inspos = self.coords[parent] + 1
+    # - the depth of the node is the depth of the parent + 1
+    parent_index = self._index(parent)
+    assert self.coords[parent_index] > 0
+    depth = self.depths[parent_index] + 1
+    self._make_writable()
+    self.generation += 1
+    self._fit_width(max(node_number, len(self.treedata) + 1))
+    inspos = self.coords[parent_index] + 1
     n_existing = len(self.coords)
     for i in range(n_existing):
       if self.coords[i] >= inspos:
         self.coords[i] += 1
     self.treedata.insert(inspos, node_number)
     edit_script.append(("insert", inspos))
-    n_to_append = node_number + 1 - n_existing
-    if n_to_append > 0:
-      self.coords.extend([0] * n_to_append)
-      self.parents.extend([self.UNDEF] * n_to_append)
-      self.subtree_sizes.extend([0] * n_to_append)
-    self.coords[node_number] = inspos
-    self.parents[node_number] = parent
-    self.subtree_sizes[node_number] = 1
+    node_index = self._insert_index(node_number)
+    self.coords[node_index] = inspos
+    self.parents[node_index] = parent
+    self.subtree_sizes[node_index] = 1
+    self.tombstones[node_index] = 0
+    self.depths[node_index] = depth
     if list_added is not None:
       list_added.append(node_number)
-    p = self.parents[node_number]
-    while p != node_number:
+    p = parent
+    while True:
       assert p != self.UNDEF
-      self.subtree_sizes[p] += 1
-      node_number = p
-      p = self.parents[node_number]
+      p_index = self._index(p)
+      self.subtree_sizes[p_index] += 1
+      gp = self.parents[p_index]
+      if gp == p:
+        break
+      p = gp
 
   def __move_subtree(self, subtree_root, new_parent, edit_script):
-    subtree_size = self.subtree_sizes[subtree_root]
-    assert self.coords[new_parent] > 0
-    inspos = self.coords[new_parent] + 1
+    root_index = self._index(subtree_root)
+    subtree_size = self.subtree_sizes[root_index]
+    assert self.coords[self._index(new_parent)] > 0
+    self._make_writable()
+    self.generation += 1
+    self._fit_width(len(self.treedata) + subtree_size)
+    inspos = self.coords[self._index(new_parent)] + 1
     for i in range(subtree_size):
       self.treedata.insert(inspos, self.UNDEF)
       edit_script.append(("insert", inspos))
@@ -132,35 +178,55 @@ class TreeEditor():
     for i in range(n_existing):
       if self.coords[i] >= inspos:
         self.coords[i] += subtree_size
-    oldpos = self.coords[subtree_root]
+    oldpos = self.coords[root_index]
+    new_depth = self.depths[self._index(new_parent)] + 1
+    old_depth = self.depths[root_index]
+    # the old positions of the subtree nodes become deleted nodes
+    # in the subtrees of the old ancestors
+    moved_tombstones = self.tombstones[root_index]
+    p = self.parents[root_index]
+    while True:
+      p_index = self._index(p)
+      self.tombstones[p_index] += subtree_size - moved_tombstones
+      gp = self.parents[p_index]
+      if gp == p:
+        break
+      p = gp
     for i in range(subtree_size):
       nodenum = self.treedata[oldpos + i]
       self.treedata[inspos + i] = nodenum
       if nodenum != self.UNDEF:
-        self.coords[nodenum] = inspos + i
+        node_index = self._index(nodenum)
+        self.coords[node_index] = inspos + i
+        self.depths[node_index] = \
+            self.depths[node_index] + new_depth - old_depth
         edit_script.append(("copy", oldpos + i, inspos + i))
       self.treedata[oldpos + i] = self.UNDEF
       edit_script.append(("delete", oldpos + i))
-    self.parents[subtree_root] = new_parent
+    self.parents[root_index] = new_parent
     p = new_parent
     while True:
-      self.subtree_sizes[p] += subtree_size
-      gp = self.parents[p]
+      p_index = self._index(p)
+      self.subtree_sizes[p_index] += subtree_size
+      self.tombstones[p_index] += moved_tombstones
+      gp = self.parents[p_index]
       if gp == p:
         break
       p = gp
 
   def __delete_subtree(self, node_number, attrfilenames=[],
                      list_deleted = None, edit_script = None):
-    try:
-      coord = self.coords[node_number]
-    except IndexError:
+    node_index = self._index(node_number)
+    if node_index is None:
       raise error.NodeNotFoundError(\
           f"The node ID does not exist: {node_number}")
+    coord = self.coords[node_index]
     n_deleted = 0
+    self._make_writable()
+    self.generation += 1
     if edit_script is None:
       edit_script = []
-    subtree_size = self.subtree_sizes[node_number]
+    subtree_size = self.subtree_sizes[node_index]
     for i in range(subtree_size):
       delpos = coord + i
       if self.treedata[delpos] != self.UNDEF:
@@ -171,6 +237,14 @@ class TreeEditor():
         if list_deleted is not None:
           list_deleted.append(deleted)
         # logger.info(f"Deleted node {deleted} at position {delpos}")
+    p = node_number
+    while n_deleted:
+      p_index = self._index(p)
+      self.tombstones[p_index] += n_deleted
+      gp = self.parents[p_index]
+      if gp == p:
+        break
+      p = gp
     self._edit_attribute_values(edit_script, attrfilenames)
     return n_deleted
 
@@ -200,7 +274,7 @@ class TreeEditor():
     self._check_node_number(new_parent)
     if self.get_parent(subtree_root) == new_parent:
       return
-    if new_parent in self.subtree_ids(subtree_root):
+    if self.is_ancestor(subtree_root, new_parent):
       raise error.ConstructionError(\
           "A node cannot be moved to be a descendant of itself")
     edit_script = []
@@ -249,6 +323,85 @@ class TreeEditor():
         list_added=list_added, total=total)
     return n_added
 
+  def compact(self) -> int:
+    """
+    Removes the deleted nodes from the tree data, i.e. the positions which
+    were left empty by delete_subtree and move_subtree; the deleted nodes
+    can then be added again as new nodes.
+    If the tree filename is set and attributes exist, then the
+    corresponding lines of the attribute files are removed.
+
+    Returns the number of bytes reclaimed (in the tree arrays and
+    in the attribute files).
+    """
+    return self._compact()
+
+  def _compact(self, save=None) -> int:
+    """
+    Compact the tree (see compact). If save is given, it is called after
+    the tree arrays are compacted and before the attribute files are
+    modified (e.g. to save the tree file); if it fails, the previous
+    arrays are restored, so that the tree still matches the attribute
+    files.
+    """
+    attrfilenames = self.__get_attrfilenames()
+    nbytes = self._nbytes() + \
+        sum(Path(fn).stat().st_size for fn in attrfilenames)
+    n_positions = len(self.treedata)
+    self._make_writable()
+    previous = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+    previous["generation"] = self.generation
+    self.generation += 1
+    keep = self._compact_arrays()
+    if save is not None:
+      try:
+        save()
+      except BaseException:
+        for name, value in previous.items():
+          setattr(self, name, value)
+        raise
+    self._compact_attribute_values(keep, attrfilenames)
+    self.clear_attributes_cache()
+    reclaimed = nbytes - self._nbytes() - \
+        sum(Path(fn).stat().st_size for fn in attrfilenames)
+    logger.debug(f"Tree compacted: {n_positions - len(self.treedata)} "+\
+        f"empty positions removed, {reclaimed} bytes reclaimed")
+    return reclaimed
+
+  def _apply_compaction_policy(self, can_compact: bool = True, save=None):
+    """
+    Compact the tree or log a warning, if the fraction of empty positions
+    exceeds the threshold (see compaction_policy); the warning is logged
+    once for each state of the tree.
+
+    If save is given, it is called in any case, when the tree is
+    compacted before the attribute files are modified (see _compact).
+    """
+    compacted = self.__apply_compaction_policy(can_compact, save)
+    if save is not None and not compacted:
+      save()
+
+  def __apply_compaction_policy(self, can_compact, save):
+    if self.compaction_policy not in self.COMPACTION_POLICIES:
+      raise error.FastsubtreesError(\
+          f"Unknown compaction policy '{self.compaction_policy}', "+\
+          f"available policies: {', '.join(self.COMPACTION_POLICIES)}")
+    if self.compaction_policy == "off":
+      return False
+    fragmentation = self.get_fragmentation()
+    if fragmentation <= self.compaction_threshold:
+      return False
+    if self.compaction_policy == "auto" and can_compact:
+      logger.info(f"{fragmentation:.0%} of the positions of the tree data "+\
+          "are empty, compacting the tree")
+      self._compact(save)
+      return True
+    elif self._fragmentation_warned != self.generation:
+      self._fragmentation_warned = self.generation
+      logger.warning(f"{fragmentation:.0%} of the positions of the tree "+\
+          "data are empty (deleted nodes), consider compacting the tree")
+    return False
+
   def update(self, generator: Iterator[Tuple[int, int]],
              list_added: Union[None, List[int]] = None,
              list_deleted: Union[None, List[int]] = None,
@@ -284,6 +437,7 @@ class TreeEditor():
       n_deleted += self.__delete_subtree(n, list_deleted=list_deleted,
           edit_script=edit_script)
     self._edit_attribute_values(edit_script, attrfilenames)
+    self._apply_compaction_policy()
     return n_added, n_deleted, n_moved
 
   def update_from_tabular(self, filename: Union[str, Path],
@@ -322,14 +476,24 @@ class TreeEditor():
     If total is provided, then it is used to display a progress bar.
     It should be set to the total number of tuples yielded by the generator.
     """
+    self.__reset(lambda remap: self._construct(generator, remap=remap))
+
+  def reset_from_chunks(self, chunks):
+    """
+    Resets the tree with the nodes in chunks of (elements, parents) arrays
+    (see Tree.construct_from_chunks).
+    """
+    self.__reset(lambda remap: \
+        self._construct_from_chunks(chunks, remap=remap))
+
+  def __reset(self, construct):
     self._check_filename_set()
     attrnames = self.list_attributes()
     for attrname in attrnames:
       self.dump_attribute_values(attrname)
+    remap = self.is_remapped()
     self._reset_data()
-    self._compute_parents(generator)
-    self._compute_subtree_sizes()
-    self._compute_treedata_and_coords()
+    construct(remap)
     for attrname in attrnames:
       self.create_attribute_from_dump(attrname)
 
@@ -337,12 +501,12 @@ class TreeEditor():
                          separator: str = "\t", elem_field_num: int = 0,
                          parent_field_num: int = 1,
                          total: Union[None, int] = None):
-    generator = ids_from_tabular_file.element_parent_ids(filename, separator,
-        elem_field_num, parent_field_num)
-    self.reset(generator, total=total)
+    chunks = ids_from_tabular_file.element_parent_id_chunks(filename,
+        separator, elem_field_num, parent_field_num)
+    self.reset_from_chunks(chunks)
 
   def reset_from_ncbi_dump(self, filename: Union[str, Path],
                            total: Union[None, int] = None):
-    generator = ids_from_tabular_file.element_parent_ids(filename,
+    chunks = ids_from_tabular_file.element_parent_id_chunks(filename,
         ncbi_preset=True)
-    self.reset(generator, total=total)
+    self.reset_from_chunks(chunks)
@@ -10,6 +10,10 @@ class ConstructionError(FastsubtreesError):
   """error while constructing the tree"""
   pass
 
+class CycleError(ConstructionError):
+  """nodes not connected to the root (cycle in the parent relationships)"""
+  pass
+
 class NodeNotFoundError(FastsubtreesError):
   """error because node does not exist in the tree"""
   pass
@@ -1,14 +1,188 @@
-from fastsubtrees import logger, tqdm
+import array
+import os
+from multiprocessing import Pool
+from fastsubtrees import logger, tqdm, vectorized, compression
 
 NCBI_DUMP_SEP = "\t|\t"
+NCBI_DUMP_LINE_END = "\t|\n"
 NCBI_DUMP_TAXID_COL = 0
 NCBI_DUMP_PARENT_COL = 1
 
+BLOCKSIZE = 1 << 24
+
+def _blocks(inputfile, blocksize, compressed = False):
+  """
+  Read a file in blocks of complete lines; each block ends with a newline.
+
+  Compressed files are decompressed on the fly; in this case the
+  progress bar shows the number of decompressed bytes.
+  """
+  total = None if compressed else os.path.getsize(inputfile)
+  with compression.open_binary(inputfile) as file, \
+      tqdm(total=total, unit="B", unit_scale=True) as progress:
+    rest = b""
+    while True:
+      data = file.read(blocksize)
+      if not data:
+        break
+      progress.update(len(data))
+      data = rest + data
+      cut = data.rfind(b"\n") + 1
+      rest = data[cut:]
+      if cut:
+        yield data[:cut]
+    if rest:
+      yield rest + b"\n"
+
+def _line_boundaries(inputfile, blocksize):
+  """
+  Split a file into byte ranges of about blocksize bytes, each of which
+  starts at the beginning of a line. Returns the boundaries of the ranges.
+  """
+  size = os.path.getsize(inputfile)
+  boundaries = [0]
+  with open(inputfile, "rb") as file:
+    while boundaries[-1] + blocksize < size:
+      file.seek(boundaries[-1] + blocksize - 1)
+      file.readline()
+      boundaries.append(file.tell())
+  if boundaries[-1] < size:
+    boundaries.append(size)
+  return boundaries
+
+def _read_range(inputfile, start, end):
+  with open(inputfile, "rb") as file:
+    file.seek(start)
+    block = file.read(end - start)
+  if not block.endswith(b"\n"):
+    block += b"\n"
+  return block
+
+def _parse_range(args):
+  inputfile, start, end, parse_args = args
+  elements, parents = _parse(_read_range(inputfile, start, end), *parse_args)
+  return elements, parents, end - start
+
+def _parse_block(args):
+  block, parse_args = args
+  return _parse(block, *parse_args)
+
+def _parallel_chunks(inputfile, blocksize, n_processes, parse_args):
+  """
+  Parse the byte ranges of a file in n_processes worker processes;
+  the chunks are yielded in the order of the ranges in the file.
+  """
+  boundaries = _line_boundaries(inputfile, blocksize)
+  ranges = [(inputfile, start, end, parse_args) \
+            for start, end in zip(boundaries[:-1], boundaries[1:])]
+  logger.debug(f"Parsing {len(ranges)} byte ranges "+\
+               f"using {n_processes} processes")
+  with Pool(n_processes) as pool, \
+      tqdm(total=boundaries[-1], unit="B", unit_scale=True) as progress:
+    for elements, parents, nbytes in pool.imap(_parse_range, ranges):
+      progress.update(nbytes)
+      yield elements, parents
+
+def _parallel_compressed_chunks(inputfile, blocksize, n_processes,
+                                parse_args):
+  """
+  Parse the blocks of a compressed file, which is decompressed
+  by the main process, in n_processes worker processes.
+  """
+  logger.debug(f"Parsing blocks using {n_processes} processes")
+  with Pool(n_processes) as pool:
+    yield from pool.imap(_parse_block, ((block, parse_args) \
+        for block in _blocks(inputfile, blocksize, compressed=True)))
+
+def _parse_lines(block, separator, element_id_column, parent_id_column,
+                 comment_pfx):
+  """
+  Parse a block line by line (used if NumPy is not available or
+  the block cannot be parsed in bulk).
+  """
+  elements = array.array("q")
+  parents = array.array("q")
+  for line in block.split(b"\n")[:-1]:
+    if comment_pfx and line.startswith(comment_pfx):
+      continue
+    fields = line.rstrip().split(separator)
+    elements.append(int(fields[element_id_column]))
+    parents.append(int(fields[parent_id_column]))
+  return elements, parents
+
+def _remove_comments(block, comment_pfx):
+  if comment_pfx and (block.startswith(comment_pfx) or \
+      b"\n" + comment_pfx in block):
+    return b"".join(line for line in block.splitlines(keepends=True) \
+                    if not line.startswith(comment_pfx))
+  return block
+
+def _parse(block, separator, line_end, element_id_column, parent_id_column,
+           comment_pfx):
+  block = _remove_comments(block, comment_pfx)
+  if not block:
+    return array.array("q"), array.array("q")
+  chunk = None
+  if vectorized.numpy_available():
+    chunk = vectorized.parse_int_columns(block, separator, line_end,
+                                         [element_id_column, parent_id_column])
+  if chunk is None:
+    chunk = _parse_lines(block, separator, element_id_column,
+                         parent_id_column, comment_pfx)
+  return chunk
+
+def element_parent_id_chunks(inputfile, separator = '\t',
+                             element_id_column = 0, parent_id_column = 1,
+                             comment_pfx = "#", ncbi_preset = False,
+                             blocksize = BLOCKSIZE, n_processes = 1):
+  """
+  Reads a tabular file in large blocks and yield (element_ids, parent_ids)
+  chunks, i.e. pairs of arrays of signed 64-bit integers
+  (NumPy arrays, if NumPy is installed, otherwise array.array).
+
+  Only the two required columns of each line are converted to integers.
+  The arguments are the same as for element_parent_ids(), in addition to:
+    blocksize: size in bytes of the blocks read from file
+    n_processes: number of processes parsing the blocks; if > 1,
+                 the file is split at line boundaries into byte ranges
+                 of blocksize bytes, which are parsed in parallel
+                 (compressed files are instead decompressed by the
+                 main process and the blocks are parsed in parallel)
+  """
+  logger.info(f"Reading data from file \"{inputfile}\" ...")
+  line_end = "\n"
+  if ncbi_preset:
+    separator = NCBI_DUMP_SEP
+    line_end = NCBI_DUMP_LINE_END
+    element_id_column = NCBI_DUMP_TAXID_COL
+    parent_id_column = NCBI_DUMP_PARENT_COL
+  separator = separator.encode()
+  line_end = line_end.encode()
+  comment_pfx = comment_pfx.encode() if comment_pfx else None
+  element_id_column = int(element_id_column)
+  parent_id_column = int(parent_id_column)
+  parse_args = (separator, line_end, element_id_column, parent_id_column,
+                comment_pfx)
+  compressed = compression.detect_compression(inputfile)
+  if compressed:
+    logger.debug(f"Decompressing {compressed}-compressed input file")
+  if n_processes > 1:
+    if compressed:
+      yield from _parallel_compressed_chunks(inputfile, blocksize,
+                                             n_processes, parse_args)
+    else:
+      yield from _parallel_chunks(inputfile, blocksize, n_processes,
+                                  parse_args)
+  else:
+    for block in _blocks(inputfile, blocksize, compressed is not None):
+      yield _parse(block, *parse_args)
+
 def element_parent_ids(inputfile, separator = '\t',
                        element_id_column = 0, parent_id_column = 1,
                        comment_pfx = "#", ncbi_preset = False):
   """
   Reads a tabular file and yield (element_id, parent_id) pairs.
+  The file can be compressed using gzip, bz2, xz or zstd.
 
   Args:
     inputfile: tabular file to read
@@ -18,16 +192,6 @@ def element_parent_ids(inputfile, separator = '\t',
     comment_pfx: prefix of lines to be skipped (default: '#')
     ncbi_preset: use NCBI dump preset (default: False)
   """
-  logger.info(f"Reading data from file \"{inputfile}\" ...")
-  if ncbi_preset:
-    separator = NCBI_DUMP_SEP
-    element_id_column = NCBI_DUMP_TAXID_COL
-    parent_id_column = NCBI_DUMP_PARENT_COL
-  with open(inputfile) as file:
-    for line in tqdm(file):
-      if comment_pfx and line.startswith(comment_pfx):
-        continue
-      fields = line.rstrip().split(separator)
-      element = int(fields[element_id_column])
-      parent = int(fields[parent_id_column])
-      yield element, parent
+  for elements, parents in element_parent_id_chunks(inputfile, separator,
+      element_id_column, parent_id_column, comment_pfx, ncbi_preset):
+    yield from zip(elements.tolist(), parents.tolist())
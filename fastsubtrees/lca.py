@@ -0,0 +1,192 @@
+"""
+Lowest common ancestor (LCA) and level ancestor indices of a tree
+(requires NumPy).
+
+The LCA index is a range minimum query structure over the depth-first order
+of the tree (treedata): for two nodes at positions i < j of treedata,
+their LCA is the parent of the shallowest node at the positions i+1..j
+(or the node at position i itself, if it is an ancestor of the other).
+
+For each position, the key depth * len(treedata) + position is stored
+(deleted nodes have the key INF), thus the minimum key identifies the
+position of the shallowest node. The keys are divided into blocks of
+BLOCKSIZE positions; a range minimum is the minimum of a suffix of a block,
+a prefix of another block and, for the blocks between them, of two entries
+of a sparse table of the block minima; ranges inside a block are scanned.
+
+The LCA index can be saved to a file, which uses the container format of
+the tree files (see the treefile module).
+
+The level ancestor index contains the keys of all nodes, sorted: thus the
+nodes of each depth are sorted by position and the ancestor at depth k of
+the node at position i is the last node of depth k at a position <= i,
+found by binary search.
+"""
+
+import zlib
+from fastsubtrees import vectorized, treefile, error, logger
+
+BLOCKSIZE = 64
+
+def fingerprint(tree) -> int:
+  """
+  Checksum of the arrays of the tree, which determine the index
+  (the treedata and subtree_sizes arrays).
+  """
+  checksum = zlib.crc32(memoryview(tree.treedata).cast("B"))
+  return zlib.crc32(memoryview(tree.subtree_sizes).cast("B"), checksum)
+
+def _live_positions(tree):
+  """
+  Positions in treedata and depths of the nodes of the tree
+  (excluding deleted nodes), as NumPy arrays.
+  """
+  np = vectorized.np
+  treedata = vectorized.from_array(tree.treedata)
+  coords = vectorized.from_array(tree.coords)
+  node_ids = vectorized.from_array(tree.ids) if tree.ids is not None \
+      else np.arange(len(coords))
+  live = (coords > 0) & (treedata[coords] == node_ids)
+  return coords[live], vectorized.from_array(tree.depths)[live]
+
+class LCAIndex:
+  """
+  Lowest common ancestor index of a tree (see the module documentation).
+  """
+
+  def __init__(self, keys, sparse, fingerprint, generation):
+    np = vectorized.np
+    self.INF = np.iinfo(np.int64).max
+    self.keys = keys
+    self.sparse = sparse
+    self.fingerprint = fingerprint
+    # generation of the tree, for which the index was computed
+    self.generation = generation
+    n_blocks = -(-len(keys) // BLOCKSIZE)
+    blocks = np.full(n_blocks * BLOCKSIZE, self.INF, dtype=np.int64)
+    blocks[:len(keys)] = keys
+    blocks = blocks.reshape(n_blocks, BLOCKSIZE)
+    self.prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    self.suffix = \
+        np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+
+  @classmethod
+  def build(cls, tree):
+    """
+    Compute the index of a tree (in linear time).
+    """
+    vectorized.require_numpy("the LCA index")
+    np = vectorized.np
+    logger.info("Computing the LCA index...")
+    positions, depths = _live_positions(tree)
+    n = len(tree.treedata)
+    keys = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    keys[positions] = depths * n + positions
+    n_blocks = -(-n // BLOCKSIZE)
+    block_min = np.full(n_blocks * BLOCKSIZE, np.iinfo(np.int64).max,
+                        dtype=np.int64)
+    block_min[:n] = keys
+    block_min = block_min.reshape(n_blocks, BLOCKSIZE).min(axis=1)
+    n_levels = max(n_blocks.bit_length(), 1)
+    sparse = np.full((n_levels, n_blocks), np.iinfo(np.int64).max,
+                     dtype=np.int64)
+    sparse[0] = block_min
+    for k in range(1, n_levels):
+      half = 1 << (k - 1)
+      sparse[k, :n_blocks - half] = \
+          np.minimum(sparse[k - 1, :n_blocks - half], sparse[k - 1, half:])
+    return cls(keys, sparse, fingerprint(tree), tree.generation)
+
+  def to_file(self, filename, tree):
+    """
+    Save the index of the given tree to file.
+    """
+    np = vectorized.np
+    arrays = [("keys", vectorized.to_array(self.keys)),
+              ("sparse", vectorized.to_array(self.sparse.ravel())),
+              ("fingerprint",
+               vectorized.to_array(np.array([self.fingerprint])))]
+    treefile.write(filename, 64, 0, tree.root_id, tree.get_treesize(),
+                   self.generation, arrays)
+    logger.info(f"LCA index written to file \"{filename}\"")
+
+  @classmethod
+  def from_file(cls, filename):
+    """
+    Load an index from file.
+    """
+    vectorized.require_numpy("the LCA index")
+    with open(filename, "rb") as f:
+      header = treefile.read_header(f, filename)
+      keys, sparse, checksum = \
+          [vectorized.from_array(treefile.read_section(f, filename, header,
+                                                       name))
+           for name in ["keys", "sparse", "fingerprint"]]
+    n_blocks = -(-len(keys) // BLOCKSIZE)
+    if n_blocks == 0 or len(sparse) % n_blocks or len(checksum) != 1:
+      raise error.FastsubtreesError(\
+          f"Invalid LCA index file \"{filename}\": inconsistent sections")
+    logger.debug(f"LCA index loaded from file \"{filename}\"")
+    return cls(keys, sparse.reshape(-1, n_blocks), int(checksum[0]),
+               header.generation)
+
+  def range_min(self, starts, ends):
+    """
+    Minimum key in the positions starts[i]..ends[i] (inclusive)
+    for each i, where starts <= ends.
+    """
+    np = vectorized.np
+    start_blocks = starts // BLOCKSIZE
+    end_blocks = ends // BLOCKSIZE
+    result = np.minimum(self.suffix[starts], self.prefix[ends])
+    inner = end_blocks - start_blocks > 1
+    if inner.any():
+      first = start_blocks[inner] + 1
+      n_inner = end_blocks[inner] - first
+      k = np.frexp(n_inner)[1].astype(np.int64) - 1
+      result[inner] = np.minimum(result[inner],
+          np.minimum(self.sparse[k, first],
+                     self.sparse[k, first + n_inner - (1 << k)]))
+    same = start_blocks == end_blocks
+    if same.any():
+      same_starts = starts[same]
+      same_ends = ends[same]
+      minimum = np.full(len(same_starts), self.INF, dtype=np.int64)
+      for offset in range(int((same_ends - same_starts).max()) + 1):
+        pos = np.minimum(same_starts + offset, same_ends)
+        np.minimum(minimum, self.keys[pos], out=minimum)
+      result[same] = minimum
+    return result
+
+  def shallowest_positions(self, starts, ends):
+    """
+    Position of the shallowest node in the positions starts[i]..ends[i]
+    (inclusive) of treedata, for each i, where starts <= ends.
+    """
+    return self.range_min(starts, ends) % len(self.keys)
+
+class LevelIndex:
+  """
+  Level ancestor index of a tree (see the module documentation).
+  """
+
+  def __init__(self, tree):
+    vectorized.require_numpy("the level ancestor index")
+    np = vectorized.np
+    logger.debug("Computing the level ancestor index...")
+    positions, depths = _live_positions(tree)
+    self.n = len(tree.treedata)
+    self.keys = np.sort(depths * self.n + positions)
+    # generation of the tree, for which the index was computed
+    self.generation = tree.generation
+
+  def ancestor_positions(self, positions, depths):
+    """
+    Positions in treedata of the ancestors at the given depths of the nodes
+    at the given positions (the depths must not exceed the depths of the
+    nodes).
+    """
+    np = vectorized.np
+    found = np.searchsorted(self.keys, depths * self.n + positions,
+                            side="right") - 1
+    return self.keys[found] % self.n
@@ -0,0 +1,236 @@
+"""
+Parallel validation of the parents table and computation of the subtree sizes.
+
+The node IDs are split into contiguous ranges, one for each worker process.
+Each worker computes the subtree sizes of the nodes in its range, using the
+same bottom-up algorithm as Tree._compute_subtree_sizes, i.e. each node
+adds its size to its parent once, when the sizes of all its children are known.
+
+The parents table, the subtree sizes table and the messages exchanged by the
+workers are stored in shared memory buffers (multiprocessing.shared_memory),
+thus they are neither pickled nor copied to or from the worker processes:
+- the parents table is written once by the main process and read by the
+  workers;
+- each worker writes the subtree sizes of the nodes of its range in place;
+- when the parent of a node belongs to the range of another worker, the
+  contribution is appended to the outbox buffer of the worker; only the
+  positions of the messages in the outbox buffers are sent through pipes
+  to the main process, which forwards them to the other workers at the end
+  of each round. The computation ends when a round does not produce messages.
+"""
+
+import array
+import bisect
+from collections import defaultdict
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from fastsubtrees import logger, error
+
+# each message is a triple of unsigned 64-bit integers:
+# - (node, n_children, 0): number of children of node in the sender range
+# - (node, size, n_completed): sum of the sizes of completed children of node
+MSGLEN = 3
+ITEMSIZE = array.array("Q").itemsize
+
+def _range_end(i, starts, n_nodes):
+  return starts[i + 1] if i + 1 < len(starts) else n_nodes
+
+def _outbox_capacity(i, starts, n_nodes):
+  # each node sends at most one children count and one size message
+  return 2 * (_range_end(i, starts, n_nodes) - starts[i])
+
+def _validate_range(parents, start, end, undef):
+  """
+  Returns an error message for the first invalid node of the range,
+  or None if all nodes of the range are valid.
+  """
+  n_nodes = len(parents)
+  for elem in range(start, end):
+    parent = parents[elem]
+    if parent == undef or parent == elem:
+      continue
+    if parent >= n_nodes:
+      return f"The node '{elem}' has parent '{parent}', "+\
+             "which is not in the tree"
+    if parents[parent] == undef:
+      return f"The node '{parent}' has parent '{undef}', "+\
+             "which is not in the tree"
+  return None
+
+def _send_messages(conn, outbox, offset, messages, starts):
+  """
+  Append the messages to the outbox, grouped by destination worker,
+  and send the positions of the groups to the main process.
+  Returns the new offset in the outbox.
+  """
+  by_dest = defaultdict(list)
+  for node, (value1, value2) in messages.items():
+    by_dest[bisect.bisect_right(starts, node) - 1].extend(\
+        (node, value1, value2))
+  segments = []
+  for dest, values in by_dest.items():
+    n_msgs = len(values) // MSGLEN
+    outbox[offset * MSGLEN:(offset + n_msgs) * MSGLEN] = \
+        array.array("Q", values)
+    segments.append((dest, offset, offset + n_msgs))
+    offset += n_msgs
+  conn.send(segments)
+  return offset
+
+def _received_messages(segments, outboxes):
+  for src, begin, end in segments:
+    outbox = outboxes[src]
+    for pos in range(begin * MSGLEN, end * MSGLEN, MSGLEN):
+      yield outbox[pos], outbox[pos + 1], outbox[pos + 2]
+
+def _complete_nodes(completed, start, end, parents, subtree_sizes, pending):
+  """
+  Propagate the sizes of the completed nodes to their parents.
+
+  Returns the contributions to parents outside of the range of the worker,
+  as a dictionary {parent: (sum_of_sizes, number_of_completed_children)}.
+  """
+  messages = {}
+  for elem in completed:
+    while True:
+      parent = parents[elem]
+      if parent == elem:
+        break
+      if start <= parent < end:
+        subtree_sizes[parent] += subtree_sizes[elem]
+        pending[parent - start] -= 1
+        if pending[parent - start]:
+          break
+        elem = parent
+      else:
+        size, n = messages.get(parent, (0, 0))
+        messages[parent] = (size + subtree_sizes[elem], n + 1)
+        break
+  return messages
+
+def _subtree_sizes(conn, i, starts, parents, subtree_sizes, outboxes, undef):
+  start = starts[i]
+  end = _range_end(i, starts, len(parents))
+  conn.send(_validate_range(parents, start, end, undef))
+  if not conn.recv():
+    return
+  pending = array.array("Q", [0] * (end - start))
+  n_children = defaultdict(int)
+  for elem in range(start, end):
+    parent = parents[elem]
+    if parent == undef:
+      subtree_sizes[elem] = 0
+      continue
+    subtree_sizes[elem] = 1
+    if parent == elem:
+      continue
+    if start <= parent < end:
+      pending[parent - start] += 1
+    else:
+      n_children[parent] += 1
+  offset = _send_messages(conn, outboxes[i], 0,
+      {node: (n, 0) for node, n in n_children.items()}, starts)
+  for node, n, _ in _received_messages(conn.recv(), outboxes):
+    pending[node - start] += n
+  completed = [elem for elem in range(start, end) \
+               if parents[elem] != undef and pending[elem - start] == 0]
+  while True:
+    messages = _complete_nodes(completed, start, end, parents,
+                               subtree_sizes, pending)
+    offset = _send_messages(conn, outboxes[i], offset, messages, starts)
+    segments = conn.recv()
+    if segments is None:
+      break
+    completed = []
+    for node, size, n in _received_messages(segments, outboxes):
+      subtree_sizes[node] += size
+      pending[node - start] -= n
+      if not pending[node - start]:
+        completed.append(node)
+
+def _subtree_sizes_worker(conn, i, starts, shm_names, undef):
+  buffers = [SharedMemory(name=name) for name in shm_names]
+  views = [buf.buf.cast("Q") for buf in buffers]
+  try:
+    _subtree_sizes(conn, i, starts, views[0], views[1], views[2:], undef)
+  finally:
+    for view in views:
+      view.release()
+    for buf in buffers:
+      buf.close()
+    conn.close()
+
+def _shared_buffer(n_elements):
+  # shared memory segments must have a positive size
+  return SharedMemory(create=True, size=max(1, n_elements) * ITEMSIZE)
+
+def _route(conns, n_workers):
+  """
+  Collect the positions of the messages sent by each worker and group
+  them by destination worker. Returns None if no message was sent.
+  """
+  inboxes = [[] for _ in range(n_workers)]
+  any_message = False
+  for src, conn in enumerate(conns):
+    for dest, begin, end in conn.recv():
+      inboxes[dest].append((src, begin, end))
+      any_message = True
+  return inboxes if any_message else None
+
+def _run_workers(conns, n_workers):
+  errors = [msg for msg in [conn.recv() for conn in conns] if msg]
+  for conn in conns:
+    conn.send(not errors)
+  if errors:
+    raise error.ConstructionError(errors[0])
+  inboxes = _route(conns, n_workers) or [[] for _ in range(n_workers)]
+  n_rounds = 0
+  while inboxes is not None:
+    for conn, inbox in zip(conns, inboxes):
+      conn.send(inbox)
+    inboxes = _route(conns, n_workers)
+    n_rounds += 1
+  for conn in conns:
+    conn.send(None)
+  logger.debug(f"Subtree sizes exchanged in {n_rounds} rounds")
+
+def compute_subtree_sizes(parents, n_processes, undef):
+  """
+  Validate the parents table and compute the subtree sizes table,
+  using n_processes worker processes.
+  """
+  n_nodes = len(parents)
+  starts = [i * n_nodes // n_processes for i in range(n_processes)]
+  parents_buf = _shared_buffer(n_nodes)
+  sizes_buf = _shared_buffer(n_nodes)
+  outbox_bufs = [_shared_buffer(_outbox_capacity(i, starts, n_nodes) * \
+                                MSGLEN) for i in range(n_processes)]
+  buffers = [parents_buf, sizes_buf] + outbox_bufs
+  conns = []
+  workers = []
+  try:
+    parents_buf.buf[:n_nodes * ITEMSIZE] = memoryview(parents).cast("B")
+    for i in range(n_processes):
+      logger.info(f"Process {i} computes subtree sizes for nodes "+\
+          f"{starts[i]} to {_range_end(i, starts, n_nodes)}...")
+      conn, worker_conn = Pipe()
+      worker = Process(target=_subtree_sizes_worker,
+          args=(worker_conn, i, starts, [b.name for b in buffers], undef))
+      worker.start()
+      worker_conn.close()
+      conns.append(conn)
+      workers.append(worker)
+    _run_workers(conns, n_processes)
+    for worker in workers:
+      worker.join()
+    subtree_sizes = array.array("Q")
+    subtree_sizes.frombytes(sizes_buf.buf[:n_nodes * ITEMSIZE])
+  finally:
+    for worker in workers:
+      if worker.is_alive():
+        worker.terminate()
+        worker.join()
+    for buf in buffers:
+      buf.close()
+      buf.unlink()
+  return subtree_sizes
@@ -3,7 +3,9 @@ Subtree query operations for Tree() objects.
 """
 
 import array
-from typing import List, Dict, Any
+from pathlib import Path
+from typing import List, Dict, Any, Union, Sequence, Tuple
+from fastsubtrees import vectorized, error, lca
 
 class SubtreeQuery():
 
@@ -11,19 +13,96 @@ class SubtreeQuery():
     """
     Returns the number of nodes in the subtree rooted at the given node.
     """
-    self._check_node_number(node)
-    return self.subtree_sizes[node]
+    return self.subtree_sizes[self._node_index(node)]
+
+  def get_live_subtree_size(self, node: int) -> int:
+    """
+    Returns the number of nodes in the subtree rooted at the given node,
+    excluding deleted nodes (0, if the node itself was deleted).
+
+    The number of deleted nodes in each subtree (tombstones) is updated
+    by the edit operations, thus no scan of the subtree is needed.
+    """
+    i = self._node_index(node)
+    if not self._is_live(node, i):
+      return 0
+    return self.subtree_sizes[i] - self.tombstones[i]
+
+  def get_live_treesize(self) -> int:
+    """
+    Returns the number of nodes in the tree, excluding deleted nodes.
+    """
+    return self.get_live_subtree_size(self.root_id)
+
+  def get_n_tombstones(self) -> int:
+    """
+    Returns the number of empty positions of the tree data, left by deleted
+    nodes and by the old positions of moved nodes (until compact is called).
+    """
+    return self.tombstones[self._node_index(self.root_id)]
+
+  def get_fragmentation(self) -> float:
+    """
+    Returns the fraction of the positions of the tree data which are empty
+    (see get_n_tombstones).
+    """
+    return self.get_n_tombstones() / self.get_treesize()
 
   def get_treedata_coord(self, node: int) -> int:
     """
     Returns the position of the given node in the treedata array.
     """
-    self._check_node_number(node)
-    return self.coords[node]
+    return self.coords[self._node_index(node)]
+
+  def _is_live(self, node, i):
+    coord = self.coords[i]
+    return coord > 0 and self.treedata[coord] == node
+
+  def is_ancestor(self, ancestor: int, node: int) -> bool:
+    """
+    Returns True if node is contained in the subtree of ancestor
+    (also if node == ancestor), i.e. if the position of node in treedata
+    is in the range of the subtree of ancestor. Deleted nodes are not
+    contained in any subtree.
+    """
+    i = self._node_index(ancestor)
+    j = self._node_index(node)
+    if not self._is_live(node, j) or not self._is_live(ancestor, i):
+      return False
+    return 0 <= self.coords[j] - self.coords[i] < self.subtree_sizes[i]
+
+  def is_descendant_of(self, nodes: Sequence[int], root: int) \
+      -> Union[List[bool], "vectorized.np.ndarray"]:
+    """
+    For each of the given nodes, returns True if it is contained in the
+    subtree of root (see is_ancestor), as a NumPy boolean array (if NumPy is
+    installed, otherwise as a list). Nodes which do not exist are not
+    contained in the subtree.
+    """
+    if not vectorized.numpy_available():
+      return [self._index(node) is not None and self.is_ancestor(root, node)
+              for node in nodes]
+    np = vectorized.np
+    i = self._node_index(root)
+    start = self.coords[i]
+    nodes = np.asarray(nodes, dtype=np.int64)
+    indices = vectorized.node_indices(nodes, len(self.subtree_sizes),
+                                      self.ids)
+    coords = np.where(indices >= 0,
+                      vectorized.from_array(self.coords)[indices], 0)
+    if start == 0 or self.treedata[start] != root:
+      return np.zeros(len(nodes), dtype=bool)
+    treedata = np.frombuffer(self.treedata,
+                             dtype=f"u{self.treedata.itemsize}")
+    live = treedata[coords].astype(np.int64) == nodes
+    del treedata
+    return live & (coords >= start) & \
+        (coords < start + self.subtree_sizes[i])
 
   def get_subtree_data(self, subtree_root: int) -> array.array:
     """
-    Returns the treedata array for the subtree rooted at the given node.
+    Returns the treedata array for the subtree rooted at the given node
+    (a read-only memoryview, if the tree is memory mapped).
 
     This includes nodes marked as deleted.
     """
@@ -33,18 +112,43 @@ class SubtreeQuery():
       subtree_size = self.get_subtree_size(subtree_root)
       return self.treedata[pos:pos + subtree_size]
     else:
-      return array.array("Q")
+      return array.array(self.TYPECODES[self.width])
 
-  def subtree_ids(self, subtree_root: int) -> array.array:
+  def subtree_ids(self, subtree_root: int, numpy: bool = False) \
+      -> Union[array.array, "vectorized.np.ndarray"]:
     """
     Returns the IDs of the nodes in the subtree rooted at the given node.
+
+    If numpy is True, a NumPy array is returned, with the unsigned integer
+    type of the width of the tree; if the subtree does not contain deleted
+    nodes, it is a slice of treedata (a view, if the tree is memory mapped).
     """
-    self._check_node_number(subtree_root)
-    result = array.array("Q")
-    for node_id in self.get_subtree_data(subtree_root):
-      if node_id != self.UNDEF:
-        result.append(node_id)
-    return result
+    i = self._node_index(subtree_root)
+    if numpy or vectorized.numpy_available():
+      result = self._subtree_ids_ndarray(subtree_root, i)
+      return result if numpy else vectorized.to_array(result)
+    if not self._is_live(subtree_root, i):
+      return array.array("Q")
+    pos = self.coords[i]
+    subtree_data = self.treedata[pos:pos + self.subtree_sizes[i]]
+    if self.tombstones[i] == 0:
+      return array.array("Q", subtree_data)
+    return array.array("Q",
+        (node_id for node_id in subtree_data if node_id != self.UNDEF))
+
+  def _subtree_ids_ndarray(self, node, i):
+    vectorized.require_numpy("NumPy subtree queries")
+    np = vectorized.np
+    dtype = np.dtype(f"u{self.treedata.itemsize}")
+    if not self._is_live(node, i):
+      return np.array([], dtype=dtype)
+    pos = self.coords[i]
+    end = pos + self.subtree_sizes[i]
+    if self.tombstones[i] == 0:
+      return np.frombuffer(self.treedata[pos:end], dtype=dtype)
+    subtree_data = np.frombuffer(memoryview(self.treedata)[pos:end],
+                                 dtype=dtype)
+    return subtree_data[subtree_data != self.UNDEF]
 
   def subtree_info(self, subtree_root: int, attributes: List[str] = [],
                    include_subtree_sizes: bool = False,
@@ -76,3 +180,337 @@ class SubtreeQuery():
         result[attrname] = attr_values[attrname]
     return result
 
+  def _batch_indices(self, nodes):
+    """
+    Indices of the nodes in the arrays indexed by node (see _index),
+    as a NumPy array; raises NodeNotFoundError if a node does not exist.
+    """
+    vectorized.require_numpy("batch subtree queries")
+    indices = vectorized.node_indices(nodes, len(self.subtree_sizes),
+                                      self.ids)
+    missing = indices < 0
+    if missing.any():
+      node = vectorized.np.asarray(nodes)[missing][0]
+      raise error.NodeNotFoundError(f"Node ID '{node}' does not exist.")
+    return indices
+
+  def _batch_ranges(self, roots, merge):
+    roots = vectorized.np.asarray(roots, dtype=vectorized.np.int64)
+    indices = self._batch_indices(roots)
+    starts = vectorized.from_array(self.coords)[indices]
+    sizes = vectorized.from_array(self.subtree_sizes)[indices]
+    sizes[starts == 0] = 0
+    if merge:
+      selected = vectorized.outermost_ranges(starts, starts + sizes)
+      roots, indices = roots[selected], indices[selected]
+      starts, sizes = starts[selected], sizes[selected]
+    # deleted roots (including the nodes of deleted subtrees) have an empty
+    # subtree (their ranges are merged above as the other ranges)
+    sizes[vectorized.gather(self.treedata, starts) != roots] = 0
+    return roots, indices, starts, sizes
+
+  def subtree_ids_batch(self, roots: Sequence[int], merge: bool = False) \
+      -> Tuple["vectorized.np.ndarray", "vectorized.np.ndarray",
+               "vectorized.np.ndarray"]:
+    """
+    Returns the IDs of the nodes in the subtrees of multiple nodes
+    (requires NumPy), in compressed sparse row form, as a tuple
+    (roots, ids, offsets) of NumPy arrays: the IDs of the subtree of
+    roots[i] are ids[offsets[i]:offsets[i+1]].
+
+    If merge is True, the roots contained in the subtree of another root
+    (or repeated) are removed, thus each part of treedata is read once;
+    the remaining roots are returned in depth-first order.
+    """
+    roots, indices, starts, sizes = self._batch_ranges(roots, merge)
+    np = vectorized.np
+    treedata = np.frombuffer(self.treedata,
+                             dtype=f"u{self.treedata.itemsize}")
+    ids = vectorized.gather_ranges(treedata, starts, sizes)
+    del treedata
+    n_live = sizes - vectorized.from_array(self.tombstones)[indices]
+    n_live[sizes == 0] = 0
+    if len(ids) > n_live.sum():
+      ids = ids[ids != self.UNDEF]
+    offsets = np.zeros(len(roots) + 1, dtype=np.int64)
+    np.cumsum(n_live, out=offsets[1:])
+    return roots, ids, offsets
+
+  def subtree_info_batch(self, roots: Sequence[int],
+                         attributes: List[str] = [],
+                         include_subtree_sizes: bool = False,
+                         include_parents: bool = False,
+                         merge: bool = False,
+                         node_id_key = "node_id",
+                         subtree_size_key = "subtree_size",
+                         parent_key = "parent") -> Dict[str, Any]:
+    """
+    Returns the IDs, and optionally further information, of the nodes in the
+    subtrees of multiple nodes (requires NumPy), in compressed sparse row
+    form (see subtree_ids_batch), as a dictionary with the keys
+    'root' (roots), 'offsets' (offsets), node_id_key (node IDs),
+    subtree_size_key and parent_key (arrays of subtree sizes and parents
+    of the nodes, if requested) and the names of the attributes (lists of
+    attribute values of the nodes). Deleted nodes are not included.
+
+    Each attribute file is read once for all subtrees.
+    """
+    roots, ids, offsets = self.subtree_ids_batch(roots, merge)
+    result = {"root": roots, "offsets": offsets, node_id_key: ids}
+    if include_subtree_sizes or include_parents or attributes:
+      indices = vectorized.node_indices(ids, len(self.subtree_sizes),
+                                        self.ids)
+    if include_subtree_sizes:
+      result[subtree_size_key] = \
+          vectorized.from_array(self.subtree_sizes)[indices]
+    if include_parents:
+      result[parent_key] = vectorized.from_array(self.parents)[indices]
+    if attributes:
+      lines = vectorized.from_array(self.coords)[indices] - 1
+      for attrname in attributes:
+        result[attrname] = self.attribute_values_at_lines(attrname, lines)
+    return result
+
+  def lca_index_filename(self) -> Path:
+    """
+    Returns the filename where the LCA index of the tree is saved.
+    """
+    self._check_filename_set()
+    return Path(f"{self.filename}.lca")
+
+  def lca_index(self) -> "lca.LCAIndex":
+    """
+    Returns the lowest common ancestor index of the tree (requires NumPy).
+
+    The index is loaded from the index file (see save_lca_index), if it
+    exists and it was saved for the current state of the tree, otherwise it
+    is computed. After the tree is edited, it is computed again.
+    """
+    if self._lca is not None and self._lca.generation == self.generation:
+      return self._lca
+    vectorized.require_numpy("the LCA index")
+    self._lca = None
+    if self.filename is not None and self.lca_index_filename().exists():
+      index = lca.LCAIndex.from_file(self.lca_index_filename())
+      if index.fingerprint == lca.fingerprint(self):
+        index.generation = self.generation
+        self._lca = index
+    if self._lca is None:
+      self._lca = lca.LCAIndex.build(self)
+    return self._lca
+
+  def save_lca_index(self):
+    """
+    Saves the LCA index of the tree to the index file, i.e. the tree
+    filename with the suffix .lca (the index is also saved when the tree
+    is saved with to_file, if it was computed).
+    """
+    self.lca_index().to_file(self.lca_index_filename(), self)
+
+  def _live_coords(self, nodes):
+    """
+    Positions of the nodes in treedata, as a NumPy array; raises
+    NodeNotFoundError if a node does not exist or was deleted.
+    """
+    indices = self._batch_indices(nodes)
+    coords = vectorized.gather(self.coords, indices)
+    deleted = vectorized.gather(self.treedata, coords) != nodes
+    if deleted.any():
+      raise error.NodeNotFoundError(\
+          f"Node ID '{nodes[deleted][0]}' does not exist.")
+    return coords
+
+  def lca_pairs(self, nodes1: Sequence[int], nodes2: Sequence[int]) \
+      -> "vectorized.np.ndarray":
+    """
+    Returns the lowest common ancestor of nodes1[i] and nodes2[i] for each i,
+    as a NumPy array (see lca_index). One of the arguments can also be
+    a single node, e.g. lca_pairs(nodes, node).
+    """
+    index = self.lca_index()
+    np = vectorized.np
+    nodes1, nodes2 = np.broadcast_arrays(np.asarray(nodes1, dtype=np.int64),
+                                         np.asarray(nodes2, dtype=np.int64))
+    nodes1, nodes2 = nodes1.ravel(), nodes2.ravel()
+    coords1 = self._live_coords(nodes1)
+    coords2 = self._live_coords(nodes2)
+    result = nodes1.copy()
+    differ = coords1 != coords2
+    starts = np.minimum(coords1[differ], coords2[differ]) + 1
+    ends = np.maximum(coords1[differ], coords2[differ])
+    shallowest = vectorized.gather(self.treedata,
+        index.shallowest_positions(starts, ends))
+    result[differ] = vectorized.gather(self.parents,
+        vectorized.node_indices(shallowest, len(self.subtree_sizes),
+                                self.ids))
+    return result
+
+  def lca(self, node1: int, node2: int) -> int:
+    """
+    Returns the lowest common ancestor of two nodes (see lca_index).
+    """
+    return int(self.lca_pairs([node1], [node2])[0])
+
+  def lca_many(self, nodes: Sequence[int]) -> int:
+    """
+    Returns the lowest common ancestor of the given nodes (see lca_index),
+    i.e. the one of the first and the last of them in depth-first order.
+    """
+    np = vectorized.np
+    vectorized.require_numpy("the LCA index")
+    nodes = np.asarray(nodes, dtype=np.int64).ravel()
+    if len(nodes) == 0:
+      raise error.FastsubtreesError(\
+          "The lowest common ancestor of an empty set of nodes is undefined")
+    coords = self._live_coords(nodes)
+    return self.lca(int(nodes[coords.argmin()]), int(nodes[coords.argmax()]))
+
+  def get_depth(self, node: int) -> int:
+    """
+    Returns the depth of the given node, i.e. the number of its ancestors
+    (0 for the root).
+    """
+    return self.depths[self._node_index(node)]
+
+  def _live_node_index(self, node):
+    i = self._node_index(node)
+    if not self._is_live(node, i):
+      raise error.NodeNotFoundError(f"Node ID '{node}' does not exist.")
+    return i
+
+  def ancestor_at_depth(self, node: int, depth: int) -> Union[int, None]:
+    """
+    Returns the ancestor of the given node at the given depth (the node
+    itself, if it has the given depth), or None if the depth is negative
+    or larger than the depth of the node.
+
+    Using NumPy, the ancestor is found by binary search in an index
+    of the nodes grouped by depth, which is computed on the first call and
+    again after the tree is edited; otherwise, by following the parents.
+    """
+    i = self._live_node_index(node)
+    node_depth = self.depths[i]
+    if depth < 0 or depth > node_depth:
+      return None
+    if not vectorized.numpy_available():
+      for _ in range(node_depth - depth):
+        node = self.parents[i]
+        i = self._index(node)
+      return node
+    if self._levels is None or self._levels.generation != self.generation:
+      self._levels = lca.LevelIndex(self)
+    np = vectorized.np
+    pos = self._levels.ancestor_positions(\
+        np.array([self.coords[i]], dtype=np.int64),
+        np.array([depth], dtype=np.int64))[0]
+    return self.treedata[pos]
+
+  def tree_distance(self, node1: int, node2: int) -> int:
+    """
+    Returns the number of edges of the path between two nodes in the tree,
+    computed from their depths and the depth of their lowest common ancestor
+    (see lca; without NumPy, the ancestors are followed up to it).
+    """
+    depth1 = self.depths[self._live_node_index(node1)]
+    depth2 = self.depths[self._live_node_index(node2)]
+    if vectorized.numpy_available():
+      common = self.lca(node1, node2)
+    else:
+      common = self.ancestor_at_depth(node1, min(depth1, depth2))
+      other = self.ancestor_at_depth(node2, min(depth1, depth2))
+      while common != other:
+        common = self.get_parent(common)
+        other = self.get_parent(other)
+    return depth1 + depth2 - 2 * self.get_depth(common)
+
+  def clear_lineage_cache(self):
+    """
+    Removes the lineages stored by lineages(nodes, cache=True).
+    """
+    self._lineage_cache = {}
+
+  def _sorted_lineages(self, positions, depths):
+    """
+    Lineages of the nodes at the given positions of treedata (sorted,
+    without repetitions) with the given depths, in CSR form (ids, offsets).
+
+    The lineages are the states of a stack, while visiting the nodes in
+    depth-first order: the lineage of each node shares with the lineage of
+    the previous node the part up to their lowest common ancestor, thus only
+    the following nodes are pushed (and looked up in the level ancestor
+    index); each entry of a lineage is the last node pushed at its depth.
+    """
+    np = vectorized.np
+    n_queries = len(positions)
+    common_depths = np.full(n_queries, -1, dtype=np.int64)
+    if n_queries > 1:
+      common_depths[1:] = self.lca_index().range_min(positions[:-1] + 1,
+          positions[1:]) // len(self.treedata) - 1
+    n_pushed = depths - common_depths
+    pushed_query = np.repeat(np.arange(n_queries), n_pushed)
+    first_pushed = np.cumsum(n_pushed) - n_pushed
+    pushed_depths = common_depths[pushed_query] + 1 + \
+        np.arange(len(pushed_query)) - first_pushed[pushed_query]
+    if self._levels is None or self._levels.generation != self.generation:
+      self._levels = lca.LevelIndex(self)
+    pushed_nodes = vectorized.gather(self.treedata,
+        self._levels.ancestor_positions(positions[pushed_query],
+                                        pushed_depths))
+    pushed_keys = pushed_depths * n_queries + pushed_query
+    order = np.argsort(pushed_keys, kind="stable")
+    lengths = depths + 1
+    offsets = np.zeros(n_queries + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    entry_query = np.repeat(np.arange(n_queries), lengths)
+    entry_depths = np.arange(offsets[-1]) - offsets[entry_query]
+    found = np.searchsorted(pushed_keys[order],
+        entry_depths * n_queries + entry_query, side="right") - 1
+    return pushed_nodes[order][found], offsets
+
+  def _compute_lineages(self, nodes):
+    np = vectorized.np
+    indices = self._batch_indices(nodes)
+    coords = self._live_coords(nodes)
+    positions, first, inverse = np.unique(coords, return_index=True,
+                                          return_inverse=True)
+    depths = vectorized.gather(self.depths, indices[first])
+    ids, offsets = self._sorted_lineages(positions, depths)
+    lengths = (depths + 1)[inverse]
+    result_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=result_offsets[1:])
+    return vectorized.gather_ranges(ids, offsets[inverse], lengths), \
+        result_offsets
+
+  def lineages(self, nodes: Sequence[int], cache: bool = False) \
+      -> Tuple["vectorized.np.ndarray", "vectorized.np.ndarray"]:
+    """
+    Returns the lineages of multiple nodes, i.e. the paths from the root to
+    each node (requires NumPy), in compressed sparse row form, as a tuple
+    (ids, offsets) of NumPy arrays: the lineage of nodes[i] is
+    ids[offsets[i]:offsets[i+1]], starting with the root.
+
+    The lineages are computed by a single pass over the nodes in depth-first
+    order (see _sorted_lineages). If cache is True, the lineage of each node
+    is stored and reused by the following calls (until the tree is edited
+    or clear_lineage_cache is called).
+    """
+    vectorized.require_numpy("lineage queries")
+    np = vectorized.np
+    nodes = np.asarray(nodes, dtype=np.int64).ravel()
+    if not cache:
+      return self._compute_lineages(nodes)
+    if self._lineage_cache_generation != self.generation:
+      self._lineage_cache = {}
+      self._lineage_cache_generation = self.generation
+    missing = np.array([node for node in set(nodes.tolist())
+                        if node not in self._lineage_cache], dtype=np.int64)
+    if len(missing):
+      ids, offsets = self._compute_lineages(missing)
+      for i, node in enumerate(missing.tolist()):
+        self._lineage_cache[node] = ids[offsets[i]:offsets[i + 1]]
+    lineages = [self._lineage_cache[node] for node in nodes.tolist()]
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum([len(lineage) for lineage in lineages], out=offsets[1:])
+    ids = np.concatenate(lineages) if lineages \
+        else np.array([], dtype=np.int64)
+    return ids, offsets
@@ -2,14 +2,15 @@
 Computation of the information necessary for the subtree query
 """
 
-import struct
 import array
+import bisect
 import sys
-from typing import Union, Iterator, Tuple
+import itertools
+from typing import Union, Iterator, Tuple, Sequence
 from pathlib import Path
 from fastsubtrees import logger, tqdm, error
 from fastsubtrees.ids_modules import ids_from_tabular_file
-from multiprocessing.pool import Pool
+from fastsubtrees import vectorized, parallel, treefile
 from .attribute import TreeAttributes
 from .query import SubtreeQuery
 from .edit import TreeEditor
@@ -24,6 +25,13 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
     tree file, where it was previously saved with the to_file method.
   - construct(cls, generator: Iterator[Tuple[int, int]]): construct a tree
     from a generator of (node, parent) pairs.
+    The construction engine can be selected using the engine parameter:
+    'python' (pure Python), 'numpy' (vectorized, requires NumPy) or
+    'auto' (default; 'numpy' if NumPy is installed, otherwise 'python';
+    'python' is also used for very deep trees, see DEEP_TREE_RATIO).
+  - construct_from_chunks(cls, chunks): construct a tree from an iterator
+    of (node_ids, parent_ids) chunks of arrays, e.g. as yielded by
+    ids_from_tabular_file.element_parent_id_chunks().
   - construct_from_tabular(cls, filename: Union[str, Path],
                            separator: str = "\t", elem_field_num: int = 0,
                           parent_field_num: int = 1, n_processes: int = 1):
@@ -81,9 +89,70 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
     # (*) not changed because the corresponding data is still in treedata
     self.parents = None
 
+    # tombstones contains:
+    #
+    #  number of deleted nodes (UNDEF values) in the treedata range
+    #  of the subtree of the i-th node
+    #  |        i-th node not contained in the tree
+    #  |        |       deleted nodes: not changed
+    #  |        |       |
+    # [n, ..., 0, ..., n, ]
+    # (computed from treedata, if not stored in the tree file)
+    self.tombstones = None
+
+    # depths contains:
+    #
+    #  number of ancestors of the i-th node
+    #  |        rootID: 0
+    #  |        |       i-th node not contained in the tree
+    #  |        |       |       deleted nodes: not changed
+    #  |        |       |       |
+    # [d, ..., 0, ..., 0, ..., d, ]
+    # (computed from treedata, if not stored in the tree file)
+    self.depths = None
+
+    # ids contains (only if the node IDs are remapped, otherwise None):
+    #
+    #  the node IDs, sorted; coords, subtree_sizes and parents are indexed
+    #  by the position of the node ID in ids, instead of the node ID itself;
+    #  treedata and parents still contain node IDs
+    self.ids = None
+
     self.root_id = None
     self.filename = None
 
+    # number of edit operations applied to the tree since its construction
+    # (stored in the tree file)
+    self.generation = 0
+
+    # memory mapped tree file, if the arrays are read-only memoryviews
+    # of its sections (see from_file), otherwise None
+    self._mapped = None
+
+    # sections of the tree file, which are loaded on first access,
+    # and header of the file (see from_file and __getattr__)
+    self._lazy_sections = set()
+    self._lazy_header = None
+
+    # lowest common ancestor index and level ancestor index,
+    # if computed (see lca_index and ancestor_at_depth)
+    self._lca = None
+    self._levels = None
+
+    # lineages of nodes, stored by lineages(nodes, cache=True),
+    # and generation of the tree, for which they were computed
+    self._lineage_cache = {}
+    self._lineage_cache_generation = 0
+
+    # generation of the tree, for which a fragmentation warning was logged
+    # (see _apply_compaction_policy)
+    self._fragmentation_warned = None
+
+    # width in bits of the unsigned integers stored in the arrays
+    # and corresponding UNDEF value (see _set_width)
+    self.width = 64
+    self.UNDEF = Tree.UNDEFS[64]
+
   def _reset_data(self):
     """
     This method prepares for the reset operation.
@@ -93,10 +162,97 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
     self.coords = array.array("Q")
     self.subtree_sizes = None
     self.parents = None
+    self.tombstones = None
+    self.depths = None
+    self.ids = None
     self.root_id = None
-
+    self._mapped = None
+    self._lazy_sections = set()
+    self._lca = None
+    self._levels = None
+    self.generation += 1
+    self.width = 64
+    self.UNDEF = Tree.UNDEFS[64]
+
+  # UNDEF value of 64-bit trees (the tree is always constructed using
+  # 64-bit arrays); use the UNDEF attribute of the instance instead,
+  # which depends on the width of its arrays
   UNDEF = sys.maxsize
 
+  # width of the arrays: "auto" selects the narrowest width, for which
+  # all node IDs and coordinates are smaller than the UNDEF value
+  WIDTHS = ["auto", 32, 64]
+  TYPECODES = {32: "I", 64: "Q"}
+  UNDEFS = {32: 2**32 - 1, 64: sys.maxsize}
+
+  def _required_width(self) -> int:
+    max_value = max(self.max_node_id(), len(self.treedata))
+    for width in [32, 64]:
+      if max_value < Tree.UNDEFS[width]:
+        return width
+    raise error.ConstructionError(\
+        f"The node IDs must be < {Tree.UNDEFS[64]}, found: {max_value}")
+
+  @staticmethod
+  def _convert_array(values, width, old_undef=None):
+    """
+    Convert an array to the given width; if old_undef is given,
+    its occurrences are replaced by the UNDEF value of the width.
+    """
+    typecode = Tree.TYPECODES[width]
+    undef = Tree.UNDEFS[width]
+    if values.typecode == typecode:
+      return values
+    if vectorized.numpy_available():
+      converted = vectorized.from_array(values)
+      if old_undef is not None:
+        converted[converted == old_undef] = undef
+      return vectorized.to_array(converted, typecode)
+    if old_undef is None:
+      return array.array(typecode, values)
+    return array.array(typecode,
+        (undef if value == old_undef else value for value in values))
+
+  def _convert_arrays(self, width):
+    self._make_writable()
+    self.treedata = self._convert_array(self.treedata, width, self.UNDEF)
+    self.parents = self._convert_array(self.parents, width, self.UNDEF)
+    self.coords = self._convert_array(self.coords, width)
+    self.subtree_sizes = self._convert_array(self.subtree_sizes, width)
+    self.tombstones = self._convert_array(self.tombstones, width)
+    self.depths = self._convert_array(self.depths, width)
+    if self.ids is not None:
+      self.ids = self._convert_array(self.ids, width)
+    self.width = width
+    self.UNDEF = Tree.UNDEFS[width]
+
+  def _set_width(self, width="auto"):
+    """
+    Convert the arrays to the given width (32, 64 or "auto").
+    """
+    if width not in Tree.WIDTHS:
+      raise error.ConstructionError(\
+          f"Unknown array width '{width}', "+\
+          f"available widths: {', '.join(str(w) for w in Tree.WIDTHS)}")
+    required = self._required_width()
+    if width == "auto":
+      width = required
+    elif width < required:
+      raise error.ConstructionError(\
+          f"The node IDs and coordinates of the tree do not fit in {width} "+\
+          f"bits, the minimum width is {required} bits")
+    self._convert_arrays(width)
+    logger.debug(f"Tree arrays width: {width} bits")
+
+  def _fit_width(self, max_value):
+    """
+    Widen the arrays to 64 bits, if max_value (a node ID or a coordinate
+    to be stored, e.g. when editing the tree) does not fit in the current width.
+    """
+    if self.width < 64 and max_value >= self.UNDEF:
+      logger.debug("Tree arrays widened to 64 bits")
+      self._convert_arrays(64)
+
   def _compute_parents(self, generator):
     """
     Copy the parents ID from the generator, after some checks;
@@ -145,6 +301,8 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
     (after __compute_parents has been called).
     """
     assert (self.parents is not None)
+    if self.ids is not None:
+      return self.ids[-1]
     return len(self.parents) - 1
 
   def _validate_parents(self):
@@ -163,56 +321,179 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
           f"The node '{parent}' has parent '{grandparent}', "+\
           "which is not in the tree")
 
-  def _compute_subtree_sizes_partial(self, start, end, parents):
-    subtree_sizes = array.array("Q", [0] * (len(parents) + 1))
-    for elem in range(start, end):
-      parent = parents[elem]
-      if parent != Tree.UNDEF:
-        subtree_sizes[elem] += 1
-        while parent != elem:
-          subtree_sizes[parent] += 1
-          elem = parent
-          parent = parents[parent]
-    return subtree_sizes
-
   def _parallel_compute_subtree_sizes(self, n_processes):
-    logger.info("Constructing subtree sizes table "+\
+    """
+    Validate the parents table and compute the subtree sizes using
+    n_processes processes, which share the tables in shared memory buffers.
+    """
+    logger.info("Validating parents and constructing subtree sizes table "+\
         f"using {n_processes} processes...")
-    results = []
-    with Pool(n_processes) as pool:
-      for i in range(n_processes):
-        start = i * (self.max_node_id()+1) // n_processes
-        end = (i + 1) * (self.max_node_id()+1) // n_processes
-        logger.info(f"Process {i} computes subtree sizes"+\
-            f" for nodes {start} to {end}...")
-        results.append(pool.apply_async(
-          self._compute_subtree_sizes_partial, (start, end, self.parents)))
-      pool.close()
-      pool.join()
-    self.subtree_sizes = array.array("Q", [0] * (self.max_node_id() + 1))
-    for i in range(self.max_node_id() + 1):
-      self.subtree_sizes[i] = sum([r.get()[i] for r in results])
+    self.subtree_sizes = parallel.compute_subtree_sizes(self.parents,
+        n_processes, Tree.UNDEF)
+    self._check_subtree_sizes()
 
   def _compute_subtree_sizes(self):
+    """
+    Compute the subtree sizes in a single bottom-up pass (O(n)):
+    each node adds its size to its parent once, as soon as the sizes
+    of all its children are known (i.e. in reverse topological order).
+    """
     logger.info("Constructing subtree sizes table...")
     self.subtree_sizes = array.array('Q', [0] * (self.max_node_id()+1))
+    n_children = array.array('Q', [0] * (self.max_node_id()+1))
+    for elem, parent in enumerate(self.parents):
+      if parent == Tree.UNDEF:
+        continue
+      self.subtree_sizes[elem] = 1
+      if parent != elem:
+        n_children[parent] += 1
+    pending = array.array('Q', n_children)
     for elem, parent in tqdm(enumerate(self.parents), \
                              total=self.max_node_id()+1):
-      if parent == Tree.UNDEF:
+      if parent == Tree.UNDEF or n_children[elem]:
         continue
-      self.subtree_sizes[elem] += 1
       while parent != elem:
-        self.subtree_sizes[parent] += 1
-        grandparent = self.parents[parent]
+        self.subtree_sizes[parent] += self.subtree_sizes[elem]
+        pending[parent] -= 1
+        if pending[parent]:
+          break
         elem = parent
-        parent = grandparent
+        parent = self.parents[elem]
+    self._check_subtree_sizes()
+
+  def _check_subtree_sizes(self):
+    """
+    Nodes which are not connected to the root (i.e. with cycles in the
+    parent relationships) do not contribute to the size of the tree.
+    """
+    n_nodes = sum(1 for parent in self.parents if parent != Tree.UNDEF)
+    if self.get_treesize() != n_nodes:
+      raise error.CycleError(\
+          f"The tree contains {n_nodes} nodes, but only "+\
+          f"{self.get_treesize()} are connected to the root "+\
+          f"'{self.root_id}' (the parent relationships contain a cycle)")
 
   def get_treesize(self) -> int:
     """
     Returns the number of nodes in the tree.
     """
     assert self.subtree_sizes is not None
-    return self.subtree_sizes[self.root_id]
+    return self.subtree_sizes[self._node_index(self.root_id)]
+
+  def _compute_tombstones(self):
+    """
+    Count the deleted nodes in the subtree of each node, using the prefix
+    sums of the number of UNDEF values in treedata.
+    """
+    logger.debug("Counting the deleted nodes in each subtree...")
+    if vectorized.numpy_available():
+      return vectorized.to_array(vectorized.count_tombstones(\
+          vectorized.from_array(self.treedata),
+          vectorized.from_array(self.coords),
+          vectorized.from_array(self.subtree_sizes), self.UNDEF),
+          Tree.TYPECODES[self.width])
+    prefix = [0]
+    prefix.extend(itertools.accumulate(\
+        int(node == self.UNDEF) for node in self.treedata))
+    tombstones = array.array(Tree.TYPECODES[self.width],
+                             [0] * len(self.coords))
+    for i, (coord, size) in enumerate(zip(self.coords, self.subtree_sizes)):
+      if coord > 0:
+        tombstones[i] = prefix[coord + size] - prefix[coord]
+    return tombstones
+
+  def _compute_depths(self):
+    """
+    Compute the depth of each node; in the pure-Python implementation,
+    from the depth of its parent, which precedes it in treedata.
+    """
+    logger.debug("Computing the depth of each node...")
+    if vectorized.numpy_available():
+      np = vectorized.np
+      treedata = vectorized.from_array(self.treedata)
+      coords = vectorized.from_array(self.coords)
+      sizes = vectorized.from_array(self.subtree_sizes)
+      node_ids = vectorized.from_array(self.ids) if self.ids is not None \
+          else np.arange(len(coords))
+      live = (coords > 0) & (treedata[coords] == node_ids)
+      depths = vectorized.treedata_depths(len(treedata), coords[live],
+                                          sizes[live])
+      return vectorized.to_array(np.where(live, depths[coords], 0),
+                                 Tree.TYPECODES[self.width])
+    depths = array.array(Tree.TYPECODES[self.width], [0] * len(self.coords))
+    for node in itertools.islice(self.treedata, self.ROOT_COORD, None):
+      if node != self.UNDEF and node != self.root_id:
+        i = self._index(node)
+        depths[i] = depths[self._index(self.parents[i])] + 1
+    return depths
+
+  def _nbytes(self) -> int:
+    """
+    Size in bytes of the tree arrays.
+    """
+    return sum(len(values) * values.itemsize for values in
+               (getattr(self, name) for name in Tree.ARRAY_NAMES)
+               if values is not None)
+
+  def _compact_arrays(self):
+    """
+    Remove the UNDEF values from treedata, keeping the depth-first order
+    of the nodes; the deleted nodes become nodes not contained in the tree
+    (if the node IDs are remapped, they are removed from the arrays).
+
+    Returns for each position of treedata after ROOT_COORD, whether it was
+    kept (i.e. it contained a node).
+    """
+    self._make_writable()
+    typecode = Tree.TYPECODES[self.width]
+    if vectorized.numpy_available():
+      np = vectorized.np
+      treedata = vectorized.from_array(self.treedata)
+      keep = treedata != self.UNDEF
+      keep[0] = True
+      new_positions = np.cumsum(keep) - 1
+      coords = vectorized.from_array(self.coords)
+      node_ids = vectorized.from_array(self.ids) if self.ids is not None \
+          else np.arange(len(coords))
+      live = (coords > 0) & (treedata[coords] == node_ids)
+      values = {"coords": np.where(live, new_positions[coords], 0),
+          "subtree_sizes": np.where(live,
+              vectorized.from_array(self.subtree_sizes) - \
+              vectorized.from_array(self.tombstones), 0),
+          "parents": np.where(live, vectorized.from_array(self.parents),
+                              self.UNDEF),
+          "depths": np.where(live, vectorized.from_array(self.depths), 0),
+          "tombstones": np.zeros(len(coords), dtype=np.int64)}
+      if self.ids is not None:
+        values = {name: v[live] for name, v in values.items()}
+        values["ids"] = node_ids[live]
+      for name, v in values.items():
+        setattr(self, name, vectorized.to_array(v, typecode))
+      self.treedata = vectorized.to_array(treedata[keep], typecode)
+      return keep[self.ROOT_COORD:]
+    keep = [node != self.UNDEF for node in self.treedata]
+    keep[0] = True
+    new_positions = [pos - 1 for pos in itertools.accumulate(keep)]
+    live = [coord > 0 and self.treedata[coord] == \
+                (self.ids[i] if self.ids is not None else i)
+            for i, coord in enumerate(self.coords)]
+    selected = range(len(self.coords)) if self.ids is None \
+        else [i for i in range(len(self.coords)) if live[i]]
+    values = {"coords": [new_positions[self.coords[i]] if live[i] else 0
+                         for i in selected],
+        "subtree_sizes": [self.subtree_sizes[i] - self.tombstones[i]
+                          if live[i] else 0 for i in selected],
+        "parents": [self.parents[i] if live[i] else self.UNDEF
+                    for i in selected],
+        "depths": [self.depths[i] if live[i] else 0 for i in selected],
+        "tombstones": [0] * len(selected)}
+    if self.ids is not None:
+      values["ids"] = [self.ids[i] for i in selected]
+    for name, v in values.items():
+      setattr(self, name, array.array(typecode, v))
+    self.treedata = array.array(typecode,
+        (node for node, kept in zip(self.treedata, keep) if kept))
+    return keep[self.ROOT_COORD:]
 
   ROOT_COORD=1
 
@@ -243,87 +524,438 @@ class Tree(TreeAttributes, SubtreeQuery, TreeEditor):
         continue
       self.coords[elem] -= (self.subtree_sizes[elem] - 1)
 
-  @classmethod
-  def construct(cls, generator: Iterator[Tuple[int, int]], n_processes: int = 1):
+  ENGINES = ["auto", "python", "numpy"]
+
+  @staticmethod
+  def _select_engine(engine):
+    if engine not in Tree.ENGINES:
+      raise error.ConstructionError(\
+          f"Unknown construction engine '{engine}', "+\
+          f"available engines: {', '.join(Tree.ENGINES)}")
+    if engine == "auto":
+      engine = "numpy" if vectorized.numpy_available() else "python"
+    elif engine == "numpy":
+      vectorized.require_numpy("the numpy construction engine")
+    logger.debug(f"Using the {engine} construction engine")
+    return engine
+
+  @staticmethod
+  def _remap_pairs(generator):
     """
-    Construct a tree from a generator that yields tuples of the form
-    (node, parent).
+    Check the (node, parent) pairs and map the node IDs to dense indices,
+    in the order of the IDs, so that the order of the siblings in the
+    traversal is not changed.
+
+    Returns the sorted node IDs and the list of pairs mapped to the indices.
     """
-    self = cls()
+    logger.info("Remapping node IDs to dense indices...")
+    nodes = {}
+    root_id = None
+    for elem, parent in generator:
+      if elem < 0 or parent < 0:
+        raise error.ConstructionError( \
+          f"The node IDs must be >= 0, found: {min(elem, parent)}")
+      if elem in nodes:
+        raise error.ConstructionError( \
+          f"Node '{elem}' had already been added with parent " + \
+          f"'{nodes[elem]}', cannot add it again with parent {parent}")
+      if elem == parent:
+        if root_id is not None:
+          raise error.ConstructionError( \
+            f"The tree already has a root node {root_id}, " + \
+            f"cannot add a second root node {elem}")
+        root_id = elem
+      nodes[elem] = parent
+    ids = sorted(nodes)
+    index = {node: i for i, node in enumerate(ids)}
+    pairs = []
+    for elem, parent in nodes.items():
+      if parent not in index:
+        raise error.ConstructionError(\
+          f"The node '{elem}' has parent '{parent}', "+\
+          "which is not in the tree")
+      pairs.append((index[elem], index[parent]))
+    return ids, pairs
+
+  def _apply_remap(self, ids):
+    """
+    Replace the dense indices in treedata and parents by the node IDs;
+    the arrays remain indexed by the dense indices (see _index).
+    """
+    if vectorized.numpy_available():
+      ids = vectorized.np.asarray(ids, dtype=vectorized.np.int64)
+      for name in ["treedata", "parents"]:
+        setattr(self, name, vectorized.to_array(vectorized.ids_of_indices(\
+            vectorized.from_array(getattr(self, name)), ids, Tree.UNDEF)))
+    else:
+      for values in [self.treedata, self.parents]:
+        for i, value in enumerate(values):
+          if value != Tree.UNDEF:
+            values[i] = ids[value]
+    self.ids = array.array("Q", ids)
+    self.root_id = self.ids[self.root_id]
+
+  def _remapped_construction(self, ids, construct):
+    try:
+      construct()
+    except error.CycleError:
+      # the message of the error contains the indices instead of the IDs
+      raise error.CycleError(\
+          "Not all nodes are connected to the root "+\
+          f"'{ids[self.root_id]}' (the parent relationships contain a cycle)")
+    self._apply_remap(ids)
+
+  # the numpy engine processes the levels of the tree one at a time, thus
+  # "auto" selects the python engine for trees deeper than this fraction
+  # of the number of nodes (e.g. chains), where it is faster
+  DEEP_TREE_RATIO = 0.4
+
+  def _vectorized_construction(self, elems, parents, remap=False,
+                               n_processes=1, auto=False):
+    if remap:
+      ids, elems, parents = vectorized.remap_ids(elems, parents)
+      self._remapped_construction(ids,
+          lambda: self._vectorized_construction(elems, parents,
+                                                n_processes=n_processes,
+                                                auto=auto))
+      return
+    pairs = (elems, parents)
+    parents, self.root_id = \
+        vectorized.compute_parents(elems, parents, Tree.UNDEF)
+    vectorized.validate_parents(parents, Tree.UNDEF)
+    depths = vectorized.compute_depths(parents, self.root_id, Tree.UNDEF)
+    if auto and depths.max() > self.DEEP_TREE_RATIO * len(elems):
+      logger.info("Deep tree, using the python construction engine")
+      self.root_id = None
+      self._python_construction(zip(*(a.tolist() for a in pairs)),
+                                n_processes)
+      return
+    levels = vectorized.compute_levels(parents, depths, Tree.UNDEF)
+    sizes, minkeys = \
+        vectorized.compute_subtree_sizes(parents, levels, Tree.UNDEF)
+    treedata, coords = vectorized.compute_treedata_and_coords(parents,
+        levels, sizes, minkeys, self.root_id, self.ROOT_COORD, Tree.UNDEF)
+    self.parents = vectorized.to_array(parents)
+    self.subtree_sizes = vectorized.to_array(sizes)
+    self.coords = vectorized.to_array(coords)
+    self.treedata = vectorized.to_array(treedata)
+    self.depths = vectorized.to_array(depths)
+
+  def _python_construction(self, generator, n_processes=1, remap=False):
+    if remap:
+      ids, pairs = self._remap_pairs(generator)
+      self._remapped_construction(ids,
+          lambda: self._python_construction(pairs, n_processes))
+      return
     self._compute_parents(generator)
-    self._validate_parents()
     if n_processes > 1:
       self._parallel_compute_subtree_sizes(n_processes)
     else:
+      self._validate_parents()
       self._compute_subtree_sizes()
     self._compute_treedata_and_coords()
+    self.depths = self._compute_depths()
+
+  def _construct(self, generator, n_processes=1, engine="auto",
+                 width="auto", remap=False):
+    if self._select_engine(engine) == "numpy":
+      if n_processes > 1:
+        logger.info("The numpy construction engine does not use "+\
+            "multiple processes")
+      self._vectorized_construction(*vectorized.pairs_to_arrays(generator),
+                                    remap, n_processes, engine == "auto")
+    else:
+      self._python_construction(generator, n_processes, remap)
+    self.tombstones = array.array("Q", bytes(8 * len(self.coords)))
+    self._set_width(width)
+
+  def _construct_from_chunks(self, chunks, n_processes=1, engine="auto",
+                             width="auto", remap=False):
+    if self._select_engine(engine) == "numpy":
+      if n_processes > 1:
+        logger.info("The numpy construction engine computes the tree "+\
+            "in a single process")
+      self._vectorized_construction(*vectorized.chunks_to_arrays(chunks),
+                                    remap, n_processes, engine == "auto")
+      self.tombstones = array.array("Q", bytes(8 * len(self.coords)))
+      self._set_width(width)
+    else:
+      generator = itertools.chain.from_iterable(\
+          zip(elems.tolist(), parents.tolist()) for elems, parents in chunks)
+      self._construct(generator, n_processes, "python", width, remap)
+
+  @classmethod
+  def construct(cls, generator: Iterator[Tuple[int, int]],
+                n_processes: int = 1, engine: str = "auto",
+                width: Union[str, int] = "auto", remap: bool = False):
+    """
+    Construct a tree from a generator that yields tuples of the form
+    (node, parent).
+
+    The engine can be 'python', 'numpy' or 'auto' (see class docstring);
+    all engines construct identical trees.
+
+    The width (in bits) of the integers stored in the tree arrays can be
+    32, 64 or 'auto' (default: the narrowest width, which fits the tree).
+
+    If remap is True, the arrays are indexed by the rank of the node IDs
+    instead of the node IDs, so that their size is proportional to the
+    number of nodes instead of the maximum node ID.
+    """
+    self = cls()
+    self._construct(generator, n_processes, engine, width, remap)
+    logger.success("Tree data structure constructed")
+    return self
+
+  @classmethod
+  def construct_from_chunks(cls, chunks: Iterator[Tuple[Sequence[int],
+                                                        Sequence[int]]],
+                            n_processes: int = 1, engine: str = "auto",
+                            width: Union[str, int] = "auto",
+                            remap: bool = False):
+    """
+    Construct a tree from an iterator of chunks of the form
+    (node_ids, parent_ids), where node_ids and parent_ids are
+    sequences (e.g. arrays) of the same length.
+
+    The chunks are consumed without creating a Python object for
+    each node, if the numpy engine is used.
+    """
+    self = cls()
+    self._construct_from_chunks(chunks, n_processes, engine, width, remap)
     logger.success("Tree data structure constructed")
     return self
 
   @classmethod
   def construct_from_tabular(cls, filename: Union[str, Path],
                              separator: str = "\t", elem_field_num: int = 0,
-                             parent_field_num: int = 1, n_processes: int = 1):
+                             parent_field_num: int = 1, n_processes: int = 1,
+                             engine: str = "auto",
+                             width: Union[str, int] = "auto",
+                             remap: bool = False):
     """
     Construct a tree from a tabular file.
+
+    If n_processes > 1, the file is also parsed by multiple processes.
     """
-    generator = ids_from_tabular_file.element_parent_ids(filename, separator,
-        elem_field_num, parent_field_num)
-    return cls.construct(generator, n_processes)
+    chunks = ids_from_tabular_file.element_parent_id_chunks(filename,
+        separator, elem_field_num, parent_field_num, n_processes=n_processes)
+    return cls.construct_from_chunks(chunks, n_processes, engine, width,
+                                     remap)
 
   @classmethod
   def construct_from_ncbi_dump(cls, filename: Union[str, Path],
-                               n_processes: int = 1):
+                               n_processes: int = 1, engine: str = "auto",
+                               width: Union[str, int] = "auto",
+                               remap: bool = False):
     """
     Constructs a tree from a NCBI taxonomy dump nodes file.
+
+    If n_processes > 1, the file is also parsed by multiple processes.
     """
-    generator = ids_from_tabular_file.element_parent_ids(filename,
-        ncbi_preset=True)
-    return cls.construct(generator, n_processes)
+    chunks = ids_from_tabular_file.element_parent_id_chunks(filename,
+        ncbi_preset=True, n_processes=n_processes)
+    return cls.construct_from_chunks(chunks, n_processes, engine, width,
+                                     remap)
 
   def to_file(self, outfname: Union[str, Path]):
     """
-    Save the tree to file.
+    Save the tree to file (see the treefile module for the file format).
+
+    Before saving, the compaction policy is applied (see compaction_policy);
+    the tree is only compacted automatically, if it is saved to its current
+    filename (or no filename is set), since its attribute files are modified.
+    The attribute files are compacted only after the tree file is written.
     """
-    self.filename = Path(outfname)
-    with open(outfname, "wb") as f:
-      f.write(struct.pack("QQQ", len(self.subtree_sizes), len(self.treedata),
-                                 len(self.parents)))
-      self.subtree_sizes.tofile(f)
-      self.coords.tofile(f)
-      self.treedata.tofile(f)
-      self.parents.tofile(f)
+    self._apply_compaction_policy(self.filename is None or \
+        Path(self.filename) == Path(outfname),
+        lambda: self._write_file(outfname))
     logger.info(f"Tree written to file \"{outfname}\"")
+    if self._lca is not None and self._lca.generation == self.generation:
+      self.save_lca_index()
+
+  def _write_file(self, outfname):
+    self._make_writable()
+    flags = treefile.FLAG_REMAPPED if self.ids is not None else 0
+    arrays = [("subtree_sizes", self.subtree_sizes), ("coords", self.coords),
+              ("treedata", self.treedata), ("parents", self.parents),
+              ("tombstones", self.tombstones), ("depths", self.depths)]
+    if self.ids is not None:
+      arrays.append(("ids", self.ids))
+    treefile.write(outfname, self.width, flags, self.root_id,
+                   self.get_treesize(), self.generation, arrays)
+    self.filename = Path(outfname)
+
+  ARRAY_NAMES = ["subtree_sizes", "coords", "treedata", "parents",
+                 "tombstones", "depths", "ids"]
+
+  # arrays which are computed if they are not stored in the tree file
+  # (e.g. in files written by previous versions)
+  COMPUTED_ARRAYS = {"tombstones": "_compute_tombstones",
+                     "depths": "_compute_depths"}
 
   @classmethod
-  def from_file(cls, filename: Union[str, Path]):
+  def from_file(cls, filename: Union[str, Path], verify: bool = True,
+                mmap: bool = False, lazy: bool = True):
     """
     Load a tree from a file.
+
+    Files written by previous versions of fastsubtrees (format version 1)
+    can also be loaded. If verify is True, the checksums of the arrays
+    are verified (only in format version 2).
+
+    If lazy is True, each array is only read from the file when it is
+    accessed for the first time (e.g. the parents array, which is not
+    needed for subtree queries); the file must not be modified meanwhile.
+
+    If mmap is True, the file is memory mapped and the arrays are read-only
+    memoryviews of it, thus the data is only read from the file when
+    accessed and the pages are shared among processes which map the same
+    file; the checksums are not verified in this case. Before the tree is
+    edited, the arrays are copied to memory.
     """
     self = cls()
     with open(filename, "rb") as f:
-      idxsize, nelems, nparents = struct.unpack("QQQ", f.read(24))
-      self.subtree_sizes = array.array("Q")
-      self.subtree_sizes.fromfile(f, idxsize)
-      self.coords.fromfile(f, idxsize)
-      self.treedata.fromfile(f, nelems)
-      self.parents = array.array("Q")
-      self.parents.fromfile(f, nparents)
-      self.root_id = self.treedata[1]
+      header = treefile.read_header(f, filename)
+      if header.width not in Tree.TYPECODES:
+        raise error.FastsubtreesError(\
+            f"Invalid tree file \"{filename}\": unknown width")
+      self.width = header.width
+      self.UNDEF = Tree.UNDEFS[self.width]
+      self.generation = header.generation
+      names = [name for name in Tree.ARRAY_NAMES if name in header.sections]
+      self._lazy_header = (filename, header, verify)
+      for name in Tree.COMPUTED_ARRAYS:
+        if name not in header.sections:
+          delattr(self, name)
+          self._lazy_sections.add(name)
+      if mmap and treefile.can_map(header):
+        self._mapped = treefile.map_file(filename)
+        for name in names:
+          setattr(self, name,
+                  treefile.map_section(self._mapped, filename, header, name))
+      elif lazy:
+        for name in names:
+          delattr(self, name)
+        self._lazy_sections.update(names)
+      else:
+        for name in names:
+          setattr(self, name,
+                  treefile.read_section(f, filename, header, name, verify))
+    self.root_id = header.root_id if header.root_id is not None \
+        else self.treedata[1]
     logger.debug(f"Tree loaded from file \"{filename}\"")
     self.filename = filename
     return self
 
-  def _check_node_number(self, node):
-    if node < 0 or node > len(self.coords) - 1:
+  def __getattr__(self, name):
+    # only called if the attribute is not set, i.e. for the arrays
+    # which were not yet loaded from the tree file (see from_file)
+    if name not in self.__dict__.get("_lazy_sections", ()):
+      raise AttributeError(\
+          f"'{type(self).__name__}' object has no attribute '{name}'")
+    filename, header, verify = self._lazy_header
+    if name not in header.sections:
+      self._lazy_sections.discard(name)
+      values = getattr(self, Tree.COMPUTED_ARRAYS[name])()
+      setattr(self, name, values)
+      return values
+    with open(filename, "rb") as f:
+      current = treefile.read_header(f, filename)
+      if current.generation != header.generation or \
+          current.sections != header.sections:
+        raise error.FastsubtreesError(\
+            f"The tree file \"{filename}\" was modified after the tree "+\
+            f"was loaded, thus the '{name}' array cannot be loaded")
+      values = treefile.read_section(f, filename, header, name, verify)
+    logger.debug(f"Array '{name}' loaded from file \"{filename}\"")
+    self._lazy_sections.discard(name)
+    setattr(self, name, values)
+    return values
+
+  def is_mapped(self) -> bool:
+    """
+    Returns True if the arrays are memory mapped from the tree file.
+    """
+    return self._mapped is not None
+
+  def _make_writable(self):
+    """
+    Replace memory mapped arrays by copies in memory, which can be edited.
+
+    The memory map is not closed, since other objects (e.g. the results
+    of get_subtree_data) can still refer to it; it is unmapped when
+    they are garbage collected.
+    """
+    if self._mapped is None:
+      return
+    logger.debug("Copying the memory mapped tree arrays to memory")
+    for name in Tree.ARRAY_NAMES:
+      values = getattr(self, name)
+      # the arrays computed on loading (e.g. from files of format version 1)
+      # are already in memory
+      if isinstance(values, memoryview):
+        copy = array.array(values.format)
+        copy.frombytes(values.cast("B"))
+        setattr(self, name, copy)
+    self._mapped = None
+
+  def _index(self, node: int) -> Union[int, None]:
+    """
+    Returns the index of a node in the arrays indexed by node (coords,
+    subtree_sizes, parents), i.e. the node ID itself or, if the node IDs
+    are remapped, the position of the node ID in the sorted ids array;
+    None if the arrays do not contain the node.
+    """
+    if self.ids is None:
+      return node if 0 <= node < len(self.subtree_sizes) else None
+    i = bisect.bisect_left(self.ids, node)
+    return i if i < len(self.ids) and self.ids[i] == node else None
+
+  def _node_index(self, node: int) -> int:
+    i = self._index(node)
+    if i is None:
       raise error.NodeNotFoundError(f"Node ID '{node}' does not exist.")
+    return i
+
+  def _check_node_number(self, node):
+    self._node_index(node)
+
+  def _insert_index(self, node: int) -> int:
+    """
+    Adds the entries for a new node to the arrays indexed by node,
+    if necessary, and returns its index.
+    """
+    if self.ids is None:
+      n_to_append = node + 1 - len(self.coords)
+      if n_to_append > 0:
+        self.coords.extend([0] * n_to_append)
+        self.parents.extend([self.UNDEF] * n_to_append)
+        self.subtree_sizes.extend([0] * n_to_append)
+        self.tombstones.extend([0] * n_to_append)
+        self.depths.extend([0] * n_to_append)
+      return node
+    i = bisect.bisect_left(self.ids, node)
+    if i == len(self.ids) or self.ids[i] != node:
+      self.ids.insert(i, node)
+      self.coords.insert(i, 0)
+      self.parents.insert(i, self.UNDEF)
+      self.subtree_sizes.insert(i, 0)
+      self.tombstones.insert(i, 0)
+      self.depths.insert(i, 0)
+    return i
+
+  def is_remapped(self) -> bool:
+    """
+    Returns True if the node IDs are remapped to dense indices.
+    """
+    return self.ids is not None
 
   def get_parent(self, node: int) -> int:
     """
     Returns the parent ID of the given node.
     """
-    self._check_node_number(node)
-    return self.parents[node]
+    return self.parents[self._node_index(node)]
 
   def set_filename(self, filename: Union[str, Path]):
     """
@@ -0,0 +1,196 @@
+"""
+Reading and writing of fastsubtrees tree files.
+
+Format version 2 (written by Tree.to_file):
+- header (HEADER): magic number, format version, width of the arrays in bits,
+  flags (FLAG_REMAPPED), number of sections, root ID, size of the tree
+  (see Tree.get_treesize), edit generation (incremented at each edit
+  of the tree);
+- section table: an entry (SECTION) for each array, containing its name,
+  typecode, CRC32 checksum, offset in the file and number of elements;
+- CRC32 checksum of the header and section table;
+- the sections, i.e. the raw data of the arrays, each starting at an offset
+  which is a multiple of PAGESIZE, so that they can be memory mapped
+  (see map_section).
+All values are little endian.
+
+Format version 1 (only read): header of three unsigned 64-bit integers
+(size of subtree_sizes and coords, size of treedata, size of parents),
+followed by the subtree_sizes, coords, treedata and parents arrays
+(64-bit unsigned integers).
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections import namedtuple
+from fastsubtrees import error
+
+MAGIC = b"\x89FSTREE\n"
+VERSION = 2
+PAGESIZE = 4096
+HEADER = struct.Struct("<8sIIIIQQQ")
+SECTION = struct.Struct("<16sc3xIQQ")
+CHECKSUM = struct.Struct("<I")
+FLAG_REMAPPED = 1
+
+V1_HEADER = struct.Struct("QQQ")
+
+Section = namedtuple("Section", ["typecode", "checksum", "offset", "count"])
+
+class Header:
+  """
+  Information stored in the header of a tree file.
+  """
+
+  def __init__(self, version, width, flags, root_id, n_nodes, generation,
+               sections):
+    self.version = version
+    self.width = width
+    self.flags = flags
+    self.root_id = root_id
+    self.n_nodes = n_nodes
+    self.generation = generation
+    # dict name: Section
+    self.sections = sections
+
+def _aligned(offset):
+  return -(-offset // PAGESIZE) * PAGESIZE
+
+def _little_endian(values):
+  if sys.byteorder != "little":  # pragma: no cover
+    values = array.array(values.typecode, values)
+    values.byteswap()
+  return values
+
+def write(filename, width, flags, root_id, n_nodes, generation, arrays):
+  """
+  Write a tree file in the current format version.
+
+  The arrays are given as a list of (section name, array.array) pairs.
+  The file is written to a temporary file, which then replaces the
+  existing file, if any (thus memory maps of the existing file stay valid).
+  """
+  arrays = [(name, _little_endian(values)) for name, values in arrays]
+  offset = _aligned(HEADER.size + SECTION.size * len(arrays) + CHECKSUM.size)
+  table = []
+  for name, values in arrays:
+    table.append(SECTION.pack(name.encode(), values.typecode.encode(),
+        zlib.crc32(memoryview(values).cast("B")), offset, len(values)))
+    offset = _aligned(offset + len(values) * values.itemsize)
+  header = HEADER.pack(MAGIC, VERSION, width, flags, len(arrays), root_id,
+                       n_nodes, generation) + b"".join(table)
+  header += CHECKSUM.pack(zlib.crc32(header))
+  tmpfilename = f"{filename}.tmp"
+  with open(tmpfilename, "wb") as f:
+    f.write(header)
+    for name, values in arrays:
+      f.seek(_aligned(f.tell()))
+      values.tofile(f)
+  os.replace(tmpfilename, filename)
+
+def _read_v1_header(f, filename):
+  idxsize, nelems, nparents = V1_HEADER.unpack(f.read(V1_HEADER.size))
+  sections = {}
+  offset = V1_HEADER.size
+  for name, count in [("subtree_sizes", idxsize), ("coords", idxsize),
+                      ("treedata", nelems), ("parents", nparents)]:
+    sections[name] = Section("Q", None, offset, count)
+    offset += count * 8
+  return Header(1, 64, 0, None, None, 0, sections)
+
+def read_header(f, filename):
+  """
+  Read the header of a tree file (format version 1 or 2) from
+  a file object opened in binary mode.
+  """
+  data = f.read(HEADER.size)
+  if not data.startswith(MAGIC):
+    f.seek(0)
+    return _read_v1_header(f, filename)
+  if len(data) < HEADER.size:
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": truncated header")
+  magic, version, width, flags, n_sections, root_id, n_nodes, generation = \
+      HEADER.unpack(data)
+  if version != VERSION:
+    raise error.FastsubtreesError(\
+        f"Tree file \"{filename}\" has format version {version}, "+\
+        f"which is not supported (supported versions: 1, {VERSION})")
+  table = f.read(SECTION.size * n_sections)
+  checksum = f.read(CHECKSUM.size)
+  if len(checksum) < CHECKSUM.size or \
+      CHECKSUM.unpack(checksum)[0] != zlib.crc32(data + table):
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": header checksum mismatch")
+  sections = {}
+  for i in range(n_sections):
+    name, typecode, checksum, offset, count = \
+        SECTION.unpack_from(table, i * SECTION.size)
+    sections[name.rstrip(b"\x00").decode()] = \
+        Section(typecode.decode(), checksum, offset, count)
+  return Header(version, width, flags, root_id, n_nodes, generation, sections)
+
+def read_section(f, filename, header, name, verify=True):
+  """
+  Read a section of a tree file as an array.
+
+  If verify is True, the checksum of the section is verified
+  (only in format version 2).
+  """
+  if name not in header.sections:
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": section '{name}' not found")
+  section = header.sections[name]
+  values = array.array(section.typecode)
+  f.seek(section.offset)
+  try:
+    values.fromfile(f, section.count)
+  except EOFError:
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": section '{name}' is truncated")
+  if verify and section.checksum is not None and \
+      zlib.crc32(memoryview(values).cast("B")) != section.checksum:
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": checksum mismatch "+\
+        f"in section '{name}'")
+  if sys.byteorder != "little" and header.version > 1:  # pragma: no cover
+    values.byteswap()
+  return values
+
+def can_map(header):
+  """
+  True if the sections of a tree file can be used as memory mapped arrays,
+  i.e. if their byte order is the native byte order.
+  """
+  return header.version == 1 or sys.byteorder == "little"
+
+def map_file(filename):
+  """
+  Memory map a tree file (read-only).
+  """
+  with open(filename, "rb") as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def map_section(mapped, filename, header, name):
+  """
+  Returns a read-only memoryview of a section of a memory mapped tree file,
+  which can be indexed as the array.array returned by read_section,
+  without reading the data from the file.
+
+  The checksum of the section is not verified, since this would
+  require reading the whole section.
+  """
+  if name not in header.sections:
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": section '{name}' not found")
+  section = header.sections[name]
+  end = section.offset + section.count * \
+      array.array(section.typecode).itemsize
+  if section.count and end > len(mapped):
+    raise error.FastsubtreesError(\
+        f"Invalid tree file \"{filename}\": section '{name}' is truncated")
+  return memoryview(mapped)[section.offset:end].cast(section.typecode)
@@ -0,0 +1,380 @@
+"""
+Vectorized (NumPy-based) implementations of the tree construction steps.
+
+NumPy is an optional dependency. If it is not installed, the functions
+of this module cannot be used and the pure-Python implementation
+in the Tree class is used instead.
+"""
+
+import array
+import itertools
+from fastsubtrees import logger, error
+
+try:
+  import numpy as np
+except ImportError:  # pragma: no cover
+  np = None
+
+def numpy_available() -> bool:
+  return np is not None
+
+def require_numpy(feature: str):
+  if np is None:
+    raise error.FastsubtreesError(\
+        f"NumPy is required for {feature}, but it is not installed")
+
+def to_array(values, typecode="Q") -> array.array:
+  """
+  Convert a NumPy array of non-negative integers to an array.array.
+  """
+  result = array.array(typecode)
+  dtype = np.dtype(f"u{result.itemsize}")
+  result.frombytes(np.ascontiguousarray(values, dtype=dtype).tobytes())
+  return result
+
+def from_array(values) -> "np.ndarray":
+  """
+  View an array.array (or any buffer of unsigned integers) as int64 array.
+  """
+  return np.frombuffer(values, dtype=f"u{values.itemsize}").astype(np.int64)
+
+def gather(values, indices) -> "np.ndarray":
+  """
+  Elements at the given indices of an array.array (or any buffer of
+  unsigned integers), as int64 array, without converting the whole array.
+  """
+  return np.frombuffer(values, dtype=f"u{values.itemsize}")[indices]\
+      .astype(np.int64)
+
+def pairs_to_arrays(generator):
+  """
+  Collect the (element, parent) pairs yielded by a generator
+  into two int64 arrays.
+  """
+  flat = np.fromiter(itertools.chain.from_iterable(generator),
+                     dtype=np.int64)
+  if len(flat) % 2:
+    raise error.ConstructionError(\
+        "The generator must yield (element, parent) pairs")
+  pairs = flat.reshape(-1, 2)
+  return pairs[:, 0], pairs[:, 1]
+
+def chunks_to_arrays(chunks):
+  """
+  Concatenate (elements, parents) chunks of arrays into two int64 arrays.
+  """
+  elems = []
+  parents = []
+  for chunk_elems, chunk_parents in chunks:
+    elems.append(np.asarray(chunk_elems, dtype=np.int64))
+    parents.append(np.asarray(chunk_parents, dtype=np.int64))
+  if not elems:
+    return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+  return np.concatenate(elems), np.concatenate(parents)
+
+# maximum number of digits of the integers parsed by parse_int_columns
+MAX_DIGITS = 18
+
+def _separator_positions(data, separator):
+  """
+  Positions of the non-overlapping occurrences of the separator,
+  or None if occurrences overlap (which would need a sequential scan).
+  """
+  first = separator[0]
+  positions = np.flatnonzero(data[:len(data) - len(separator) + 1] == first)
+  for i in range(1, len(separator)):
+    positions = positions[data[positions + i] == separator[i]]
+  if len(positions) > 1 and np.diff(positions).min() < len(separator):
+    return None
+  return positions
+
+def _parse_digits(data, field_starts, field_ends):
+  lengths = field_ends - field_starts
+  if lengths.min() < 1 or lengths.max() > MAX_DIGITS:
+    return None
+  values = np.zeros(len(lengths), dtype=np.int64)
+  for offset in range(lengths.max()):
+    inside = offset < lengths
+    digits = data[np.where(inside, field_starts + offset, 0)]
+    digits = digits.astype(np.int64) - ord("0")
+    if (inside & ((digits < 0) | (digits > 9))).any():
+      return None
+    values = np.where(inside, values * 10 + digits, values)
+  return values
+
+def parse_int_columns(block, separator, line_end, columns):
+  """
+  Parse the given columns of all lines of a block of bytes, which ends
+  with line_end, into int64 arrays.
+
+  The fields are located using the positions of the separators and line
+  ends; their digits are then converted to integers for all lines at once.
+  Returns None if the block cannot be parsed this way (e.g. if a line has
+  too few columns or a field is not a sequence of digits), so that the
+  caller can fall back to parsing the block line by line.
+  """
+  data = np.frombuffer(block, dtype=np.uint8)
+  ends = _separator_positions(data, np.frombuffer(line_end, dtype=np.uint8))
+  seps = _separator_positions(data, np.frombuffer(separator, dtype=np.uint8))
+  if ends is None or seps is None or len(ends) == 0 or \
+      ends[-1] != len(data) - len(line_end) or \
+      np.count_nonzero(data == ord("\n")) != len(ends):
+    return None
+  starts = np.empty(len(ends), dtype=np.int64)
+  starts[0] = 0
+  starts[1:] = ends[:-1] + len(line_end)
+  first_sep = np.searchsorted(seps, starts)
+  n_seps = np.searchsorted(seps, ends) - first_sep
+  if n_seps.min() < max(columns):
+    return None
+  result = []
+  for column in columns:
+    if column == 0:
+      field_starts = starts
+    else:
+      field_starts = seps[first_sep + column - 1] + len(separator)
+    if len(seps) > 0:
+      field_ends = np.where(n_seps > column,
+          seps[np.minimum(first_sep + column, len(seps) - 1)], ends)
+    else:
+      field_ends = ends
+    field_ends = field_ends - (data[field_ends - 1] == ord("\r"))
+    values = _parse_digits(data, field_starts, field_ends)
+    if values is None:
+      return None
+    result.append(values)
+  return result
+
+def _check_pairs(elems, parents_in, sorted_elems):
+  """
+  Check that the node IDs are non-negative and unique
+  and that there is exactly one root. Returns the root ID.
+  """
+  negative = elems < 0
+  if negative.any():
+    raise error.ConstructionError(\
+        f"The node IDs must be >= 0, found: {elems[negative][0]}")
+  negative = parents_in < 0
+  if negative.any():
+    raise error.ConstructionError(\
+        f"The node IDs must be >= 0, found: {parents_in[negative][0]}")
+  roots = elems[elems == parents_in]
+  repeated = sorted_elems[1:][sorted_elems[1:] == sorted_elems[:-1]]
+  if len(repeated) > 0:
+    elem = repeated[0]
+    if elem in roots:
+      raise error.ConstructionError(\
+          f"Node {elem} had already been added as root, cannot " + \
+          "add it again with a different parent")
+    raise error.ConstructionError(\
+        f"Node '{elem}' had already been added, cannot add it again")
+  if len(roots) == 0:
+    raise error.ConstructionError("The tree does not have any root node")
+  if len(roots) > 1:
+    raise error.ConstructionError(\
+        f"The tree already has a root node {roots[0]}, " + \
+        f"cannot add a second root node {roots[1]}")
+  return int(roots[0])
+
+def compute_parents(elems, parents_in, undef):
+  """
+  Compute the parents table from arrays of elements and parents.
+
+  Returns the parents table and the root ID.
+  """
+  logger.info("Constructing temporary parents table (vectorized)...")
+  sorted_elems = np.sort(elems)
+  root_id = _check_pairs(elems, parents_in, sorted_elems)
+  parents = np.full(int(sorted_elems[-1]) + 1, undef, dtype=np.int64)
+  parents[elems] = parents_in
+  return parents, root_id
+
+def remap_ids(elems, parents_in):
+  """
+  Map the node IDs to dense indices, in the order of the IDs, so that
+  the order of the siblings in the traversal is not changed.
+
+  Returns the sorted node IDs and the arrays of elements and parents
+  mapped to the indices.
+  """
+  logger.info("Remapping node IDs to dense indices (vectorized)...")
+  ids = np.sort(elems)
+  _check_pairs(elems, parents_in, ids)
+  parents_pos = np.searchsorted(ids, parents_in)
+  missing = ids[np.minimum(parents_pos, len(ids) - 1)] != parents_in
+  if missing.any():
+    i = np.flatnonzero(missing)[0]
+    raise error.ConstructionError(\
+        f"The node '{elems[i]}' has parent '{parents_in[i]}', "+\
+        "which is not in the tree")
+  return ids, np.searchsorted(ids, elems), parents_pos
+
+def ids_of_indices(values, ids, undef):
+  """
+  Replace the indices in an array by the corresponding node IDs,
+  except for the undef values.
+  """
+  values = values.copy()
+  defined = values != undef
+  values[defined] = ids[values[defined]]
+  return values
+
+def validate_parents(parents, undef):
+  logger.info("Validating the parents table data (vectorized)...")
+  elems = np.flatnonzero(parents != undef)
+  nonroot = elems[parents[elems] != elems]
+  nonroot_parents = parents[nonroot]
+  outside = nonroot_parents >= len(parents)
+  if outside.any():
+    raise error.ConstructionError(\
+        f"The node '{nonroot[outside][0]}' has parent "+\
+        f"'{nonroot_parents[outside][0]}', which is not in the tree")
+  missing = parents[nonroot_parents] == undef
+  if missing.any():
+    raise error.ConstructionError(\
+        f"The node '{nonroot_parents[missing][0]}' has parent "+\
+        f"'{undef}', which is not in the tree")
+
+def compute_depths(parents, root_id, undef):
+  """
+  Compute the depth of each node (0 for the nodes not contained in the
+  tree) by pointer jumping, i.e. in a number of passes logarithmic in the
+  depth of the tree: in each pass, the distance of each node to an
+  ancestor is added to the distance of the ancestor to its own ancestor.
+  """
+  elems = np.flatnonzero(parents != undef)
+  depths = np.zeros(len(parents), dtype=np.int64)
+  depths[elems] = 1
+  depths[root_id] = 0
+  ancestors = parents.copy()
+  active = elems[parents[elems] != root_id]
+  active = active[active != root_id]
+  max_passes = len(parents).bit_length() + 1
+  while len(active) > 0:
+    if max_passes == 0:
+      raise error.CycleError(\
+          f"The node '{active[0]}' is not connected to the root "+\
+          f"'{root_id}' (the parent relationships contain a cycle)")
+    max_passes -= 1
+    active_ancestors = ancestors[active]
+    depths[active] += depths[active_ancestors]
+    ancestors[active] = ancestors[active_ancestors]
+    active = active[ancestors[active] != root_id]
+  return depths
+
+def compute_levels(parents, depths, undef):
+  """
+  Group the nodes of the tree by depth (see compute_depths).
+  """
+  elems = np.flatnonzero(parents != undef)
+  by_depth = elems[np.argsort(depths[elems], kind="stable")]
+  level_sizes = np.bincount(depths[elems])
+  return np.split(by_depth, np.cumsum(level_sizes)[:-1])
+
+def compute_subtree_sizes(parents, levels, undef):
+  """
+  Compute the subtree sizes, by a bottom-up pass over the levels.
+
+  Returns the subtree sizes and, for each node, the smallest node ID in its
+  subtree (which determines the order of the siblings in the traversal).
+  """
+  logger.info("Constructing subtree sizes table (vectorized)...")
+  defined = parents != undef
+  sizes = defined.astype(np.int64)
+  minkeys = np.where(defined, np.arange(len(parents)), undef)
+  for level in reversed(levels[1:]):
+    np.add.at(sizes, parents[level], sizes[level])
+    np.minimum.at(minkeys, parents[level], minkeys[level])
+  return sizes, minkeys
+
+def compute_treedata_and_coords(parents, levels, sizes, minkeys, root_id,
+                                root_coord, undef):
+  """
+  Compute the depth-first traversal order.
+
+  Siblings are sorted by the smallest node ID in their subtrees,
+  so that the result is identical to the one of the pure-Python
+  implementation. The offset of each node from its parent
+  is the prefix sum of the sizes of its preceding siblings.
+  """
+  logger.info("Computing depth-first tree traversal order (vectorized)...")
+  nonroot = np.concatenate(levels[1:]) if len(levels) > 1 \
+      else np.array([], dtype=np.int64)
+  siblings = nonroot[np.lexsort((minkeys[nonroot], parents[nonroot]))]
+  sibling_sizes = sizes[siblings]
+  preceding = np.cumsum(sibling_sizes) - sibling_sizes
+  sibling_parents = parents[siblings]
+  is_first = np.ones(len(siblings), dtype=bool)
+  is_first[1:] = sibling_parents[1:] != sibling_parents[:-1]
+  group_start = np.maximum.accumulate(np.where(is_first, preceding, 0))
+  offsets = np.zeros(len(parents), dtype=np.int64)
+  offsets[siblings] = preceding - group_start
+  coords = np.zeros(len(parents), dtype=np.int64)
+  coords[root_id] = root_coord
+  for level in levels[1:]:
+    coords[level] = coords[parents[level]] + 1 + offsets[level]
+  treedata = np.full(sizes[root_id] + 1, undef, dtype=np.int64)
+  treedata[coords[root_id]] = root_id
+  treedata[coords[nonroot]] = nonroot
+  return treedata, coords
+
+def count_tombstones(treedata, coords, sizes, undef):
+  """
+  Count the UNDEF values in the treedata range of the subtree of each node.
+  """
+  prefix = np.zeros(len(treedata) + 1, dtype=np.int64)
+  np.cumsum(treedata == undef, out=prefix[1:])
+  return prefix[coords + sizes] - prefix[coords]
+
+def node_indices(nodes, n_indices, ids=None):
+  """
+  Indices of the nodes in the arrays indexed by node (see Tree._index),
+  given the length of the arrays and the sorted node IDs, if the node IDs
+  are remapped; -1 for the nodes which are not contained in the arrays.
+  """
+  nodes = np.asarray(nodes, dtype=np.int64)
+  if ids is None:
+    return np.where((nodes >= 0) & (nodes < n_indices), nodes, -1)
+  if len(ids) == 0:
+    return np.full(len(nodes), -1, dtype=np.int64)
+  # view of the IDs (which are smaller than 2**63), compared with the nodes
+  # without conversion to floating point
+  ids = np.frombuffer(ids, dtype="i8" if ids.itemsize == 8 else "u4")
+  pos = np.minimum(np.searchsorted(ids, nodes), len(ids) - 1)
+  return np.where(ids[pos] == nodes, pos, -1)
+
+def outermost_ranges(starts, ends):
+  """
+  Given ranges which are either nested or disjoint (such as the treedata
+  ranges of subtrees), select the ranges not contained in other ranges
+  (of identical ranges, only the first one is selected).
+
+  Returns the indices of the selected ranges, sorted by start.
+  """
+  order = np.lexsort((-ends, starts))
+  sorted_starts = starts[order]
+  sorted_ends = ends[order]
+  prev_max_end = np.empty(len(order), dtype=np.int64)
+  if len(order) > 0:
+    prev_max_end[0] = -1
+    np.maximum.accumulate(sorted_ends[:-1], out=prev_max_end[1:])
+  return order[sorted_starts >= prev_max_end]
+
+def gather_ranges(data, starts, sizes):
+  """
+  Concatenate the slices data[start:start+size] for each range.
+  """
+  offsets = np.cumsum(sizes) - sizes
+  positions = np.repeat(starts - offsets, sizes) + \
+      np.arange(int(sizes.sum()), dtype=np.int64)
+  return data[positions]
+
+def treedata_depths(n, starts, sizes):
+  """
+  Depth of the node at each of the n positions of treedata, given the
+  treedata ranges of the subtrees of all nodes of the tree, i.e. the number
+  of ranges containing the position, minus one.
+  """
+  changes = np.bincount(starts, minlength=n + 1) - \
+      np.bincount(starts + sizes, minlength=n + 1)
+  return np.cumsum(changes[:n]) - 1
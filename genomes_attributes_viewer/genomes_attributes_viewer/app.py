@@ -142,12 +142,16 @@ def update_figure(clicks, attribute, taxid):
       boxplot_dict[id + ')'] = []
       my_str = id.partition('(')[-1]
       subtree_root = int(my_str)
-      attribute_list = tree.subtree_attribute_data(subtree_root, attribute)
-      sublist = list()
-      for att in attribute_list:
-        if att is not None:
-          for i in att:
-            sublist.append(i)
+      if tree.has_attribute_column(attribute):
+        values, _ = tree.subtree_attribute_csr(subtree_root, attribute)
+        sublist = values.tolist()
+      else:
+        attribute_list = tree.subtree_attribute_data(subtree_root, attribute)
+        sublist = list()
+        for att in attribute_list:
+          if att is not None:
+            for i in att:
+              sublist.append(i)
       final_values.append(sublist)
       sublist = []
     list_len = [len(i) for i in final_values]
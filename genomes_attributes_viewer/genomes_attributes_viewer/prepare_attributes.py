@@ -10,6 +10,9 @@ ATTR_COLUMN["GC_content"] = 3
 ATTR_CAST = {}
 ATTR_CAST["genome_size"] = int
 ATTR_CAST["GC_content"] = float
+ATTR_COLUMN_KIND = {}
+ATTR_COLUMN_KIND["genome_size"] = "int"
+ATTR_COLUMN_KIND["GC_content"] = "float"
 ATTR_INPUTFILE="accession_taxid_attribute.tsv.gz"
 
 def generate_attribute_files(workdir, force):
@@ -22,10 +25,16 @@ def generate_attribute_files(workdir, force):
   for attribute in gav.ATTRIBUTES:
     if tree.has_attribute(attribute) and not force:
       logger.info(f"Attribute '{attribute}' found")
+      if not tree.has_attribute_column(attribute):
+        tree.create_attribute_column(attribute, ATTR_COLUMN_KIND[attribute],
+                                     multivalued=True)
+        logger.success(f"Column of attribute '{attribute}' added to tree")
     else:
       if force and tree.has_attribute(attribute):
         tree.destroy_attribute(attribute)
       tree.create_attribute_from_tabular(attribute, attr_inputfile,
           elem_field_num=TAXID_COLUMN, attr_field_num=ATTR_COLUMN[attribute],
           casting_fn=ATTR_CAST[attribute])
+      tree.create_attribute_column(attribute, ATTR_COLUMN_KIND[attribute],
+                                   multivalued=True)
       logger.success(f"Attribute '{attribute}' added to tree")
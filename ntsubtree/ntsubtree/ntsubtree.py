@@ -1,4 +1,5 @@
 import fastsubtrees
+from fastsubtrees import vectorized
 from ntdownload import Downloader
 from pathlib import Path
 from shutil import rmtree
@@ -42,6 +43,13 @@ def read_ranks():
     result[taxid] = rank
   return result
 
+def rank_column_kind():
+  """
+  Ranks are stored as a categorical attribute column, if possible,
+  since there are only few distinct ranks.
+  """
+  return "category" if vectorized.numpy_available() else None
+
 def n_lines(filename):
   n = 0
   with open(filename, 'r') as f:
@@ -92,8 +100,11 @@ def update(force_download=False, force_construct=False):
     names_index = None
     if tree.has_attribute("rank"):
       tree.replace_attribute_values("rank", read_ranks())
+      if rank_column_kind() and not tree.has_attribute_column("rank"):
+        tree.create_attribute_column("rank", rank_column_kind())
     else:
-      tree.create_attribute("rank", yield_ranks())
+      tree.create_attribute("rank", yield_ranks(),
+                            column_kind=rank_column_kind())
   else:
     fastsubtrees.logger.info("No tree update needed.")
 
@@ -124,7 +135,7 @@ def setup():
   fastsubtrees.logger.info("Loading taxonomy names...")
   tree.create_attribute("taxname", yield_names())
   fastsubtrees.logger.info("Loading taxonomy ranks...")
-  tree.create_attribute("rank", yield_ranks())
+  tree.create_attribute("rank", yield_ranks(), column_kind=rank_column_kind())
 
 def __auto_setup():
   """
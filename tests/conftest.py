@@ -29,6 +29,20 @@ def testout():
     os.mkdir(testoutdir)
   return lambda fn: os.path.join(testoutdir, fn)
 
+@pytest.fixture
+def sparse_factor():
+  return 10**7
+
+@pytest.fixture
+def sparse_ids(sparse_factor):
+  """
+  Yields the (element, parent) pairs of a tabular file, multiplying
+  the IDs by sparse_factor (e.g. up to 10^10 for medium_tree.tsv)
+  """
+  import fastsubtrees.ids_modules.ids_from_tabular_file as m
+  return lambda fn, **kwargs: [(e * sparse_factor, p * sparse_factor) \
+      for e, p in m.element_parent_ids(fn, **kwargs)]
+
 @pytest.fixture
 def small_tree_file(testdata, testout):
   import fastsubtrees
@@ -11,23 +11,38 @@ Output:
   - a line for each other node containing:  child_id <TAB> parent_id
 
 Usage:
-  ./generate_random_tree.py <n>
+  ./generate_random_tree.py [options] <n>
 
+Options:
+  -c, --chain       generate a chain-shaped tree, i.e. the parent of each
+                    node is the previous node (the depth of the tree is n-1)
+  -w, --window W    choose the parent of each node among the W previous
+                    nodes, generating a deep tree (expected depth ~ 2n/W)
+  -r, --reverse     label the nodes in reverse order, i.e. so that
+                    each parent has a larger ID than its children
+                    (the root is then labeled with n)
 """
 from docopt import docopt
 import sys
 import random
 
+def random_parent(i, window):
+  if window:
+    return random.randint(max(1, i - window + 1), i)
+  return random.randint(1, i)
+
 def main(args):
   n = int(args["<n>"])
   if n < 1:
     sys.stderr.write("Error: n must be an integer > 0\n")
     exit(1)
-  print("1\t1")
+  window = 1 if args["--chain"] else int(args["--window"] or 0)
+  label = (lambda x: n + 1 - x) if args["--reverse"] else (lambda x: x)
+  print(f"{label(1)}\t{label(1)}")
   for i in range(1, n):
-    parent = random.randint(1, i)
+    parent = random_parent(i, window)
     child = i+1
-    print(f"{child}\t{parent}")
+    print(f"{label(child)}\t{label(parent)}")
 
 if __name__ == "__main__":
   arguments = docopt(__doc__, version="1.0")
@@ -32,6 +32,19 @@ def test_new_from_tabular(testout, testdata, script, script_runner):
   ret = script_runner.run(script("fastsubtrees"), *args)
   assert ret.returncode == 0
   assert os.path.exists(testout("small_tree.tree"))
+  for engine in ["python", "auto"]:
+    ret = script_runner.run(script("fastsubtrees"), *args, "--engine", engine)
+    assert ret.returncode == 0
+  ret = script_runner.run(script("fastsubtrees"), *args, "--engine", "xyz")
+  assert ret.returncode == 1
+  assert "ERROR" in ret.stderr
+  for width in ["32", "64", "auto"]:
+    ret = script_runner.run(script("fastsubtrees"), *args, "--width", width)
+    assert ret.returncode == 0
+  ret = script_runner.run(script("fastsubtrees"), *args, "--width", "16")
+  assert ret.returncode == 1
+  ret = script_runner.run(script("fastsubtrees"), *args, "--remap")
+  assert ret.returncode == 0
 
 @pytest.mark.script_launch_mode('subprocess')
 def test_update(testout, testdata, script, script_runner):
@@ -338,6 +351,23 @@ def test_attribute_failures_and_warnings(testout, testdata, ids_modules, script,
   assert ret.returncode == 1
   assert "ERROR" in ret.stderr
 
+def check_aggregates(testdata, script, script_runner, small_tree_file,
+                     column_args):
+  args = ["attribute", small_tree_file, "--replace", "attrI",
+          testdata("small_tree_attrI.tsv"), "--type", "int"] + column_args
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+  args = ["query", small_tree_file, "3", "attrI", "attrX",
+          "--aggregate", "count,sum,min,max,mean"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 1
+  args = ["query", small_tree_file, "3", "attrI", "--aggregate",
+          "count,sum,min,max,mean"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+  assert ret.stdout == "# attribute\tcount\tsum\tmin\tmax\tmean\n"+\
+      "attrI\t3\t1900\t300\t900\t633.3333333333334\n"
+
 @pytest.mark.script_launch_mode('subprocess')
 def test_attribute_edit_and_query(testout, testdata, script,
                                   script_runner, small_tree_file):
@@ -407,6 +437,11 @@ def test_attribute_edit_and_query(testout, testdata, script,
   ret = script_runner.run(script("fastsubtrees"), *args)
   assert ret.returncode == 0
   assert ret.stdout.strip() == "900"
+  # aggregates of the int attribute
+  check_aggregates(testdata, script, script_runner, small_tree_file, [])
+  args = ["query", small_tree_file, "3", "attrI", "--aggregate", "median"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 1
   # create custom type attribute
   args = ["attribute", small_tree_file, 'attrJ',
           "--module", __file__, "--fn", "attribute_values_wrapper",
@@ -512,6 +547,18 @@ def test_edit(testout, testdata, ids_modules, script, script_runner,
   assert ret.returncode == 0
   assert ret.stdout == "".join(f"{x}\n" for x in
       results_query_small_tree_id_8)
+  # compact the tree, removing the positions of the deleted nodes
+  args = ["query", testout("small_tree.tree"), "1", "attrX", "-H"]
+  expected = script_runner.run(script("fastsubtrees"), *args).stdout
+  size = Path(testout("small_tree.tree.attrX.attr")).stat().st_size
+  args = ["tree", "--compact", testout("small_tree.tree")]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+  assert "Number of bytes reclaimed" in ret.stderr
+  assert Path(testout("small_tree.tree.attrX.attr")).stat().st_size < size
+  args = ["query", testout("small_tree.tree"), "1", "attrX", "-H"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.stdout == expected
   # delete all values of attrX
   args = ["attribute", "--delete", testout("small_tree.tree"), 'attrX']
   ret = script_runner.run(script("fastsubtrees"), *args)
@@ -522,3 +569,81 @@ def test_edit(testout, testdata, ids_modules, script, script_runner,
   assert ret.returncode == 1
   assert "ERROR" in ret.stderr
 
+
+@pytest.mark.script_launch_mode('subprocess')
+def test_convert(testout, testdata, prebuilt, script, script_runner):
+  import shutil
+  v1fname = testout("small_tree_v1.tree")
+  shutil.copyfile(prebuilt("small_tree.tree"), v1fname)
+  args = ["attribute", v1fname, "attrX", testdata("small_tree_attrX.tsv")]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+  args = ["query", v1fname, "1", "attrX"]
+  expected = script_runner.run(script("fastsubtrees"), *args).stdout
+  # convert to another file, copying the attribute files
+  v2fname = testout("small_tree_v2.tree")
+  Path(v2fname + ".attrX.attr").unlink(missing_ok=True)
+  ret = script_runner.run(script("fastsubtrees"), "convert", v1fname, v2fname)
+  assert ret.returncode == 0
+  with open(v2fname, "rb") as f:
+    assert f.read(8) == b"\x89FSTREE\n"
+  assert Path(v2fname + ".attrX.attr.idx").read_bytes() == \
+      Path(v1fname + ".attrX.attr.idx").read_bytes()
+  ret = script_runner.run(script("fastsubtrees"), "query", v2fname, "1",
+                          "attrX")
+  assert ret.returncode == 0
+  assert ret.stdout == expected
+  # convert in place
+  ret = script_runner.run(script("fastsubtrees"), "convert", v1fname)
+  assert ret.returncode == 0
+  with open(v1fname, "rb") as f:
+    assert f.read(8) == b"\x89FSTREE\n"
+  ret = script_runner.run(script("fastsubtrees"), "query", v1fname, "1",
+                          "attrX")
+  assert ret.stdout == expected
+  ret = script_runner.run(script("fastsubtrees"), "convert",
+                          testout("not_existing.tree"))
+  assert ret.returncode == 1
+
+@pytest.mark.script_launch_mode('subprocess')
+def test_attribute_column_aggregate(testdata, script, script_runner,
+                                    small_tree_file):
+  pytest.importorskip("numpy")
+  args = ["attribute", small_tree_file, "attrI",
+          testdata("small_tree_attrI.tsv"), "--type", "int"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+  check_aggregates(testdata, script, script_runner, small_tree_file,
+                   ["--column", "int"])
+  args = ["attribute", "--delete", small_tree_file, "attrI"]
+  ret = script_runner.run(script("fastsubtrees"), *args)
+  assert ret.returncode == 0
+
+def test_attribute_column_created_once(testdata, testout, monkeypatch):
+  pytest.importorskip("numpy")
+  from docopt import docopt
+  from fastsubtrees import Tree
+  from fastsubtrees.commands import attribute
+  tree = Tree.construct_from_tabular(testdata("small_tree.tsv"))
+  tree.to_file(testout("small_tree_column_once.tree"))
+  tree.destroy_all_attributes()
+  calls = []
+  create = Tree.create_attribute_column
+  monkeypatch.setattr(Tree, "create_attribute_column",
+      lambda *args: calls.append(args[2:]) or create(*args))
+
+  def run(*argv):
+    attribute.manage_attribute(docopt(attribute.__doc__,
+        argv=["attribute", "tree", *argv, "attrI",
+              testdata("small_tree_attrI.tsv"), "--type", "int"]), tree)
+  run("--column", "int")
+  assert calls == [("int", False)]
+  # the existing column is updated, not created again
+  for action in ["--replace", "--new"]:
+    run(action, "--column", "int")
+  assert calls == [("int", False)]
+  # the column is created again if its kind changes
+  run("--replace", "--column", "float")
+  run("--replace", "--column", "float", "--multivalued")
+  assert calls == [("int", False), ("float", False), ("float", True)]
+  assert tree.subtree_aggregate(3, "attrI", ["sum"]) == {"sum": 1900.0}
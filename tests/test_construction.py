@@ -1,5 +1,6 @@
 import pytest
-from fastsubtrees.ids_modules.ids_from_tabular_file import element_parent_ids
+from fastsubtrees.ids_modules.ids_from_tabular_file import element_parent_ids, \
+    element_parent_id_chunks
 from fastsubtrees.ids_modules.attr_from_tabular_file import attribute_values
 from fastsubtrees import Tree, error
 
@@ -88,7 +89,7 @@ def test_get_methods(testdata):
   assert tree.get_parent(8) == 1
   assert tree.get_subtree_size(1) == 8
   assert tree.get_subtree_size(8) == 6
-  assert tree.get_parent(6) == Tree.UNDEF
+  assert tree.get_parent(6) == tree.UNDEF
   assert tree.get_subtree_size(6) == 0
   assert list(tree.get_subtree_data(6)) == []
 
@@ -106,6 +107,30 @@ def test_construction_node0(testdata):
   tree = Tree.construct_from_tabular(infname)
   assert list(tree.subtree_ids(tree.root_id)) == [0, 1]
 
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_construction_width(testdata, engine, monkeypatch):
+  if engine == "numpy":
+    pytest.importorskip("numpy")
+  infname = testdata('small_tree.tsv')
+  tree = Tree.construct_from_tabular(infname, engine=engine)
+  assert tree.width == 32
+  assert tree.UNDEF == 2**32 - 1
+  assert tree.get_parent(6) == tree.UNDEF
+  expected = Tree.construct_from_tabular(infname, engine=engine, width=64)
+  assert expected.width == 64
+  assert list(tree.treedata[1:]) == list(expected.treedata[1:])
+  assert list(tree.coords) == list(expected.coords)
+  # use a smaller UNDEF value for 32 bits, to avoid large arrays in the test
+  monkeypatch.setitem(Tree.UNDEFS, 32, 1000)
+  large_ids = [(1, 1), (2, 1), (1000, 2)]
+  tree = Tree.construct(large_ids, engine=engine)
+  assert tree.width == 64
+  assert list(tree.subtree_ids(1)) == [1, 2, 1000]
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(large_ids, engine=engine, width=32)
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(large_ids, engine=engine, width=16)
+
 def test_construction_err_repeated_ids(testdata):
   infname = testdata('repeated_nodes.tsv')
   generator = element_parent_ids(infname)
@@ -149,3 +174,238 @@ def test_construction_err_parent_not_exist(testdata):
   generator = element_parent_ids(infname)
   with pytest.raises(error.ConstructionError):
     Tree.construct(generator)
+
+ERRFILES = ['repeated_nodes.tsv', 'no_root_node.tsv', 'multiple_root_nodes.tsv',
+            'same_node_root_and_not.tsv', 'negative_parent.tsv',
+            'negative_node.tsv', 'parent_not_exist.tsv',
+            'parent_not_exist_small.tsv']
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_construction_remap(testdata, sparse_ids, sparse_factor, engine):
+  if engine == "numpy":
+    pytest.importorskip("numpy")
+  factor = sparse_factor
+  for fn in ['small_tree.tsv', 'medium_tree.tsv']:
+    tree = Tree.construct(sparse_ids(testdata(fn)), engine=engine, remap=True)
+    expected = Tree.construct_from_tabular(testdata(fn), engine=engine)
+    assert tree.is_remapped()
+    assert len(tree.coords) == len(tree.ids) == expected.get_treesize()
+    assert tree.root_id == expected.root_id * factor
+    assert list(tree.subtree_ids(tree.root_id)) == \
+        [n * factor for n in expected.subtree_ids(expected.root_id)]
+    for node in expected.subtree_ids(expected.root_id):
+      assert tree.get_parent(node * factor) == \
+          expected.get_parent(node) * factor
+      assert tree.get_subtree_size(node * factor) == \
+          expected.get_subtree_size(node)
+      assert tree.get_depth(node * factor) == expected.get_depth(node)
+    with pytest.raises(error.NodeNotFoundError):
+      tree.subtree_ids(factor + 1)
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+@pytest.mark.parametrize("infname", ERRFILES + ['cycle.tsv'])
+def test_construction_remap_errors(testdata, testout, engine, infname):
+  if engine == "numpy":
+    pytest.importorskip("numpy")
+  if infname == 'cycle.tsv':
+    with open(testout(infname), "w") as f:
+      f.write("1\t1\n2\t3\n3\t2\n")
+    infname = testout(infname)
+  else:
+    infname = testdata(infname)
+  with pytest.raises(error.ConstructionError) as exc_info:
+    Tree.construct(element_parent_ids(infname), engine=engine, remap=True)
+  # only the errors due to cycles are reported as such
+  assert isinstance(exc_info.value, error.CycleError) == \
+      infname.endswith('cycle.tsv')
+  # no root (the original error is not replaced)
+  with pytest.raises(error.ConstructionError, match="does not have any root"):
+    Tree.construct(iter([(10, 20), (20, 10)]), engine=engine, remap=True)
+
+@pytest.mark.parametrize("infname", ['small_tree.tsv',
+  'small_tree.shuffled.tsv',
+  'medium_tree.tsv', 'construction_node0.tsv', 'just_root.tsv'])
+def test_construction_numpy_engine(testdata, infname):
+  pytest.importorskip("numpy")
+  python_tree = Tree.construct_from_tabular(testdata(infname), engine="python")
+  numpy_tree = Tree.construct_from_tabular(testdata(infname), engine="numpy")
+  assert numpy_tree.root_id == python_tree.root_id
+  assert numpy_tree.treedata == python_tree.treedata
+  assert numpy_tree.coords == python_tree.coords
+  assert numpy_tree.subtree_sizes == python_tree.subtree_sizes
+  assert numpy_tree.parents == python_tree.parents
+  assert numpy_tree.depths == python_tree.depths
+
+@pytest.mark.parametrize("infname", ERRFILES)
+def test_construction_numpy_engine_errors(testdata, infname):
+  pytest.importorskip("numpy")
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(element_parent_ids(testdata(infname)), engine="numpy")
+
+def test_construction_numpy_engine_cycle():
+  pytest.importorskip("numpy")
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(iter([(1, 1), (2, 3), (3, 2)]), engine="numpy")
+
+def test_construction_unknown_engine(testdata):
+  with pytest.raises(error.ConstructionError):
+    Tree.construct_from_tabular(testdata('small_tree.tsv'), engine="xyz")
+
+def chain_tree(n, reverse=False):
+  label = (lambda x: n - x) if reverse else (lambda x: x)
+  yield label(0), label(0)
+  for i in range(1, n):
+    yield label(i), label(i - 1)
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("n_processes", [1, 3])
+def test_construction_deep_chain(reverse, n_processes):
+  # the subtree sizes computation must be linear in the number of nodes;
+  # walking up to the root from each node would be too slow for this test
+  n = 50000
+  tree = Tree.construct(chain_tree(n, reverse), n_processes, engine="python")
+  assert tree.get_treesize() == n
+  leaf = n - 1 if not reverse else 1
+  assert tree.get_subtree_size(leaf) == 1
+  assert tree.get_subtree_size(tree.root_id) == n
+  assert tree.get_depth(leaf) == n - 1
+  assert list(tree.subtree_ids(n // 2)) == \
+      [x if not reverse else n - x for x in range(n // 2, n)]
+
+@pytest.mark.parametrize("remap", [False, True])
+def test_construction_deep_chain_auto(monkeypatch, remap):
+  pytest.importorskip("numpy")
+  n = 1000
+  expected = Tree.construct(chain_tree(n), engine="python", remap=remap)
+  calls = []
+  python_construction = Tree._python_construction
+  monkeypatch.setattr(Tree, "_python_construction",
+      lambda *args, **kwargs: calls.append(1) or \
+          python_construction(*args, **kwargs))
+  # the numpy engine is used, unless "auto" is selected
+  tree = Tree.construct(chain_tree(n), engine="numpy", remap=remap)
+  assert not calls
+  assert tree.treedata == expected.treedata
+  assert tree.depths == expected.depths
+  tree = Tree.construct(chain_tree(n), engine="auto", remap=remap)
+  assert calls
+  assert tree.treedata == expected.treedata
+  assert tree.coords == expected.coords
+  assert tree.ids == expected.ids
+  # shallow trees are constructed by the numpy engine
+  calls.clear()
+  Tree.construct(((i, 1) for i in range(1, 100)), engine="auto")
+  assert not calls
+
+def test_construction_err_cycle():
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(iter([(1, 1), (2, 3), (3, 2)]), engine="python")
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(iter([(1, 1), (2, 3), (3, 2)]), 2, engine="python")
+
+@pytest.mark.parametrize("infname", ERRFILES)
+def test_construction_parallel_errors(testdata, infname):
+  with pytest.raises(error.ConstructionError):
+    Tree.construct(element_parent_ids(testdata(infname)), 3, engine="python")
+
+@pytest.mark.parametrize("n_processes", [2, 3, 7, 20])
+def test_construction_parallel_medium(testdata, n_processes):
+  infname = testdata('medium_tree.tsv')
+  tree = Tree.construct_from_tabular(infname, engine="python")
+  parallel_tree = Tree.construct_from_tabular(infname,
+      n_processes=n_processes, engine="python")
+  assert parallel_tree.subtree_sizes == tree.subtree_sizes
+  assert parallel_tree.treedata == tree.treedata
+
+@pytest.mark.parametrize("blocksize", [1, 7, 64, 1 << 20])
+@pytest.mark.parametrize("infname,kwargs", [
+  ('small_tree.tsv', {}), ('small_tree.shuffled.tsv', {}),
+  ('medium_tree.tsv', {}), ('small_ncbi.tsv', {"ncbi_preset": True}),
+  ('small_tree_attrX.tsv', {"comment_pfx": None})])
+@pytest.mark.parametrize("n_processes", [1, 3])
+def test_element_parent_id_chunks(testdata, blocksize, infname, kwargs,
+                                  n_processes):
+  infname = testdata(infname)
+  with open(infname) as f:
+    expected = []
+    for line in f:
+      if kwargs.get("comment_pfx", "#") and line.startswith("#"):
+        continue
+      sep = "\t|\t" if kwargs.get("ncbi_preset") else "\t"
+      fields = line.rstrip().split(sep)
+      try:
+        expected.append((int(fields[0]), int(fields[1])))
+      except ValueError:
+        expected = None
+        break
+  chunks = element_parent_id_chunks(infname, blocksize=blocksize,
+                                    n_processes=n_processes, **kwargs)
+  if expected is None:
+    with pytest.raises(ValueError):
+      list(chunks)
+  else:
+    result = []
+    for elems, parents in chunks:
+      assert len(elems) == len(parents)
+      result.extend(zip(elems, parents))
+    assert result == expected
+
+COMPRESSORS = {"gz": "gzip", "bz2": "bz2", "xz": "lzma"}
+
+def compressed_copy(infname, outfname, ext):
+  module = pytest.importorskip(COMPRESSORS[ext])
+  with open(infname, "rb") as f:
+    data = f.read()
+  with module.open(outfname, "wb") as f:
+    f.write(data)
+  return outfname
+
+@pytest.mark.parametrize("ext", ["gz", "bz2", "xz"])
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_compressed_input(testdata, testout, ext, n_processes):
+  for fn, kwargs in [("medium_tree.tsv", {}),
+                     ("small_ncbi.tsv", {"ncbi_preset": True})]:
+    infname = testdata(fn)
+    compressed = compressed_copy(infname, testout(f"{fn}.{ext}"), ext)
+    expected = list(element_parent_ids(infname, **kwargs))
+    result = []
+    for elems, parents in element_parent_id_chunks(compressed, blocksize=100,
+        n_processes=n_processes, **kwargs):
+      result.extend(zip(elems, parents))
+    assert result == expected
+    assert list(element_parent_ids(compressed, **kwargs)) == expected
+
+def test_compressed_input_zstd(testdata, testout):
+  zstandard = pytest.importorskip("zstandard")
+  infname = testdata("medium_tree.tsv")
+  with open(infname, "rb") as f:
+    data = f.read()
+  with open(testout("medium_tree.tsv.zst"), "wb") as f:
+    f.write(zstandard.ZstdCompressor().compress(data))
+  assert list(element_parent_ids(testout("medium_tree.tsv.zst"))) == \
+      list(element_parent_ids(infname))
+
+def test_parallel_parsing(testdata):
+  infname = testdata('small_ncbi.tsv')
+  tree = Tree.construct_from_ncbi_dump(infname, n_processes=2)
+  expected = Tree.construct_from_ncbi_dump(infname)
+  assert tree.treedata == expected.treedata
+  assert tree.parents == expected.parents
+  infname = testdata('medium_tree.tsv')
+  tree = Tree.construct_from_tabular(infname, n_processes=3)
+  expected = Tree.construct_from_tabular(infname)
+  assert tree.treedata == expected.treedata
+  assert tree.parents == expected.parents
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_construction_from_chunks(testdata, engine):
+  if engine == "numpy":
+    pytest.importorskip("numpy")
+  infname = testdata('small_ncbi.tsv')
+  tree = Tree.construct_from_chunks(\
+      element_parent_id_chunks(infname, ncbi_preset=True, blocksize=100),
+      engine=engine)
+  expected = Tree.construct(element_parent_ids(infname, ncbi_preset=True),
+                            engine="python")
+  assert tree.treedata == expected.treedata
+  assert tree.coords == expected.coords
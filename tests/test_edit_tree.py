@@ -1,6 +1,7 @@
 import pytest
+import gzip
 from fastsubtrees.ids_modules.ids_from_tabular_file import element_parent_ids
-from fastsubtrees import Tree, error
+from fastsubtrees import Tree, error, vectorized
 
 def test_add_subtree_small_tree(testdata, results_add_subtree_small_subtree_1):
   construction_infname = testdata('small_tree.tsv')
@@ -106,6 +107,29 @@ def assert_identical_attributes(tree1, tree2):
     attrvalues2 = tree2.load_attribute_values(attrname)
     assert attrvalues1 == attrvalues2
 
+def test_add_nodes_widen(testdata, monkeypatch):
+  # use a smaller UNDEF value for 32 bits, to avoid large arrays in the test
+  monkeypatch.setitem(Tree.UNDEFS, 32, 1000)
+  tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
+  assert tree.width == 32
+  assert tree.get_parent(6) == 1000
+  tree.add_nodes([(1000, 8), (1001, 1000)])
+  assert tree.width == 64
+  assert tree.UNDEF == Tree.UNDEF
+  assert tree.get_parent(6) == tree.UNDEF
+  assert list(tree.subtree_ids(8)) == [8, 1000, 1001, 3, 7, 9, 4, 5]
+
+def test_update_tree_compressed(testdata, testout):
+  with open(testdata('small_tree.update.tsv'), "rb") as f:
+    data = f.read()
+  with gzip.open(testout('small_tree.update.tsv.gz'), "wb") as f:
+    f.write(data)
+  tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
+  tree.to_file(testout('small_tree.tree'))
+  tree.update_from_tabular(testout('small_tree.update.tsv.gz'))
+  t2 = Tree.construct_from_tabular(testout('small_tree.update.tsv.gz'))
+  assert_identical_subtrees(tree, t2)
+
 def test_update_tree(testdata, testout):
   tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
   tree.to_file(testout('small_tree.tree'))
@@ -200,6 +224,15 @@ def test_reset_tree(testdata, testout):
   assert_identical_subtrees(tree, t2)
   assert_identical_attributes(tree, t2)
 
+def assert_correct_depths(tree):
+  for node in tree.subtree_ids(tree.root_id):
+    depth = 0
+    ancestor = node
+    while tree.get_parent(ancestor) != ancestor:
+      ancestor = tree.get_parent(ancestor)
+      depth += 1
+    assert tree.get_depth(node) == depth
+
 def test_move_subtree(testdata, testout):
   tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
   tree.set_filename(testout("small_tree.tree"))
@@ -215,5 +248,202 @@ def test_move_subtree(testdata, testout):
     tree.move_subtree(-2, 1)
   tree.move_subtree(2, tree.get_parent(2))
   tree.move_subtree(2, 8)
+  assert_correct_depths(tree)
   with pytest.raises(error.ConstructionError):
     tree.move_subtree(3, 7)
+
+def test_edit_remapped_tree(testdata, testout, sparse_ids, sparse_factor):
+  tree = Tree.construct(sparse_ids(testdata('medium_tree.tsv')), remap=True)
+  expected = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+
+  def assert_same_tree():
+    assert list(tree.subtree_ids(tree.root_id)) == \
+        [n * sparse_factor for n in expected.subtree_ids(expected.root_id)]
+    for node in expected.subtree_ids(expected.root_id):
+      assert tree.get_parent(node * sparse_factor) == \
+          expected.get_parent(node) * sparse_factor
+    assert_correct_depths(tree)
+    assert_correct_depths(expected)
+  added = []
+  tree.add_nodes(sparse_ids(testdata('medium_tree_add_subtree.tsv')),
+                 list_added=added)
+  expected.add_nodes(\
+      element_parent_ids(testdata('medium_tree_add_subtree.tsv')))
+  assert len(added) > 0
+  assert_same_tree()
+  tree.delete_subtree(78 * sparse_factor)
+  expected.delete_subtree(78)
+  assert_same_tree()
+  tree.move_subtree(46 * sparse_factor, 8 * sparse_factor)
+  expected.move_subtree(46, 8)
+  assert_same_tree()
+  with pytest.raises(error.NodeNotFoundError):
+    tree.delete_subtree(46)
+  tree.set_filename(testout('medium_tree_remapped.tree'))
+  tree.destroy_all_attributes()
+  tree.create_attribute("attrX", [(46 * sparse_factor, "a")])
+  assert tree.get_attribute_values(46 * sparse_factor, "attrX") == ["a"]
+  tree.update(sparse_ids(testdata('medium_tree.tsv')))
+  expected.update(element_parent_ids(testdata('medium_tree.tsv')))
+  assert_same_tree()
+  assert tree.get_attribute_values(46 * sparse_factor, "attrX",
+                                   cache=False) == ["a"]
+  tree.reset(sparse_ids(testdata('small_tree.tsv')))
+  assert tree.is_remapped()
+  assert len(tree.ids) == 8
+
+def test_edit_mmap_tree(testdata, testout):
+  outfname = testout('small_tree_mmap.tree')
+  Tree.construct_from_tabular(testdata('small_tree.tsv')).to_file(outfname)
+  tree = Tree.from_file(outfname, mmap=True)
+  expected = Tree.from_file(outfname)
+  for t in [tree, expected]:
+    t.add_nodes(iter([(100, 1), (101, 100)]))
+    t.move_subtree(100, 2)
+    t.delete_subtree(101)
+  assert not tree.is_mapped()
+  assert tree.treedata == expected.treedata
+  assert tree.subtree_ids(1) == expected.subtree_ids(1)
+  assert Tree.from_file(outfname).subtree_ids(1) != tree.subtree_ids(1)
+
+def test_update_move_under_descendant(testdata):
+  tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
+  # 8 is moved under its current descendant 3,
+  # which is moved under 2 in a later line
+  moved = []
+  n_added, n_deleted, n_moved = tree.update(iter([(1, 1), (8, 3), (2, 1),
+      (5, 8), (3, 2), (4, 8), (7, 3), (9, 3)]), list_moved=moved)
+  assert (n_added, n_deleted, n_moved) == (0, 0, 2)
+  assert sorted(moved) == [3, 8]
+  assert tree.get_parent(8) == 3
+  assert tree.is_ancestor(2, 8)
+  assert sorted(tree.subtree_ids(1)) == [1, 2, 3, 4, 5, 7, 8, 9]
+  with pytest.raises(error.ConstructionError):
+    tree.update(iter([(1, 1), (2, 3), (3, 2)]))
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+@pytest.mark.parametrize("remap", [False, True])
+def test_compact(testdata, testout, monkeypatch, use_numpy, remap):
+  if not use_numpy:
+    monkeypatch.setattr(vectorized, "np", None)
+  elif not vectorized.numpy_available():
+    pytest.skip("NumPy is not installed")
+  if remap:
+    tree = Tree.construct(element_parent_ids(testdata('medium_tree.tsv')),
+                          remap=True)
+  else:
+    tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.set_filename(testout('medium_tree_compact.tree'))
+  tree.destroy_all_attributes()
+  tree.create_attribute("attrX",
+      ((node, f"v{node}") for node in tree.subtree_ids(1)))
+  if use_numpy:
+    tree.create_attribute("attrN",
+        ((node, node) for node in tree.subtree_ids(1)), column_kind="int")
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  tree.add_nodes(iter([(100000, 8), (100001, 100000)]))
+  tree.delete_subtree(100001)
+  nodes = list(tree.subtree_ids(1))
+  expected = {node: (tree.get_parent(node), tree.get_depth(node),
+                     tree.get_live_subtree_size(node)) for node in nodes}
+  if use_numpy:
+    column = tree.subtree_attribute_column(1, "attrN")
+    assert column.compressed().tolist() == \
+        [node for node in tree.get_subtree_data(1)
+         if node not in (tree.UNDEF, 100000)]
+  reclaimed = tree.compact()
+  assert reclaimed > 0
+  assert list(tree.subtree_ids(1)) == nodes
+  assert list(tree.get_subtree_data(1)) == nodes
+  assert tree.get_treesize() == len(nodes)
+  assert max(tree.tombstones) == 0
+  for node in nodes:
+    assert (tree.get_parent(node), tree.get_depth(node),
+            tree.get_subtree_size(node)) == expected[node]
+    assert tree.get_attribute_values(node, "attrX", cache=False) == \
+        ([f"v{node}"] if node != 100000 else None)
+  if use_numpy:
+    column = tree.subtree_attribute_column(1, "attrN")
+    assert column.filled(0).tolist() == \
+        [node if node != 100000 else 0 for node in nodes]
+  if remap:
+    with pytest.raises(error.NodeNotFoundError):
+      tree.get_parent(566)
+  else:
+    assert tree.get_live_subtree_size(566) == 0
+  # deleted nodes can be added again
+  tree.add_nodes(iter([(566, 1)]))
+  assert tree.get_parent(566) == 1
+  assert tree.get_attribute_values(566, "attrX", cache=False) is None
+
+def test_compaction_policy(testdata, testout):
+  from fastsubtrees import logger
+  infname = testdata('medium_tree.tsv')
+  tree = Tree.construct_from_tabular(infname)
+  outfname = testout('medium_tree_policy.tree')
+  tree.set_filename(outfname)
+  tree.destroy_all_attributes()
+  assert tree.get_n_tombstones() == 0
+  assert tree.get_fragmentation() == 0
+  n_deleted = tree.delete_subtree(3)
+  assert tree.get_n_tombstones() == n_deleted
+  assert tree.get_fragmentation() == n_deleted / tree.get_treesize()
+  tree.compaction_threshold = 0.1
+  messages = []
+  logger.enable("fastsubtrees")
+  handler = logger.add(messages.append, level="WARNING")
+  try:
+    tree.to_file(outfname)
+    tree.to_file(outfname)
+  finally:
+    logger.remove(handler)
+    logger.disable("fastsubtrees")
+  assert len(messages) == 1
+  assert Tree.from_file(outfname).get_n_tombstones() == n_deleted
+  tree.compaction_policy = "auto"
+  # not compacted, since saved to a different file
+  outfname = testout('medium_tree_policy2.tree')
+  tree.to_file(outfname)
+  assert tree.get_n_tombstones() == n_deleted
+  tree.to_file(outfname)
+  assert tree.get_n_tombstones() == 0
+  tree.delete_subtree(2)
+  tree.update(element_parent_ids(infname))
+  assert tree.get_n_tombstones() == 0
+  tree.compaction_policy = "xyz"
+  with pytest.raises(error.FastsubtreesError):
+    tree.to_file(outfname)
+
+def test_compaction_policy_write_error(testdata, testout, monkeypatch):
+  from fastsubtrees import treefile
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  outfname = testout('medium_tree_policy_error.tree')
+  tree.to_file(outfname)
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  tree.create_attribute("name", ((n, f"n{n}") for n in nodes))
+  tree.delete_subtree(3)
+  tree.to_file(outfname)
+  expected = {n: tree.get_attribute_values(n, "name", cache=False)
+              for n in nodes}
+  tree.compaction_policy = "auto"
+  tree.compaction_threshold = 0.01
+
+  def failing_write(*args, **kwargs):
+    raise OSError("No space left on device")
+  monkeypatch.setattr(treefile, "write", failing_write)
+  with pytest.raises(OSError):
+    tree.to_file(outfname)
+  monkeypatch.undo()
+  # neither the attribute files nor the tree were compacted
+  assert tree.get_n_tombstones() > 0
+  for loaded in [tree, Tree.from_file(outfname)]:
+    for n in nodes:
+      assert loaded.get_attribute_values(n, "name", cache=False) == \
+          expected[n]
+  tree.to_file(outfname)
+  assert tree.get_n_tombstones() == 0
+  tree = Tree.from_file(outfname)
+  for n in nodes:
+    assert tree.get_attribute_values(n, "name", cache=False) == expected[n]
@@ -1,6 +1,6 @@
 import pytest
 from fastsubtrees.ids_modules.ids_from_tabular_file import element_parent_ids
-from fastsubtrees import Tree
+from fastsubtrees import Tree, treefile, error
 
 def test_save_reload_small(testdata, testout):
   infname = testdata('small_tree.tsv')
@@ -27,3 +27,213 @@ def test_save_reload_medium(testdata, testout):
 def test_err_nofile():
   with pytest.raises(FileNotFoundError):
     Tree.from_file('no_such_file.tree')
+
+@pytest.mark.parametrize("width", [32, 64])
+def test_save_reload_width(testdata, testout, width):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'), width=width)
+  assert tree.width == width
+  assert tree.treedata.itemsize * 8 == width
+  outfname = testout('medium_tree.tree')
+  tree.to_file(outfname)
+  reloaded_tree = Tree.from_file(outfname)
+  assert reloaded_tree.width == width
+  assert reloaded_tree.UNDEF == tree.UNDEF
+  assert reloaded_tree.treedata == tree.treedata
+  assert reloaded_tree.parents == tree.parents
+
+def test_reload_64bit_file(prebuilt):
+  tree = Tree.from_file(prebuilt('small_tree.tree'))
+  assert tree.width == 64
+  assert tree.UNDEF == Tree.UNDEF
+
+def test_save_reload_remapped(testdata, testout, sparse_ids):
+  tree = Tree.construct(sparse_ids(testdata('medium_tree.tsv')), remap=True)
+  assert tree.width == 64
+  outfname = testout('medium_tree_remapped.tree')
+  tree.to_file(outfname)
+  reloaded_tree = Tree.from_file(outfname)
+  assert reloaded_tree.is_remapped()
+  assert reloaded_tree.ids == tree.ids
+  assert reloaded_tree.root_id == tree.root_id
+  assert reloaded_tree.subtree_ids(tree.root_id) == \
+      tree.subtree_ids(tree.root_id)
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'), remap=True)
+  assert tree.width == 32
+  tree.to_file(outfname)
+  reloaded_tree = Tree.from_file(outfname)
+  assert reloaded_tree.width == 32
+  assert reloaded_tree.ids == tree.ids
+
+def test_file_format_v2(testdata, testout):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  outfname = testout('medium_tree.tree')
+  tree.to_file(outfname)
+  with open(outfname, "rb") as f:
+    assert f.read(len(treefile.MAGIC)) == treefile.MAGIC
+    f.seek(0)
+    header = treefile.read_header(f, outfname)
+  assert header.version == treefile.VERSION
+  assert header.width == tree.width
+  assert header.root_id == tree.root_id
+  assert header.n_nodes == tree.get_treesize()
+  assert set(header.sections) == \
+      {"subtree_sizes", "coords", "treedata", "parents", "tombstones",
+       "depths"}
+  for section in header.sections.values():
+    assert section.offset % treefile.PAGESIZE == 0
+
+def test_reload_v1_file(prebuilt, testout):
+  tree = Tree.from_file(prebuilt('medium_tree.tree'))
+  assert tree.generation == 0
+  outfname = testout('medium_tree_v2.tree')
+  tree.to_file(outfname)
+  reloaded_tree = Tree.from_file(outfname)
+  assert reloaded_tree.treedata == tree.treedata
+  assert reloaded_tree.coords == tree.coords
+  assert reloaded_tree.subtree_sizes == tree.subtree_sizes
+  assert reloaded_tree.parents == tree.parents
+
+def test_generation_persisted(testdata, testout):
+  tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
+  assert tree.generation == 0
+  tree.add_nodes(iter([(100, 1), (101, 100)]))
+  tree.delete_subtree(101)
+  assert tree.generation == 3
+  outfname = testout('small_tree_edited.tree')
+  tree.to_file(outfname)
+  assert Tree.from_file(outfname).generation == 3
+
+def test_corrupted_file(testdata, testout):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  outfname = testout('medium_tree_corrupted.tree')
+  tree.to_file(outfname)
+  with open(outfname, "rb") as f:
+    header = treefile.read_header(f, outfname)
+  with open(outfname, "r+b") as f:
+    f.seek(header.sections["treedata"].offset + 8)
+    f.write(b"\xff")
+  with pytest.raises(error.FastsubtreesError):
+    Tree.from_file(outfname, lazy=False)
+  tree = Tree.from_file(outfname)
+  tree.get_parent(2)
+  with pytest.raises(error.FastsubtreesError):
+    tree.subtree_ids(2)
+  Tree.from_file(outfname, verify=False, lazy=False)
+  with open(outfname, "r+b") as f:
+    f.seek(len(treefile.MAGIC) + 4)
+    f.write(b"\x07")
+  with pytest.raises(error.FastsubtreesError):
+    Tree.from_file(outfname)
+
+@pytest.mark.parametrize("remap", [False, True])
+def test_load_mmap(testdata, testout, prebuilt, remap):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'), remap=remap)
+  outfname = testout('medium_tree_mmap.tree')
+  tree.to_file(outfname)
+  mapped_tree = Tree.from_file(outfname, mmap=True)
+  assert mapped_tree.is_mapped()
+  assert isinstance(mapped_tree.treedata, memoryview)
+  assert mapped_tree.treedata.readonly
+  assert mapped_tree.width == tree.width
+  assert mapped_tree.root_id == tree.root_id
+  for node in [tree.root_id, 2, 17, 1000]:
+    assert mapped_tree.subtree_ids(node) == tree.subtree_ids(node)
+    assert mapped_tree.get_parent(node) == tree.get_parent(node)
+  assert not Tree.from_file(outfname).is_mapped()
+  # files of format version 1 can also be mapped
+  tree = Tree.from_file(prebuilt('small_tree.tree'))
+  mapped_tree = Tree.from_file(prebuilt('small_tree.tree'), mmap=True)
+  assert mapped_tree.is_mapped()
+  assert mapped_tree.subtree_ids(1) == tree.subtree_ids(1)
+  # and edited
+  tree.delete_subtree(3)
+  mapped_tree.delete_subtree(3)
+  mapped_tree.add_nodes(iter([(100, 1)]))
+  assert not mapped_tree.is_mapped()
+  assert mapped_tree.subtree_ids(3) == tree.subtree_ids(3)
+  assert set(mapped_tree.subtree_ids(1)) == set(tree.subtree_ids(1)) | {100}
+
+def test_save_mmap(testdata, testout):
+  outfname = testout('small_tree_mmap.tree')
+  Tree.construct_from_tabular(testdata('small_tree.tsv')).to_file(outfname)
+  mapped_tree = Tree.from_file(outfname, mmap=True)
+  subtree_data = mapped_tree.get_subtree_data(1)
+  expected = subtree_data.tolist()
+  mapped_tree.to_file(outfname)
+  assert not mapped_tree.is_mapped()
+  assert subtree_data.tolist() == expected
+  assert Tree.from_file(outfname).treedata == mapped_tree.treedata
+
+def test_load_lazy(testdata, testout):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  outfname = testout('medium_tree_lazy.tree')
+  tree.to_file(outfname)
+  lazy_tree = Tree.from_file(outfname)
+  assert lazy_tree.root_id == tree.root_id
+  assert "treedata" not in vars(lazy_tree)
+  assert lazy_tree.subtree_ids(17) == tree.subtree_ids(17)
+  assert "treedata" in vars(lazy_tree)
+  assert "parents" not in vars(lazy_tree)
+  assert lazy_tree.get_parent(17) == tree.get_parent(17)
+  assert "parents" in vars(lazy_tree)
+  assert "treedata" in vars(Tree.from_file(outfname, lazy=False))
+  with pytest.raises(AttributeError):
+    lazy_tree.no_such_attribute
+  # the file is changed before all arrays are loaded
+  lazy_tree = Tree.from_file(outfname)
+  tree.add_nodes(iter([(100000, 1)]))
+  tree.to_file(outfname)
+  with pytest.raises(error.FastsubtreesError):
+    lazy_tree.subtree_ids(1)
+
+def test_tombstones_persisted(testdata, testout, prebuilt):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.delete_subtree(8)
+  outfname = testout('medium_tree_tombstones.tree')
+  tree.to_file(outfname)
+  assert Tree.from_file(outfname).tombstones == tree.tombstones
+  # files without the tombstones section
+  tree = Tree.from_file(prebuilt('medium_tree.tree'))
+  assert "tombstones" not in vars(tree)
+  assert tree.tombstones == tree._compute_tombstones()
+  assert max(tree.tombstones) == 0
+
+def test_lca_index_file(testdata, testout, monkeypatch):
+  pytest.importorskip("numpy")
+  from fastsubtrees import lca
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  outfname = testout('medium_tree_lca.tree')
+  tree.to_file(outfname)
+  if tree.lca_index_filename().exists():
+    tree.lca_index_filename().unlink()
+  expected = tree.lca(566, 17)
+  tree.to_file(outfname)
+  assert tree.lca_index_filename().exists()
+  built = []
+  original_build = lca.LCAIndex.build
+  monkeypatch.setattr(lca.LCAIndex, "build",
+      classmethod(lambda cls, t: built.append(t) or original_build(t)))
+  reloaded_tree = Tree.from_file(outfname)
+  assert reloaded_tree.lca(566, 17) == expected
+  assert not built
+  # the index file is not used, if it was saved for a different tree
+  tree.move_subtree(566, 17)
+  tree.to_file(outfname)
+  tree.lca_index_filename().unlink()
+  Tree.from_file(outfname).save_lca_index()
+  assert len(built) == 1
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(outfname)
+  assert Tree.from_file(outfname).lca(566, 17) == expected
+  assert len(built) == 2
+
+def test_depths_persisted(testdata, testout, prebuilt):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.move_subtree(566, 17)
+  outfname = testout('medium_tree_depths.tree')
+  tree.to_file(outfname)
+  assert Tree.from_file(outfname).depths == tree.depths
+  # files without the depths section
+  tree = Tree.from_file(prebuilt('medium_tree.tree'))
+  assert "depths" not in vars(tree)
+  assert tree.get_depth(566) == 5
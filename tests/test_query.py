@@ -1,6 +1,6 @@
 import pytest
 from fastsubtrees.ids_modules.ids_from_tabular_file import element_parent_ids
-from fastsubtrees import Tree, error
+from fastsubtrees import Tree, error, vectorized
 
 def test_query_small_tree(testdata, results_query_small_tree_id_1,
                           results_query_small_tree_id_8):
@@ -31,3 +31,508 @@ def test_query_node_not_exist(testdata):
   tree = Tree.construct(generator)
   with pytest.raises(error.NodeNotFoundError):
       tree.subtree_ids(87)
+
+def edited_medium_tree(testdata):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  tree.add_nodes(iter([(100000, 8), (100001, 100000)]))
+  tree.delete_subtree(100001)
+  return tree
+
+def test_query_numpy(testdata, results_query_medium_tree_id_8):
+  np = pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  subtree_8_ids = tree.subtree_ids(8, numpy=True)
+  assert isinstance(subtree_8_ids, np.ndarray)
+  assert subtree_8_ids.dtype == np.dtype(f"u{tree.width // 8}")
+  assert subtree_8_ids.tolist() == results_query_medium_tree_id_8.tolist()
+  tree = edited_medium_tree(testdata)
+  for node in [1, 8, 17, 100000]:
+    assert tree.subtree_ids(node, numpy=True).tolist() == \
+        [n for n in tree.get_subtree_data(node) if n != tree.UNDEF]
+
+def test_query_tombstones(testdata, monkeypatch):
+  tree = edited_medium_tree(testdata)
+  assert tree.tombstones == tree._compute_tombstones()
+  assert tree.tombstones[1] > 0
+  assert tree.tombstones[566] == tree.subtree_sizes[566]
+  expected = {node: tree.subtree_ids(node) for node in [1, 8, 17, 100000]}
+  # pure-Python implementation
+  monkeypatch.setattr(vectorized, "np", None)
+  assert tree.tombstones == tree._compute_tombstones()
+  for node, ids in expected.items():
+    assert tree.subtree_ids(node) == ids
+  with pytest.raises(error.FastsubtreesError):
+    tree.subtree_ids(1, numpy=True)
+
+def test_query_below_deleted_subtree(monkeypatch):
+  tree = Tree.construct(iter([(1, 1), (2, 1), (3, 2), (4, 3)]))
+  tree.delete_subtree(2)
+  for node in [2, 3, 4]:
+    assert list(tree.subtree_ids(node)) == []
+    assert tree.get_live_subtree_size(node) == 0
+  if vectorized.numpy_available():
+    assert tree.subtree_ids(3, numpy=True).tolist() == []
+    roots, ids, offsets = tree.subtree_ids_batch([3, 1, 4])
+    assert ids.tolist() == [1]
+    assert offsets.tolist() == [0, 0, 1, 1]
+    roots, ids, offsets = tree.subtree_ids_batch([3, 4], merge=True)
+    assert len(ids) == 0
+  # pure-Python implementation
+  monkeypatch.setattr(vectorized, "np", None)
+  assert list(tree.subtree_ids(3)) == []
+
+@pytest.mark.parametrize("edited", [False, True])
+def test_query_batch(testdata, edited):
+  np = pytest.importorskip("numpy")
+  tree = edited_medium_tree(testdata) if edited else \
+      Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  roots = [17, 1, 8, 566, 17, 100000] if edited else [17, 1, 8, 566, 17]
+  result_roots, ids, offsets = tree.subtree_ids_batch(roots)
+  assert result_roots.tolist() == roots
+  assert len(offsets) == len(roots) + 1
+  for i, root in enumerate(roots):
+    assert ids[offsets[i]:offsets[i + 1]].tolist() == \
+        tree.subtree_ids(root).tolist()
+  # nested and repeated roots are merged
+  result_roots, ids, offsets = tree.subtree_ids_batch(roots, merge=True)
+  assert result_roots.tolist() == [1]
+  assert ids.tolist() == tree.subtree_ids(1).tolist()
+  result_roots, ids, offsets = tree.subtree_ids_batch([566, 17, 566],
+                                                      merge=True)
+  assert sorted(result_roots.tolist()) == [17, 566]
+  assert sorted(ids.tolist()) == \
+      sorted(tree.subtree_ids(17).tolist() + tree.subtree_ids(566).tolist())
+  result_roots, ids, offsets = tree.subtree_ids_batch([])
+  assert len(ids) == 0 and offsets.tolist() == [0]
+  with pytest.raises(error.NodeNotFoundError):
+    tree.subtree_ids_batch([1, -1])
+  with pytest.raises(error.NodeNotFoundError):
+    tree.subtree_ids_batch([1, 10**9])
+  assert isinstance(ids, np.ndarray)
+
+def test_query_batch_remapped(testdata, sparse_ids, sparse_factor):
+  pytest.importorskip("numpy")
+  tree = Tree.construct(sparse_ids(testdata('medium_tree.tsv')), remap=True)
+  roots = [8 * sparse_factor, 17 * sparse_factor]
+  _, ids, offsets = tree.subtree_ids_batch(roots)
+  assert ids[offsets[1]:].tolist() == tree.subtree_ids(roots[1]).tolist()
+  with pytest.raises(error.NodeNotFoundError):
+    tree.subtree_ids_batch([8])
+
+def test_query_info_batch(testdata, testout):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('small_tree.tsv'))
+  tree.to_file(testout('small_tree_batch.tree'))
+  tree.create_attribute_from_tabular('attrX',
+      testdata('small_tree_attrX.tsv'), force=True)
+  result = tree.subtree_info_batch([8, 1], ['attrX'], True, True)
+  assert result["root"].tolist() == [8, 1]
+  for i, root in enumerate([8, 1]):
+    start, end = result["offsets"][i], result["offsets"][i + 1]
+    expected = tree.subtree_info(root, ['attrX'], True, True)
+    assert result["node_id"][start:end].tolist() == \
+        list(expected["node_id"])
+    assert result["subtree_size"][start:end].tolist() == \
+        expected["subtree_size"]
+    assert result["parent"][start:end].tolist() == expected["parent"]
+    assert result["attrX"][start:end] == expected["attrX"]
+
+def test_is_ancestor(testdata, monkeypatch):
+  tree = edited_medium_tree(testdata)
+  subtree_17 = set(tree.subtree_ids(17))
+  assert tree.is_ancestor(17, 17)
+  assert tree.is_ancestor(1, 17)
+  assert not tree.is_ancestor(17, 1)
+  assert tree.is_ancestor(17, 8)
+  assert not tree.is_ancestor(1, 566)
+  assert not tree.is_ancestor(566, 566)
+  with pytest.raises(error.NodeNotFoundError):
+    tree.is_ancestor(1, -1)
+  nodes = list(range(-1, 1200)) + [100000, 100001, 10**9]
+  expected = [node in subtree_17 for node in nodes]
+  if vectorized.numpy_available():
+    assert tree.is_descendant_of(nodes, 17).tolist() == expected
+    assert not tree.is_descendant_of(nodes, 566).any()
+  monkeypatch.setattr(vectorized, "np", None)
+  assert tree.is_descendant_of(nodes, 17) == expected
+
+def naive_lca(tree, node1, node2):
+  ancestors = {node1}
+  while tree.get_parent(node1) != node1:
+    node1 = tree.get_parent(node1)
+    ancestors.add(node1)
+  while node2 not in ancestors:
+    node2 = tree.get_parent(node2)
+  return node2
+
+@pytest.mark.parametrize("remap", [False, True])
+def test_lca(testdata, sparse_ids, sparse_factor, remap):
+  np = pytest.importorskip("numpy")
+  if remap:
+    tree = Tree.construct(sparse_ids(testdata('medium_tree.tsv')), remap=True)
+  else:
+    tree = edited_medium_tree(testdata)
+  nodes = np.array(tree.subtree_ids(tree.root_id).tolist())
+  rng = np.random.default_rng(42)
+  nodes1 = rng.choice(nodes, 500)
+  nodes2 = np.concatenate([rng.choice(nodes, 490), nodes1[490:]])
+  expected = [naive_lca(tree, a, b) for a, b in zip(nodes1, nodes2)]
+  assert tree.lca_pairs(nodes1, nodes2).tolist() == expected
+  assert tree.lca(int(nodes1[0]), int(nodes2[0])) == expected[0]
+  assert tree.lca_pairs(nodes1, tree.root_id).tolist() == \
+      [tree.root_id] * len(nodes1)
+  assert tree.lca_many(nodes1[:1]) == nodes1[0]
+  expected_many = nodes1[0]
+  for node in nodes1[:20]:
+    expected_many = naive_lca(tree, expected_many, node)
+  assert tree.lca_many(nodes1[:20]) == expected_many
+  with pytest.raises(error.FastsubtreesError):
+    tree.lca_many([])
+  with pytest.raises(error.NodeNotFoundError):
+    tree.lca(tree.root_id, 10**12)
+
+def test_lca_after_edit(testdata):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  assert tree.lca(566, 17) == 1
+  tree.move_subtree(566, 17)
+  assert tree.lca(566, 17) == 17
+  assert tree.lca(566, 8) == 1
+  tree.delete_subtree(566)
+  with pytest.raises(error.NodeNotFoundError):
+    tree.lca(566, 17)
+  tree.add_nodes(iter([(100000, 17), (100001, 100000)]))
+  assert tree.lca(100001, 17) == 17
+  assert tree.lca(100001, 2) == naive_lca(tree, 100001, 2)
+
+def naive_lineage(tree, node):
+  lineage = [node]
+  while tree.get_parent(lineage[-1]) != lineage[-1]:
+    lineage.append(tree.get_parent(lineage[-1]))
+  return lineage[::-1]
+
+def test_level_ancestors(testdata, monkeypatch):
+  tree = edited_medium_tree(testdata)
+  nodes = list(tree.subtree_ids(tree.root_id))[::7]
+  pairs = list(zip(nodes, nodes[3:]))
+  expected_distances = [len(naive_lineage(tree, a)) + \
+      len(naive_lineage(tree, b)) - \
+      2 * len(naive_lineage(tree, naive_lca(tree, a, b))) for a, b in pairs]
+  for use_numpy in [True, False]:
+    if not use_numpy:
+      monkeypatch.setattr(vectorized, "np", None)
+      computed_depths = tree._compute_depths()
+      for node in tree.subtree_ids(tree.root_id):
+        assert computed_depths[node] == tree.get_depth(node)
+    for node in nodes:
+      lineage = naive_lineage(tree, node)
+      assert tree.get_depth(node) == len(lineage) - 1
+      for depth, ancestor in enumerate(lineage):
+        assert tree.ancestor_at_depth(node, depth) == ancestor
+      assert tree.ancestor_at_depth(node, len(lineage)) is None
+      assert tree.ancestor_at_depth(node, -1) is None
+    assert [tree.tree_distance(a, b) for a, b in pairs] == expected_distances
+    with pytest.raises(error.NodeNotFoundError):
+      tree.ancestor_at_depth(566, 0)
+
+@pytest.mark.parametrize("remap", [False, True])
+def test_lineages(testdata, sparse_ids, remap):
+  np = pytest.importorskip("numpy")
+  if remap:
+    tree = Tree.construct(sparse_ids(testdata('medium_tree.tsv')), remap=True)
+  else:
+    tree = edited_medium_tree(testdata)
+  all_nodes = tree.subtree_ids(tree.root_id).tolist()
+  nodes = np.random.default_rng(42).choice(all_nodes, 300).tolist()
+  nodes += [tree.root_id, nodes[0], nodes[0]]
+  for cache in [False, True, True]:
+    ids, offsets = tree.lineages(nodes, cache=cache)
+    assert len(offsets) == len(nodes) + 1
+    for i, node in enumerate(nodes):
+      assert ids[offsets[i]:offsets[i + 1]].tolist() == \
+          naive_lineage(tree, node)
+  ids, offsets = tree.lineages([])
+  assert len(ids) == 0 and offsets.tolist() == [0]
+  with pytest.raises(error.NodeNotFoundError):
+    tree.lineages([tree.root_id, 10**12])
+  if not remap:
+    with pytest.raises(error.NodeNotFoundError):
+      tree.lineages([566], cache=True)
+    assert tree.lineages([8], cache=True)[0].tolist() == [1, 3, 5, 17, 8]
+    tree.move_subtree(8, 2)
+    ids, offsets = tree.lineages([8], cache=True)
+    assert ids.tolist() == [1, 2, 8]
+
+def test_live_subtree_size(testdata):
+  tree = edited_medium_tree(testdata)
+  for node in [1, 8, 17, 100000]:
+    assert tree.get_live_subtree_size(node) == \
+        sum(1 for n in tree.get_subtree_data(node) if n != tree.UNDEF)
+  assert tree.get_live_subtree_size(566) == 0
+  assert tree.get_live_treesize() == len(tree.subtree_ids(1))
+  assert tree.get_live_treesize() < tree.get_treesize()
+  assert tree.get_live_subtree_size(100001) == 0
+
+def assert_column_matches(tree, attribute, nodes):
+  for node in nodes:
+    column = tree.subtree_attribute_column(node, attribute)
+    expected = [v[0] if v else None
+                for v in tree.subtree_attribute_data(node, attribute)]
+    assert [None if m else v for v, m in
+            zip(column.data.tolist(), column.mask.tolist())] == expected
+
+def test_attribute_column(testdata, testout):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_column.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  tree.create_attribute("size", ((n, n * 3) for n in nodes if n % 4),
+                        column_kind="int")
+  tree.create_attribute("ratio", ((n, n / 7) for n in nodes))
+  tree.create_attribute_column("ratio", "float")
+  tree.create_attribute("odd", ((n, bool(n % 2)) for n in nodes[::2]),
+                        column_kind="bool")
+  for attribute in ["size", "ratio", "odd"]:
+    assert tree.has_attribute_column(attribute)
+    assert_column_matches(tree, attribute, [1, 8, 17, 566, 1000])
+  column = tree.subtree_attribute_column(17, "size")
+  assert len(column) == tree.get_subtree_size(17)
+  assert column.sum() == sum(n * 3 for n in tree.subtree_ids(17) if n % 4)
+  assert tree.subtree_attribute_column(1, "odd").dtype == bool
+  # the text format is still used for the other queries
+  assert tree.get_attribute_values(17, "size") == [51]
+  tree.create_attribute("names", ((n, f"n{n}") for n in nodes))
+  with pytest.raises(error.AttributeNotFoundError):
+    tree.subtree_attribute_column(1, "names")
+  with pytest.raises(error.AttributeCreationError):
+    tree.create_attribute_column("names", "int")
+  with pytest.raises(error.AttributeCreationError):
+    tree.create_attribute_column("size", "str")
+  tree.replace_attribute_values("size", {17: [5]})
+  assert tree.subtree_attribute_column(17, "size")[0] == 5
+  tree.destroy_attribute("size")
+  assert not tree.attribute_column_filename("size").exists()
+
+def test_attribute_line_index(testdata, testout, monkeypatch):
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_line_index.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  tree.create_attribute("name", ((n, f"n{n}é") for n in nodes if n % 3))
+  attrfilename = tree.attribute_filename("name")
+  idxfilename = tree.compute_line_index_filename(attrfilename)
+  assert idxfilename.exists()
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  tree.add_nodes(iter([(100000, 8)]))
+  expected = {n: ([f"n{n}é"] if n % 3 and n != 100000 else None)
+              for n in tree.subtree_ids(1)}
+  # the line index is kept in sync by the edit operations
+  n_lines = tree.get_treesize()
+  assert tree._read_lines(attrfilename, 0, n_lines) is not None
+  assert tree._read_lines(attrfilename, 0, n_lines + 1) is None
+  index = idxfilename.read_bytes()
+  monkeypatch.setattr(vectorized, "np", None)
+  tree._write_line_index(attrfilename)
+  assert idxfilename.read_bytes() == index
+  monkeypatch.undo()
+  for node in [1, 8, 17, 1000, 100000]:
+    assert tree.get_attribute_values(node, "name", cache=False) == \
+        expected[node]
+    assert tree.subtree_attribute_data(node, "name") == \
+        [expected.get(n) for n in tree.get_subtree_data(node)]
+  # node ID in the range of the IDs, which is not in the tree
+  missing = 99999
+  assert tree.get_treedata_coord(missing) == 0
+  assert tree.get_attribute_values(missing, "name", cache=False) is None
+  assert tree.subtree_attribute_data(missing, "name") == []
+  # lines in arbitrary order, repeated, negative or after the end
+  data = tree.get_subtree_data(1)
+  lines = [n_lines - 1, 5, -1, 5, 0, n_lines + 3, 17]
+  line_values = [expected.get(data[i]) if 0 <= i < n_lines else None
+                 for i in lines]
+  assert tree._read_lines_at(attrfilename, lines) is not None
+  assert tree.attribute_values_at_lines("name", lines) == line_values
+  # outdated line index
+  with open(attrfilename, 'a') as f:
+    f.write('null\n')
+  assert tree._read_lines(attrfilename, 0, 1) is None
+  assert tree._read_lines_at(attrfilename, lines) is None
+  assert tree.get_attribute_values(17, "name", cache=False) == expected[17]
+  assert tree.attribute_values_at_lines("name", lines) == line_values
+  # missing line index
+  idxfilename.unlink()
+  assert tree._read_lines_at(attrfilename, lines) is None
+  assert tree.attribute_values_at_lines("name", lines) == line_values
+  tree.destroy_attribute("name")
+  assert not idxfilename.exists()
+
+def test_multivalued_attribute_column(testdata, testout):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_csr.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  values = [(n, n * 0.5) for n in nodes if n % 3] + \
+           [(n, -n * 0.5) for n in nodes if n % 5 == 0]
+  tree.create_attribute("gc", iter(values), column_kind="float",
+                        multivalued_column=True)
+  tree.append_attribute_values("gc", {17: [], 1000: [1.5]})
+  for node in [1, 8, 17, 566, 1000]:
+    data = tree.subtree_attribute_data(node, "gc")
+    values, offsets = tree.subtree_attribute_csr(node, "gc")
+    assert len(offsets) == len(data) + 1
+    assert [values[offsets[i]:offsets[i + 1]].tolist()
+            for i in range(len(data))] == [v or [] for v in data]
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  tree.add_nodes(iter([(100000, 8)]))
+  values, offsets = tree.subtree_attribute_csr(1, "gc")
+  expected = [v for vs in tree.subtree_attribute_data(1, "gc") if vs
+              for v in vs]
+  assert values.tolist() == expected
+  with pytest.raises(error.FastsubtreesError):
+    tree.subtree_attribute_column(1, "gc")
+  with pytest.raises(error.AttributeCreationError):
+    tree.create_attribute_column("gc", "float")
+  # scalar columns can also be returned in CSR form
+  tree.create_attribute("size", ((n, n) for n in nodes if n % 2),
+                        column_kind="int")
+  values, offsets = tree.subtree_attribute_csr(17, "size")
+  assert values.tolist() == [n for n in tree.subtree_ids(17) if n % 2]
+  assert offsets[-1] == len(values)
+  result = tree.query_attributes(17, ["gc", "size"], show_stats=True)
+  assert len(result["gc"]) == tree.get_subtree_size(17)
+
+def test_categorical_attribute_column(testdata, testout):
+  np = pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_categorical.tree'))
+  tree.destroy_all_attributes()
+  ranks = ["species", "genus", "family", "order"]
+  nodes = tree.subtree_ids(1).tolist()
+  rank = {n: ranks[n % 4] for n in nodes if n % 7}
+  tree.create_attribute("rank", iter(rank.items()), column_kind="category")
+  assert sorted(tree.attribute_categories("rank")) == sorted(ranks)
+  column = tree.subtree_attribute_column(17, "rank")
+  assert column.dtype == object
+  assert [None if m else v for v, m in
+          zip(column.data.tolist(), column.mask.tolist())] == \
+      [rank.get(n) for n in tree.subtree_ids(17)]
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  for node in [1, 17]:
+    found = tree.subtree_nodes_with_attribute_value(node, "rank", "genus")
+    assert found.tolist() == [n for n in tree.subtree_ids(node)
+                              if rank.get(n) == "genus"]
+  assert len(tree.subtree_nodes_with_attribute_value(1, "rank", "x")) == 0
+  tree.create_attribute("ranks", ((n, r) for n, r in rank.items()),
+                        column_kind="category", multivalued_column=True)
+  tree.append_attribute_values("ranks", {8: ["family"], 17: ["genus"]})
+  found = tree.subtree_nodes_with_attribute_value(1, "ranks", "genus")
+  assert found.tolist() == [n for n in tree.subtree_ids(1)
+      if rank.get(n) == "genus" or n == 17]
+  values, offsets = tree.subtree_attribute_csr(8, "ranks")
+  assert values.tolist() == [r for v in tree.subtree_attribute_data(8, "ranks")
+                             if v for r in v]
+  # numeric columns can also be searched
+  tree.create_attribute("mod", ((n, n % 3) for n in nodes),
+                        column_kind="int")
+  assert np.array_equal(tree.subtree_nodes_with_attribute_value(17, "mod", 0),
+                        [n for n in tree.subtree_ids(17) if n % 3 == 0])
+  with pytest.raises(error.FastsubtreesError):
+    tree.attribute_categories("mod")
+
+def naive_aggregate(values):
+  n = len(values)
+  if n == 0:
+    return {"count": 0, "sum": 0, "min": None, "max": None, "mean": None,
+            "var": None, "std": None}
+  mean = sum(values) / n
+  var = sum((v - mean) ** 2 for v in values) / n
+  return {"count": n, "sum": sum(values), "min": min(values),
+          "max": max(values), "mean": mean, "var": var, "std": var ** 0.5}
+
+def assert_aggregates(result, expected):
+  assert result.keys() == expected.keys()
+  for op, value in expected.items():
+    assert result[op] == pytest.approx(value)
+
+@pytest.mark.parametrize("multivalued", [False, True])
+def test_subtree_aggregate(testdata, testout, multivalued):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_aggregate.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  values = {n: [(n * 37) % 101 - 50] for n in nodes if n % 6}
+  if multivalued:
+    for n in nodes[::5]:
+      values.setdefault(n, []).extend([n % 13, -n % 7])
+  tree.create_attribute("x", ((n, v) for n, vs in values.items() for v in vs),
+      column_kind="int", multivalued_column=multivalued)
+  tree.create_attribute("y", ((n, v) for n, vs in values.items() for v in vs))
+
+  def check(nodes):
+    for node in nodes:
+      expected = naive_aggregate([v for n in tree.subtree_ids(node)
+                                  for v in values.get(n, [])])
+      assert_aggregates(tree.subtree_aggregate(node, "x"), expected)
+      assert_aggregates(tree.subtree_aggregate(node, "y"), expected)
+  check([1, 8, 17, 566, 1000])
+  # the index is updated by the edit operations
+  tree.delete_subtree(566)
+  tree.move_subtree(8, 17)
+  tree.add_nodes(iter([(100000, 8)]))
+  tree.replace_attribute_values("x", {17: [1000]})
+  tree.replace_attribute_values("y", {17: [1000]})
+  values[17] = [1000]
+  check([1, 8, 17, 100000])
+  tree.compact()
+  check([1, 17])
+  assert tree.subtree_aggregate(100000, "x", ["count", "mean"]) == \
+      {"count": 0, "mean": None}
+  with pytest.raises(error.FastsubtreesError):
+    tree.subtree_aggregate(1, "x", ["median"])
+  tree.create_attribute("name", ((n, f"n{n}") for n in nodes))
+  with pytest.raises(error.FastsubtreesError):
+    tree.subtree_aggregate(1, "name")
+
+@pytest.mark.parametrize("kind", ["int", "float"])
+def test_subtree_aggregate_precision(testdata, testout, kind):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_aggregate_precision.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  # large values with a small variance, such as genome sizes
+  convert = int if kind == "int" else float
+  values = {n: convert(5 * 10**9 + (n * 37) % 101) for n in nodes}
+  tree.create_attribute("size", values.items(), column_kind=kind)
+  for node in [1, 8, 17]:
+    expected = naive_aggregate([values[n] for n in tree.subtree_ids(node)])
+    result = tree.subtree_aggregate(node, "size", ["var", "std"])
+    assert result["var"] == pytest.approx(expected["var"], rel=1e-6)
+    assert result["std"] == pytest.approx(expected["std"], rel=1e-6)
+
+def test_subtree_aggregate_exact_int_variance(testdata, testout):
+  pytest.importorskip("numpy")
+  tree = Tree.construct_from_tabular(testdata('medium_tree.tsv'))
+  tree.to_file(testout('medium_tree_aggregate_exact.tree'))
+  tree.destroy_all_attributes()
+  nodes = tree.subtree_ids(1).tolist()
+  # values spread around 1e10: the subtrees of single nodes have
+  # a mean far from the mean of all values
+  values = {n: (n * 2654435761) % 10**10 + 10**10 for n in nodes}
+  tree.create_attribute("size", values.items(), column_kind="int")
+  leaves = [n for n in nodes if tree.get_subtree_size(n) == 1]
+  for node in leaves[:50]:
+    assert tree.subtree_aggregate(node, "size", ["var", "std"]) == \
+        {"var": 0.0, "std": 0.0}
+  for node in [1, 8, 17]:
+    expected = naive_aggregate([values[n] for n in tree.subtree_ids(node)])
+    assert tree.subtree_aggregate(node, "size", ["var"])["var"] == \
+        pytest.approx(expected["var"], rel=1e-12)